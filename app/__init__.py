@@ -0,0 +1,3 @@
+from . import config
+
+config.load_env()
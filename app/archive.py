@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import case, func, insert, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+
+from . import database, models, versions
+
+try:
+    import zstandard
+except ImportError:  # optional, archives are written with zlib instead
+    zstandard = None
+
+# Versions older than VERSION_ARCHIVE_RETENTION_DAYS move to event_version_archive.
+# The latest version of every event always stays in event_versions.
+VERSION_ARCHIVE_RETENTION_DAYS = float(os.getenv("VERSION_ARCHIVE_RETENTION_DAYS", 365))
+# Seconds between archival runs in the app process, 0 leaves it to `python -m app.archive`
+VERSION_ARCHIVE_INTERVAL = float(os.getenv("VERSION_ARCHIVE_INTERVAL", 0))
+VERSION_PARTITIONS = int(os.getenv("VERSION_PARTITIONS", 16))
+# Advisory lock held for a whole run, so workers never archive the same versions twice
+ARCHIVE_LOCK_KEY = 72406132
+
+ZSTD_LEVEL = 10
+
+# =======================================================================================================================
+# Compression
+# =======================================================================================================================
+
+
+def compress(payload: dict):
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, 9)
+
+
+def decompress(codec: str, blob: bytes) -> dict:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archived version was written with zstd, install zstandard to read it")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = zlib.decompress(blob)
+    return json.loads(raw)
+
+# =======================================================================================================================
+# Archival
+# =======================================================================================================================
+
+
+def archive_event(db: Session, event_id: int, cutoff: datetime) -> int:
+    # Moves the versions written before `cutoff`, except the latest one. The
+    # first version left behind is rewritten as a snapshot, so the remaining
+    # history still reconstructs without the archived rows.
+    last_old, latest = db.query(
+        func.max(case((models.EventVersion.timestamp < cutoff, models.EventVersion.version_number))),
+        func.max(models.EventVersion.version_number)).filter(
+        models.EventVersion.event_id == event_id).one()
+    if last_old is None:
+        return 0
+    last_old = min(last_old, latest - 1)
+
+    history = db.query(models.EventVersion).filter(
+        models.EventVersion.event_id == event_id,
+        models.EventVersion.version_number <= last_old + 1).order_by(models.EventVersion.version_number).all()
+    *old, first_kept = history
+    if not old:
+        return 0
+
+    snapshot, archived = None, []
+    for version in history:
+        if version.kind != versions.DELTA:
+            snapshot = dict(versions.load(version.data))
+        elif snapshot is None:
+            snapshot = versions.reconstruct(db, version)
+        else:
+            snapshot.update(versions.load(version.data))
+
+        if version is first_kept:
+            if version.kind == versions.DELTA:
+                version.kind, version.data = versions.SNAPSHOT, versions.dump(snapshot)
+            continue
+        data = version.data if version.kind != versions.DELTA else versions.dump(snapshot)
+        codec, payload = compress({"data": data, "changes": version.changes})
+        archived.append({"id": version.id, "event_id": version.event_id, "version_number": version.version_number,
+                         "timestamp": version.timestamp, "codec": codec, "payload": payload})
+
+    db.execute(insert(models.EventVersionArchive), archived)
+    db.query(models.EventVersion).filter(models.EventVersion.id.in_([row["id"] for row in archived])).delete(
+        synchronize_session=False)
+    return len(archived)
+
+
+def archive_versions(db: Session, retention_days: float = VERSION_ARCHIVE_RETENTION_DAYS,
+                     now: Optional[datetime] = None, event_id: Optional[int] = None) -> int:
+    # One transaction per event, so an interrupted run leaves every history
+    # consistent. A run that finds another one in progress does nothing.
+    with database.advisory_lock(db.get_bind(), ARCHIVE_LOCK_KEY) as acquired:
+        if not acquired:
+            return 0
+        cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+        query = db.query(models.EventVersion.event_id).filter(
+            models.EventVersion.timestamp < cutoff, models.EventVersion.event_id.isnot(None)).distinct()
+        if event_id is not None:
+            query = query.filter(models.EventVersion.event_id == event_id)
+
+        moved = 0
+        for (current_event_id,) in query.all():
+            moved += archive_event(db, current_event_id, cutoff)
+            db.commit()
+        return moved
+
+
+def fetch(db: Session, event_id: int, version_id: int):
+    # The same shape get_event_version returns for versions that are still hot
+    row = db.query(models.EventVersionArchive).filter_by(event_id=event_id, id=version_id).first()
+    if row is None:
+        return None
+    return {
+        "version_id": row.id,
+        "event_id": row.event_id,
+        "data": decompress(row.codec, row.payload)["data"],
+        "timestamp": row.timestamp
+    }
+
+
+def changelog(db: Session, event_id: int, limit: Optional[int] = None, before: Optional[int] = None,
+              above: Optional[int] = None):
+    # Archived changelog entries, newest first, in the shape versions.changelog returns
+    query = db.query(models.EventVersionArchive).filter(models.EventVersionArchive.event_id == event_id)
+    if before is not None:
+        query = query.filter(models.EventVersionArchive.version_number < before)
+    if above is not None:
+        query = query.filter(models.EventVersionArchive.version_number > above)
+    query = query.order_by(models.EventVersionArchive.version_number.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return [{"version_id": row.id, "version_number": row.version_number, "timestamp": row.timestamp,
+             "changes": decompress(row.codec, row.payload)["changes"]} for row in query.all()]
+
+
+def latest(db: Session, event_id: int):
+    # (version_number, snapshot) of the newest archived version, or (0, None)
+    row = db.query(models.EventVersionArchive).filter_by(event_id=event_id).order_by(
+        models.EventVersionArchive.version_number.desc()).first()
+    if row is None:
+        return 0, None
+    return row.version_number, versions.load(decompress(row.codec, row.payload)["data"])
+
+# =======================================================================================================================
+# Partitioning
+# =======================================================================================================================
+
+
+def partition_statements(partitions: int = VERSION_PARTITIONS):
+    # Rebuilds event_versions as a table hash partitioned by event_id. Postgres
+    # cannot enforce a primary key on id alone across partitions, so id keeps
+    # its sequence and a plain index, and the ORM goes on treating it as the key.
+    from sqlalchemy.dialects import postgresql
+
+    dialect = postgresql.dialect()
+    statements = [
+        "LOCK TABLE event_versions IN ACCESS EXCLUSIVE MODE",
+        "ALTER SEQUENCE event_versions_id_seq OWNED BY NONE",
+        "CREATE TABLE event_versions_partitioned (LIKE event_versions INCLUDING DEFAULTS) "
+        "PARTITION BY HASH (event_id)",
+    ]
+    statements += [f"CREATE TABLE event_versions_p{remainder} PARTITION OF event_versions_partitioned "
+                   f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+                   for remainder in range(partitions)]
+    statements += [
+        "INSERT INTO event_versions_partitioned SELECT * FROM event_versions",
+        "DROP TABLE event_versions",
+        "ALTER TABLE event_versions_partitioned RENAME TO event_versions",
+        "ALTER SEQUENCE event_versions_id_seq OWNED BY event_versions.id",
+        "ALTER TABLE event_versions ADD FOREIGN KEY (event_id) REFERENCES events (id)",
+    ]
+    statements += [str(CreateIndex(index).compile(dialect=dialect))
+                   for index in sorted(models.EventVersion.__table__.indexes, key=lambda index: index.name)]
+    return statements
+
+
+def partition_versions(engine, partitions: int = VERSION_PARTITIONS) -> bool:
+    if engine.dialect.name != "postgresql":
+        raise ValueError("Partitioning event_versions needs PostgreSQL")
+    with engine.begin() as conn:
+        partitioned = conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass('event_versions'))")).scalar()
+        if partitioned:
+            return False
+        for statement in partition_statements(partitions):
+            conn.execute(text(statement))
+    return True
+
+
+def main():
+    from .database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Archive old event versions, or partition event_versions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive = commands.add_parser("archive", help="move versions past the retention window to the archive")
+    archive.add_argument("--retention-days", type=float, default=VERSION_ARCHIVE_RETENTION_DAYS)
+    archive.add_argument("--event-id", type=int, default=None)
+    partition = commands.add_parser("partition", help="hash partition event_versions by event_id (PostgreSQL)")
+    partition.add_argument("--partitions", type=int, default=VERSION_PARTITIONS)
+    partition.add_argument("--dry-run", action="store_true", help="print the DDL instead of running it")
+    args = parser.parse_args()
+
+    if args.command == "partition":
+        if args.dry_run:
+            print(";\n".join(partition_statements(args.partitions)) + ";")
+        elif partition_versions(engine, args.partitions):
+            print(f"Partitioned event_versions into {args.partitions} partitions")
+        else:
+            print("event_versions is already partitioned")
+        return
+
+    db = SessionLocal()
+    try:
+        count = archive_versions(db, retention_days=args.retention_days, event_id=args.event_id)
+    finally:
+        db.close()
+    print(f"Archived {count} version(s)")
+
+
+if __name__ == "__main__":
+    main()
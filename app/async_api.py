@@ -0,0 +1,109 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
+
+from . import auth, schemas, database, etags, events, instrumentation, serialization
+
+# Async counterparts of the core routes, served when DB_MODE=async. Each one
+# awaits the existing sync logic through AsyncSession.run_sync, so database I/O
+# goes through the async driver without holding a threadpool slot.
+# Register and login are already async in app.main and await the app.hashing
+# process pool. Event ids use the int convertor so that fixed paths
+# such as /api/events/export still fall through to the sync routes.
+router = APIRouter(route_class=instrumentation.TrackedRoute)
+
+
+def _event_out(event):
+    return schemas.EventOut.model_validate(event)
+
+
+def _bearer_token(request: Request):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid token")
+    return auth_header.split(" ")[1]
+
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    return await db.run_sync(lambda session: events.get_current_user(request, session))
+
+# =======================================================================================================================
+# Authentcation APIs
+# =======================================================================================================================
+
+
+@router.post("/api/auth/refresh", response_model=schemas.Token, tags=["Auth"])
+async def refresh(request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    refresh_token = _bearer_token(request)
+    return await db.run_sync(lambda session: auth.refresh_user_token(refresh_token, session))
+
+
+@router.post("/api/auth/logout", tags=["Auth"])
+async def logout(request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    refresh_token = _bearer_token(request)
+    return await db.run_sync(lambda session: auth.logout_user(refresh_token, session))
+
+# =======================================================================================================================
+# Events Main APIs
+# =======================================================================================================================
+
+
+@router.post("/api/events", response_model=schemas.EventOut, tags=["Events"])
+async def create_event(event: schemas.EventCreate, check_conflicts: bool = False,
+                       db: AsyncSession = Depends(database.get_async_db), current_user=Depends(get_current_user)):
+    return await db.run_sync(lambda session: _event_out(
+        events.create_event_logic(event=event, db=session, current_user=current_user,
+                                  check_conflicts=check_conflicts)))
+
+
+@router.get("/api/events", response_model=List[schemas.EventOut], tags=["Events"])
+async def list_events(skip: int = 0, limit: int = Query(10, ge=0), cursor: Optional[str] = None,
+                      start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      location: Optional[str] = None, role: Optional[schemas.RoleEnum] = None,
+                      db: AsyncSession = Depends(database.get_async_db), current_user=Depends(get_current_user)):
+    body, next_cursor = await db.run_sync(lambda session: events.list_events_json(
+        skip=skip, limit=limit, db=session, current_user=current_user, cursor=cursor, start=start, end=end,
+        location=location, role=role.value if role else None))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.get("/api/events/{event_id:int}", response_model=schemas.EventOut, tags=["Events"])
+async def get_event(event_id: int, if_none_match: Optional[str] = Header(None),
+                    db: AsyncSession = Depends(database.get_async_db), current_user=Depends(get_current_user)):
+    etag, body = await db.run_sync(lambda session: events.get_event_body(
+        event_id=event_id, db=session, current_user=current_user))
+    return etags.respond(body, etag, if_none_match)
+
+
+@router.put("/api/events/{event_id:int}", response_model=schemas.EventOut, tags=["Events"])
+async def update_event(event_id: int, event_data: schemas.EventCreate, response: Response,
+                       if_match: Optional[str] = Header(None),
+                       db: AsyncSession = Depends(database.get_async_db), current_user=Depends(get_current_user)):
+    def run(session):
+        event = events.update_event_logic(event_id=event_id, event_data=event_data, db=session,
+                                          current_user=current_user, if_match=if_match)
+        return _event_out(event), etags.revision_etag(event["id"], event["revision"])
+
+    event, response.headers["ETag"] = await db.run_sync(run)
+    return event
+
+
+@router.delete("/api/events/{event_id:int}", tags=["Events"])
+async def delete_event(event_id: int, db: AsyncSession = Depends(database.get_async_db),
+                       current_user=Depends(get_current_user)):
+    return await db.run_sync(lambda session: events.delete_event_logic(
+        event_id=event_id, db=session, current_user=current_user))
+
+
+@router.post("/api/events/batch", response_model=List[schemas.EventOut], tags=["Events"])
+async def create_batch_events(events_list: List[schemas.EventCreate],
+                              chunk_size: int = Query(events.BATCH_CHUNK_SIZE, ge=1), check_conflicts: bool = False,
+                              db: AsyncSession = Depends(database.get_async_db),
+                              current_user=Depends(get_current_user)):
+    created = await db.run_sync(lambda session: events.create_batch_events_logic(
+        events=events_list, db=session, current_user=current_user, chunk_size=chunk_size,
+        check_conflicts=check_conflicts))
+    return Response(serialization.dump_events(created), media_type="application/json")
@@ -1,34 +1,61 @@
 from fastapi import HTTPException
+from sqlalchemy import delete, select, update
 from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
 
-from . import models, token_utils
+from . import database, hashing, instrumentation, models, token_utils, user_cache
 from .schemas import UserCreate
 
+# Advisory lock of the refresh token sweep, next to app.migrate's and app.archive's
+TOKEN_SWEEP_LOCK_KEY = 72406133
 
-def register_user(user: UserCreate, db: Session):
-    if db.query(models.User).filter(models.User.username == user.username).first():
+
+# Register and login are async: the database work takes a threadpool slot for
+# a moment, while the bcrypt work is awaited on the app.hashing pool, so a login
+# storm cannot starve the other sync routes of threads.
+async def register_user(user: UserCreate, db: Session):
+    if await instrumentation.run_in_threadpool(_find_user, user.username, db):
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    hashed_pw = token_utils.hash_password(user.password)
-    new_user = models.User(username=user.username, hashed_password=hashed_pw)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    hashed_pw = await hashing.hash_password_async(user.password)
+    await instrumentation.run_in_threadpool(_add_user, user.username, hashed_pw, db)
     return {"msg": "User registered"}
 
 
-def login_user(username: str, password: str, db: Session):
-    user = db.query(models.User).filter(
-        models.User.username == username).first()
-    if not user or not token_utils.verify_password(password, user.hashed_password):
+async def login_user(username: str, password: str, db: Session):
+    user = await instrumentation.run_in_threadpool(_find_user, username, db)
+    if not user or not await hashing.verify_password_async(password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    access_token = token_utils.create_token({"sub": user.username}, token_utils.ACCESS_EXPIRE_MIN,
+    # Upgrade hashes made with a different bcrypt cost while we have the plain password
+    new_hash = None
+    if hashing.needs_rehash(user.hashed_password):
+        new_hash = await hashing.hash_password_async(password)
+    return await instrumentation.run_in_threadpool(_issue_tokens, user, new_hash, db)
+
+
+def _find_user(username: str, db: Session):
+    return db.query(models.User).filter(models.User.username == username).first()
+
+
+def _add_user(username: str, hashed_password: str, db: Session):
+    db.add(models.User(username=username, hashed_password=hashed_password))
+    db.commit()
+
+
+def _issue_tokens(user: models.User, new_hash, db: Session):
+    if new_hash:
+        user.hashed_password = new_hash
+
+    # Tokens issued for this login share a session id so logout can revoke them together
+    claims = {"sub": user.username, "sid": token_utils.new_session_id()}
+    access_token = token_utils.create_token(claims, token_utils.ACCESS_EXPIRE_MIN,
                                             token_utils.SECRET_KEY)
-    refresh_token = token_utils.create_token({"sub": user.username}, token_utils.REFRESH_EXPIRE_MIN,
+    refresh_token = token_utils.create_token(claims, token_utils.REFRESH_EXPIRE_MIN,
                                              token_utils.REFRESH_SECRET_KEY)
 
-    db_token = models.RefreshToken(token=refresh_token, user_id=user.id)
+    db_token = models.RefreshToken(token_hash=token_utils.token_digest(refresh_token), user_id=user.id,
+                                   expires_at=_refresh_expiry())
     db.add(db_token)
     db.commit()
 
@@ -39,6 +66,10 @@ def login_user(username: str, password: str, db: Session):
     }
 
 
+def _refresh_expiry():
+    return datetime.utcnow() + timedelta(minutes=token_utils.REFRESH_EXPIRE_MIN)
+
+
 def refresh_user_token(refresh_token: str, db: Session):
     payload = token_utils.decode_token(
         refresh_token, token_utils.REFRESH_SECRET_KEY)
@@ -46,28 +77,31 @@ def refresh_user_token(refresh_token: str, db: Session):
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
     username = payload.get("sub")
-    user = db.query(models.User).filter(
-        models.User.username == username).first()
+    user = user_cache.get_user(username, db)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    stored_token = db.query(models.RefreshToken).filter(models.RefreshToken.token == refresh_token,
-                                                        models.RefreshToken.user_id == user.id).first()
-    if not stored_token:
+    claims = {"sub": user.username, "sid": payload.get("sid") or token_utils.new_session_id()}
+    new_refresh_token = token_utils.create_token(claims, token_utils.REFRESH_EXPIRE_MIN,
+                                                 token_utils.REFRESH_SECRET_KEY)
+
+    # Rotate in place: a single UPDATE swaps the stored digest, so a token
+    # can only ever be redeemed once even by concurrent requests
+    now = datetime.utcnow()
+    rotated = db.execute(update(models.RefreshToken).where(
+        models.RefreshToken.token_hash == token_utils.token_digest(refresh_token),
+        models.RefreshToken.user_id == user.id,
+        models.RefreshToken.expires_at > now).values(
+        token_hash=token_utils.token_digest(new_refresh_token), created_at=now,
+        expires_at=_refresh_expiry()))
+    if rotated.rowcount != 1:
+        db.rollback()
         raise HTTPException(
             status_code=401, detail="Refresh token expired or already used")
-
-    # Rotate token: delete old, issue new
-    db.delete(stored_token)
-    db.commit()
-
-    new_refresh_token = token_utils.create_token({"sub": user.username}, token_utils.REFRESH_EXPIRE_MIN,
-                                                 token_utils.REFRESH_SECRET_KEY)
-    db.add(models.RefreshToken(token=new_refresh_token, user_id=user.id))
     db.commit()
 
     access_token = token_utils.create_token(
-        {"sub": user.username}, token_utils.ACCESS_EXPIRE_MIN, token_utils.SECRET_KEY)
+        claims, token_utils.ACCESS_EXPIRE_MIN, token_utils.SECRET_KEY)
     return {
         "access_token": access_token,
         "refresh_token": new_refresh_token,
@@ -76,11 +110,36 @@ def refresh_user_token(refresh_token: str, db: Session):
 
 
 def logout_user(refresh_token: str, db: Session):
-    stored_token = db.query(models.RefreshToken).filter(
-        models.RefreshToken.token == refresh_token).first()
-    if not stored_token:
+    deleted = db.execute(delete(models.RefreshToken).where(
+        models.RefreshToken.token_hash == token_utils.token_digest(refresh_token)))
+    if not deleted.rowcount:
+        db.rollback()
         raise HTTPException(
             status_code=400, detail="Token already invalidated or not found")
-    db.delete(stored_token)
     db.commit()
+
+    payload = token_utils.decode_token(
+        refresh_token, token_utils.REFRESH_SECRET_KEY)
+    if payload:
+        token_utils.revoke_session(payload.get("sid"))
+        user_cache.invalidate(payload.get("sub"))
     return {"msg": "Logged out"}
+
+
+def sweep_expired_tokens(db: Session, batch_size: int = 1000):
+    # Deletes in bounded batches so the sweep never holds long locks. Every
+    # worker schedules it, the advisory lock lets one of them run at a time.
+    with database.advisory_lock(db.get_bind(), TOKEN_SWEEP_LOCK_KEY) as acquired:
+        if not acquired:
+            return 0
+        swept = 0
+        while True:
+            expired = select(models.RefreshToken.id).where(
+                models.RefreshToken.expires_at <= datetime.utcnow()).limit(batch_size)
+            deleted = db.execute(delete(models.RefreshToken).where(
+                models.RefreshToken.id.in_(expired.scalar_subquery())),
+                execution_options={"synchronize_session": False})
+            db.commit()
+            swept += deleted.rowcount
+            if deleted.rowcount < batch_size:
+                return swept
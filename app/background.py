@@ -0,0 +1,35 @@
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import logging
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+
+async def run_periodically(interval: float, job, *args):
+    # Runs a sync job(db, *args) on a fresh session every `interval` seconds until cancelled
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(_run_with_session, job, *args)
+        except Exception:
+            logger.exception("Background job %s failed", job.__name__)
+
+
+def _run_with_session(job, *args):
+    db = database.SessionLocal()
+    try:
+        return job(db, *args)
+    finally:
+        db.close()
+
+
+def start(interval: float, job, *args):
+    return asyncio.create_task(run_periodically(interval, job, *args))
+
+
+async def stop(*tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
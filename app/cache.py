@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+
+# Caches registered with publish_stats() are published on /internal/metrics
+_caches = {}
+
+
+def publish_stats(name: str, stats):
+    # `stats` returns the cache's stats() dict, read on every scrape
+    _caches[name] = stats
+
+
+def _cache_samples(field: str):
+    def read():
+        samples = {}
+        for name, stats in list(_caches.items()):
+            values = stats()
+            if field in values:
+                samples[(name,)] = values[field]
+        return samples
+    return read
+
+
+metrics.Counter("cache_hits_total", "Lookups answered from the cache", ["cache"], callback=_cache_samples("hits"))
+metrics.Counter("cache_misses_total", "Lookups the cache could not answer", ["cache"],
+                callback=_cache_samples("misses"))
+metrics.Counter("cache_evictions_total", "Entries dropped to stay within the cache's maxsize", ["cache"],
+                callback=_cache_samples("evictions"))
+metrics.Gauge("cache_entries", "Entries currently held by the cache", ["cache"], callback=_cache_samples("size"))
+
+
+class TTLCache:
+    """In-process LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SharedCache:
+    """Cache backed by a shared key/value store so that every worker sees the same entries.
+
+    `client` only needs `get(key)`, `set(key, value, ex=seconds)` and `delete(key)`,
+    which is the subset of the redis-py client used here. Values are stored as JSON.
+    """
+
+    def __init__(self, client, prefix: str = "", ttl: float = 60.0):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        raw = self.client.get(self.prefix + str(key))
+        if raw is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl: float = None):
+        self.client.set(self.prefix + str(key), json.dumps(value),
+                        ex=max(1, int(self.ttl if ttl is None else ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + str(key))
+
+    def clear(self):
+        # Entries of a shared store expire on their own, there is nothing local to drop.
+        pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,13 @@
+_loaded = False
+
+
+def load_env():
+    # The one place .env is read, from app/__init__ so that it happens before
+    # any module reads its settings. Variables already set in the environment win.
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    from dotenv import load_dotenv
+
+    load_dotenv()
@@ -1,20 +1,120 @@
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from contextlib import contextmanager
 import os
 
-load_dotenv()
+from . import pool
 
 database_url = os.getenv("DATABASE_URL")
+# "sync" serves every route from the threadpool, "async" serves the core
+# routes from app.async_api on an AsyncEngine
+DB_MODE = os.getenv("DB_MODE", "sync")
 
-engine = create_engine(database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# The engine, and with it the driver, is created on first use rather than at
+# import, so workers and tools that never touch the database start faster
+_engine = None
+_SessionLocal = None
+
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+_async_engine = None
+_AsyncSessionLocal = None
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = pool.register(create_engine(
+            database_url, **pool.engine_options(database_url)), "sync")
+    return _engine
+
+
+def get_sessionmaker():
+    global _SessionLocal
+    if _SessionLocal is None:
+        _SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+    return _SessionLocal
+
+
+def __getattr__(name):
+    # database.engine and database.SessionLocal keep working for existing callers
+    if name == "engine":
+        return get_engine()
+    if name == "SessionLocal":
+        return get_sessionmaker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def get_db():
-    db = SessionLocal()
+    db = get_sessionmaker()()
     try:
         yield db
     finally:
         db.close()
+
+
+@contextmanager
+def advisory_lock(bind, key: int):
+    # Yields whether this process got the Postgres session lock `key`, so a job
+    # that every worker schedules runs in one of them at a time. Other databases
+    # have no advisory locks and always get it.
+    if bind.dialect.name != "postgresql":
+        yield True
+        return
+    with bind.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+                conn.commit()
+
+
+def async_database_url(url: str):
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if not driver:
+        raise ValueError(f"No async driver configured for {url.get_backend_name()}")
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}")
+
+
+def get_async_sessionmaker():
+    global _async_engine, _AsyncSessionLocal
+    if _AsyncSessionLocal is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = async_database_url(database_url)
+        _async_engine = create_async_engine(
+            url, **pool.engine_options(url, is_async=True))
+        pool.register(_async_engine.sync_engine, "async")
+        # Objects are serialized after the handler returns, outside the
+        # greenlet that is allowed to lazy-load, so keep them loaded on commit
+        _AsyncSessionLocal = async_sessionmaker(
+            _async_engine, autoflush=False, expire_on_commit=False)
+    return _AsyncSessionLocal
+
+
+def get_async_engine():
+    get_async_sessionmaker()
+    return _async_engine
+
+
+async def dispose():
+    # Closes pooled connections on shutdown instead of leaving them to the server's idle timeout
+    if _engine is not None:
+        _engine.dispose()
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
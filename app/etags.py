@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+from . import instrumentation, invalidation
+from .cache import TTLCache, publish_stats
+
+# Serialized response bodies. Event bodies are keyed by revision, so an edit
+# never needs to invalidate anything: the old key simply stops being asked for.
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+RESPONSE_CACHE_MAXSIZE = int(os.getenv("RESPONSE_CACHE_MAXSIZE", 10000))
+
+_responses = TTLCache(maxsize=RESPONSE_CACHE_MAXSIZE, ttl=RESPONSE_CACHE_TTL)
+
+
+def revision_etag(event_id: int, revision: int) -> str:
+    return f'"{event_id}-{revision}"'
+
+
+def content_etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def _tags(header: str):
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def none_match(header: Optional[str], etag: str) -> bool:
+    # If-None-Match uses the weak comparison
+    if not header:
+        return False
+    tags = _tags(header)
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def match(header: Optional[str], etag: str) -> bool:
+    # If-Match uses the strong comparison, weak tags never match
+    if header is None:
+        return True
+    tags = _tags(header)
+    return "*" in tags or etag in tags
+
+
+def dump(payload) -> bytes:
+    # Same bytes as FastAPI's JSONResponse
+    with instrumentation.timed_serialization():
+        return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None,
+                          separators=(",", ":")).encode("utf-8")
+
+
+def get_cached(key) -> Optional[bytes]:
+    return _responses.get(key)
+
+
+def cache(key, body: bytes) -> bytes:
+    _responses.set(key, body)
+    return body
+
+
+def invalidate_event(event_id: int):
+    # Only needed on delete, where SQLite may hand the same id to the next event
+    invalidation.broadcast("responses.event", event_id)
+
+
+@invalidation.handler("responses.event")
+def _forget_event(event_id: int):
+    _responses.delete_matching(lambda key: key[1] == event_id)
+
+
+@invalidation.on_reset
+def clear_cache():
+    _responses.clear()
+
+
+def cache_stats():
+    return _responses.stats()
+
+
+publish_stats("responses", cache_stats)
+
+
+def respond(body: bytes, etag: str, if_none_match: Optional[str] = None) -> Response:
+    if none_match(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
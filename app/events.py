@@ -1,11 +1,34 @@
-from typing import List
+from typing import AsyncIterator, List, Optional
 from fastapi import HTTPException, status, Request, Depends
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from sqlalchemy import delete, insert, select, tuple_, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, defer
 from datetime import datetime
+import base64
+import importlib
 import json
+import os
 
-from . import models, schemas, database
-from .token_utils import decode_token, SECRET_KEY
+from . import (models, schemas, database, archive, etags, instrumentation, notifications, permissions, recurrence,
+               scheduling, serialization, user_cache, versions)
+from .token_utils import verify_access_token
+
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 500))
+PERMISSION_CHUNK_SIZE = 1000
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", 1000))
+IMPORT_MAX_ERRORS = 100
+# Longer import lines are reported as failed without being buffered
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", 64 * 1024))
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+EVENT_OUT_COLUMNS = (
+    models.Event.id, models.Event.title, models.Event.description, models.Event.start_time,
+    models.Event.end_time, models.Event.location, models.Event.is_recurring,
+    models.Event.recurrence_pattern, models.Event.owner_id,
+)
 
 # =======================================================================================================================
 # Events Main
@@ -19,165 +42,511 @@ def get_current_user(request: Request, db: Session = Depends(database.get_db)):
                             detail="Invalid authorization header")
 
     token = auth_header.split(" ")[1]
-    payload = decode_token(token, SECRET_KEY)
+    payload = verify_access_token(token)
     if not payload:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    user = db.query(models.User).filter(
-        models.User.username == payload.get("sub")).first()
+    user = user_cache.get_user(payload.get("sub"), db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return user
 
 
-def create_event_logic(event: schemas.EventCreate, db: Session, current_user: models.User):
-    new_event = models.Event(**event.dict(), owner_id=current_user.id)
-    db.add(new_event)
-    db.commit()
-    db.refresh(new_event)
-
-    # Add event permission for owner
-    permission = models.EventPermission(
-        event_id=new_event.id, user_id=current_user.id, role="Owner")
-    db.add(permission)
-    db.commit()
+def create_event_logic(event: schemas.EventCreate, db: Session, current_user: models.User,
+                       check_conflicts: bool = False):
+    if check_conflicts:
+        scheduling.ensure_no_conflicts(scheduling.batch_conflicts(db, current_user.id, [event]))
 
-    # Create initial version
-    version = models.EventVersion(
-        event_id=new_event.id, data=event.json(), timestamp=datetime.utcnow())
-    db.add(version)
+    # Event, owner permission, initial version and occurrences in one transaction.
+    # The id comes back from INSERT ... RETURNING, so nothing is re-read after commit.
+    new_event, = _bulk_insert_events([event], db, current_user.id)
     db.commit()
 
+    notifications.notify(db, "created", new_event["id"], new_event, [current_user.id])
     return new_event
 
 
-def list_events_logic(skip: int, limit: int, db: Session, current_user: models.User):
-    permissions = db.query(models.EventPermission).filter(
-        models.EventPermission.user_id == current_user.id).all()
-    event_ids = [p.event_id for p in permissions]
-    return db.query(models.Event).filter(models.Event.id.in_(event_ids)).offset(skip).limit(limit).all()
+def _encode_cursor(event: models.Event):
+    raw = json.dumps([event.start_time.isoformat(), event.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
 
-def get_event_logic(event_id: int, db: Session, current_user: models.User):
-    permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=current_user.id).first()
-    if not permission:
+def _decode_cursor(cursor: str):
+    try:
+        start_time, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(start_time), int(event_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def list_events_logic(skip: int, limit: int, db: Session, current_user: models.User, cursor: Optional[str] = None,
+                      start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      location: Optional[str] = None, role: Optional[str] = None, columns: tuple = (models.Event,)):
+    query = db.query(*columns).select_from(models.Event).filter(permissions.can_access(current_user.id, role=role))
+
+    if location:
+        query = query.filter(models.Event.location == location)
+    if start:
+        query = query.filter(models.Event.end_time >= start)
+    if end:
+        query = query.filter(models.Event.start_time <= end)
+
+    query = query.order_by(models.Event.start_time, models.Event.id)
+    if cursor:
+        query = query.filter(tuple_(models.Event.start_time, models.Event.id) > _decode_cursor(cursor))
+    elif skip:
+        query = query.offset(skip)
+
+    # Fetch one extra row to know whether there is a next page
+    page = query.limit(limit + 1).all()
+    next_cursor = _encode_cursor(page[limit - 1]) if len(page) > limit and limit > 0 else None
+    return page[:limit], next_cursor
+
+
+def list_events_json(db: Session, current_user: models.User, **filters):
+    # Same page as list_events_logic, but selects only the EventOut columns and
+    # serializes the row tuples directly instead of validating ORM objects
+    page, next_cursor = list_events_logic(db=db, current_user=current_user, columns=EVENT_OUT_COLUMNS, **filters)
+    return serialization.dump_events(row._mapping for row in page), next_cursor
+
+
+def get_event_body(event_id: int, db: Session, current_user: models.User):
+    # (etag, serialized EventOut). Hits cost a role lookup and a revision
+    # lookup, without loading the ORM object or running Pydantic.
+    if not permissions.get_role(db, event_id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
-    event = db.query(models.Event).filter_by(id=event_id).first()
-    if not event:
+    revision = db.scalar(select(models.Event.revision).where(models.Event.id == event_id))
+    if revision is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Event not found")
-    return event
 
+    body = etags.get_cached(("event", event_id, revision))
+    if body is None:
+        event = db.get(models.Event, event_id)
+        revision = event.revision
+        with instrumentation.timed_serialization():
+            body = schemas.EventOut.model_validate(event).model_dump_json().encode()
+        etags.cache(("event", event_id, revision), body)
+    return etags.revision_etag(event_id, revision), body
 
-def update_event_logic(event_id: int, event_data: schemas.EventCreate, db: Session, current_user: models.User):
-    permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=current_user.id).first()
-    if not permission or permission.role not in ["Owner", "Editor"]:
+
+def update_event_logic(event_id: int, event_data: schemas.EventCreate, db: Session, current_user: models.User,
+                       if_match: Optional[str] = None):
+    role, event = permissions.get_event_with_role(db, event_id, current_user.id)
+    if role not in ["Owner", "Editor"]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Insufficient permissions")
 
-    event = db.query(models.Event).filter_by(id=event_id).first()
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Event not found")
+    if not etags.match(if_match, etags.revision_etag(event.id, event.revision)):
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail="Event has been modified")
 
-    for field, value in event_data.dict().items():
-        setattr(event, field, value)
+    previous = versions.event_snapshot(event)
+    updated = _write_event(db, event, event_data)
+    versions.add_version(db, event_id, event_data.model_dump(mode="json"), previous)
     db.commit()
-    db.refresh(event)
 
-    # Create version
-    version = models.EventVersion(
-        event_id=event_id, data=event_data.json(), timestamp=datetime.utcnow())
-    db.add(version)
-    db.commit()
+    notifications.notify(db, "updated", event_id, updated)
+    return updated
+
+
+def _write_event(db: Session, event: models.Event, data: schemas.EventCreate):
+    # One UPDATE guarded by the revision that was read, so a concurrent writer
+    # makes it match no row. Dialects with UPDATE ... RETURNING hand back the
+    # stored row in the same round trip instead of a refresh after commit.
+    planned, covered_from, covered_until = recurrence.plan(
+        data.start_time, data.end_time, recurrence.rule_for(data))
+    values = {**data.model_dump(), "occurrences_from": covered_from, "occurrences_until": covered_until,
+              "revision": event.revision + 1}
+    stmt = update(models.Event).where(
+        models.Event.id == event.id, models.Event.revision == event.revision).values(**values)
+    options = {"synchronize_session": False}
+
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(stmt.returning(*EVENT_OUT_COLUMNS, models.Event.revision), execution_options=options).first()
+        row = row and dict(row._mapping)
+    else:
+        matched = db.execute(stmt, execution_options=options).rowcount
+        row = matched and {**values, "id": event.id, "owner_id": event.owner_id}
+    if not row:
+        # Someone else updated the event between our read and our write
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail="Event has been modified")
 
-    return event
+    recurrence.clear(db, event.id)
+    if planned:
+        db.execute(insert(models.EventOccurrence), recurrence.occurrence_rows(event.id, planned))
+    return row
 
 
 def delete_event_logic(event_id: int, db: Session, current_user: models.User):
-    permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=current_user.id).first()
-    if not permission or permission.role != "Owner":
+    role, event = permissions.get_event_with_role(db, event_id, current_user.id)
+    if role != "Owner":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Only owner can delete the event")
 
-    event = db.query(models.Event).filter_by(id=event_id).first()
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Event not found")
 
-    db.delete(event)
+    audience = permissions.event_audience(db, event_id) if notifications.has_listeners() else []
+    recurrence.clear(db, event_id)
+    db.query(models.EventGroupPermission).filter_by(event_id=event_id).delete(synchronize_session=False)
+    # What db.delete(event) did, without loading both collections first: the
+    # permissions and versions are detached from the event, then the row goes
+    for child in (models.EventPermission, models.EventVersion):
+        db.execute(update(child).where(child.event_id == event_id).values(event_id=None),
+                   execution_options={"synchronize_session": False})
+    db.execute(delete(models.Event).where(models.Event.id == event_id),
+               execution_options={"synchronize_session": False})
     db.commit()
+    permissions.invalidate_event(event_id)
+    etags.invalidate_event(event_id)
+    notifications.notify(db, "deleted", event_id, audience=audience)
     return {"msg": "Event deleted successfully"}
 
 
-def create_batch_events_logic(events: List[schemas.EventCreate], db: Session, current_user: models.User):
-    new_events = []
+def _chunked(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+
+def _bulk_insert_events(events: List[schemas.EventCreate], db: Session, owner_id: int):
+    # One INSERT ... RETURNING for the events, then one statement each for the
+    # owner permissions and the initial versions. The caller owns the transaction.
+    rows, occurrences = [], []
     for event in events:
-        new_event = models.Event(**event.dict(), owner_id=current_user.id)
-        db.add(new_event)
+        planned, covered_from, covered_until = recurrence.plan(
+            event.start_time, event.end_time, recurrence.rule_for(event))
+        rows.append({**event.model_dump(), "owner_id": owner_id,
+                     "occurrences_from": covered_from, "occurrences_until": covered_until})
+        occurrences.append(planned)
+
+    ids = db.execute(
+        insert(models.Event).returning(
+            models.Event.id, sort_by_parameter_order=True),
+        rows).scalars().all()
+
+    now = datetime.utcnow()
+    db.execute(insert(models.EventPermission), [
+        {"event_id": event_id, "user_id": owner_id, "role": "Owner"} for event_id in ids])
+    db.execute(insert(models.EventVersion), [
+        versions.initial_version_row(event_id, event.model_dump(mode="json"), now)
+        for event_id, event in zip(ids, events)])
+    occurrence_rows = [row for event_id, planned in zip(ids, occurrences)
+                       for row in recurrence.occurrence_rows(event_id, planned)]
+    if occurrence_rows:
+        db.execute(insert(models.EventOccurrence), occurrence_rows)
+
+    return [{**row, "id": event_id} for row, event_id in zip(rows, ids)]
+
+
+def create_batch_events_logic(events: List[schemas.EventCreate], db: Session, current_user: models.User,
+                              chunk_size: int = BATCH_CHUNK_SIZE, check_conflicts: bool = False):
+    if check_conflicts:
+        scheduling.ensure_no_conflicts(scheduling.batch_conflicts(db, current_user.id, events))
+
+    new_events = []
+    try:
+        for _, chunk in _chunked(events, chunk_size):
+            new_events.extend(_bulk_insert_events(chunk, db, current_user.id))
         db.commit()
-        db.refresh(new_event)
+    except SQLAlchemyError:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Batch insert failed, no events were created")
+    for event in new_events:
+        notifications.notify(db, "created", event["id"], event, [current_user.id])
+    return new_events
+
+
+def create_batch_events_report_logic(events: List[schemas.EventCreate], db: Session, current_user: models.User,
+                                     chunk_size: int = BATCH_CHUNK_SIZE):
+    results = []
+    for start, chunk in _chunked(events, chunk_size):
+        savepoint = db.begin_nested()
+        try:
+            created = _bulk_insert_events(chunk, db, current_user.id)
+            savepoint.commit()
+        except SQLAlchemyError:
+            savepoint.rollback()
+            created = None
+
+        if created is not None:
+            results.extend({"index": start + i, "ok": True, "event": event}
+                           for i, event in enumerate(created))
+            continue
+
+        # The chunk failed as a whole, retry its items one by one to isolate the bad ones
+        for i, event in enumerate(chunk):
+            savepoint = db.begin_nested()
+            try:
+                created = _bulk_insert_events([event], db, current_user.id)
+                savepoint.commit()
+                results.append(
+                    {"index": start + i, "ok": True, "event": created[0]})
+            except SQLAlchemyError as exc:
+                savepoint.rollback()
+                results.append({"index": start + i, "ok": False,
+                                "error": str(exc.orig or exc)})
+    db.commit()
+    for result in results:
+        if result["ok"]:
+            notifications.notify(db, "created", result["event"]["id"], result["event"], [current_user.id])
+    return results
+
+
+def list_occurrences_logic(start: datetime, end: datetime, db: Session, current_user: models.User):
+    if end <= start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="end must be after start")
+    return recurrence.query_window(db, current_user.id, start, end)
+
+
+def check_conflicts_logic(time_range: schemas.TimeRange, db: Session, current_user: models.User):
+    if time_range.end_time <= time_range.start_time:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="end_time must be after start_time")
+    return scheduling.find_conflicts(db, current_user.id, time_range.start_time, time_range.end_time)
 
-        # Add event permission
-        permission = models.EventPermission(
-            event_id=new_event.id, user_id=current_user.id, role="Owner")
-        db.add(permission)
 
-        # Create initial version
-        version = models.EventVersion(
-            event_id=new_event.id, data=event.model_dump_json(), timestamp=datetime.utcnow())
-        db.add(version)
+def free_busy_logic(request: schemas.FreeBusyRequest, db: Session, current_user: models.User):
+    if request.end_time <= request.start_time:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="end_time must be after start_time")
+    return scheduling.free_busy(db, current_user.id, request.user_ids, request.start_time, request.end_time)
 
+# =======================================================================================================================
+# Events Import & Export
+# =======================================================================================================================
+
+
+async def _iter_ndjson_lines(stream: AsyncIterator[bytes], max_line: int = IMPORT_MAX_LINE_BYTES):
+    # Yields every line, or None for a line longer than max_line. Only the new
+    # chunk is searched for newlines, and an oversized line is dropped as it
+    # arrives, so memory stays bounded by max_line plus one chunk.
+    buffer, oversized = bytearray(), False
+    async for chunk in stream:
+        start = chunk.find(b"\n") + 1
+        end = 0
+        while start:
+            if oversized or len(buffer) + start - 1 - end > max_line:
+                yield None
+            else:
+                buffer += chunk[end:start - 1]
+                yield bytes(buffer)
+            buffer.clear()
+            oversized = False
+            end, start = start, chunk.find(b"\n", start) + 1
+        if not oversized:
+            buffer += chunk[end:]
+            if len(buffer) > max_line:
+                oversized = True
+                buffer.clear()
+    if oversized:
+        yield None
+    elif buffer:
+        yield bytes(buffer)
+
+
+def _import_chunk(chunk: List[schemas.EventCreate], db: Session, owner_id: int):
+    try:
+        _bulk_insert_events(chunk, db, owner_id)
         db.commit()
-        new_events.append(new_event)
+    except SQLAlchemyError as exc:
+        db.rollback()
+        return str(exc.orig or exc)
+    return None
+
+
+async def import_events_ndjson(stream: AsyncIterator[bytes], db: Session, current_user: models.User,
+                               chunk_size: int = BATCH_CHUNK_SIZE):
+    imported, failed, errors = 0, 0, []
+
+    def record_error(line: int, error: str):
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"line": line, "error": error})
+
+    async def flush(pending: List[schemas.EventCreate], first_line: int):
+        nonlocal imported, failed
+        error = await instrumentation.run_in_threadpool(_import_chunk, pending, db, current_user.id)
+        if error:
+            failed += len(pending)
+            record_error(first_line, error)
+        else:
+            imported += len(pending)
+
+    pending, first_line, line_no = [], 1, 0
+    async for line in _iter_ndjson_lines(stream):
+        line_no += 1
+        if line is None:
+            failed += 1
+            record_error(line_no, f"Line is longer than {IMPORT_MAX_LINE_BYTES} bytes")
+            continue
+        if not line.strip():
+            continue
+        try:
+            event = schemas.EventCreate.model_validate_json(line)
+        except ValidationError as exc:
+            failed += 1
+            record_error(line_no, str(exc))
+            continue
+
+        if not pending:
+            first_line = line_no
+        pending.append(event)
+        if len(pending) >= chunk_size:
+            await flush(pending, first_line)
+            pending = []
+
+    if pending:
+        await flush(pending, first_line)
+
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+
+def export_events_ndjson(db: Session, current_user: models.User):
+    # The request session is closed before the body is streamed, so the export
+    # runs on its own session bound to the same engine.
+    bind = db.get_bind()
+    query = select(*EVENT_OUT_COLUMNS).where(permissions.can_access(current_user.id)).order_by(
+        models.Event.id).execution_options(
+        stream_results=True, yield_per=EXPORT_FETCH_SIZE)
+
+    def generate():
+        with Session(bind) as stream_db:
+            for row in stream_db.execute(query):
+                yield serialization.dumps(serialization.event_out(row._mapping)) + b"\n"
+
+    return generate()
 
-    return new_events
 
 # =======================================================================================================================
 # Events Collaboration
 # =======================================================================================================================
 
 
+def _upsert_permissions(rows: List[dict], db: Session):
+    # INSERT ... ON CONFLICT (event_id, user_id) DO UPDATE, relying on the unique index
+    dialect = db.get_bind().dialect.name
+    dialect_insert = importlib.import_module(f"sqlalchemy.dialects.{dialect}").insert \
+        if dialect in UPSERT_DIALECTS else None
+    for _, chunk in _chunked(rows, PERMISSION_CHUNK_SIZE):
+        if dialect_insert is None:
+            for row in chunk:
+                existing = db.query(models.EventPermission).filter_by(
+                    event_id=row["event_id"], user_id=row["user_id"]).first()
+                if existing:
+                    existing.role = row["role"]
+                else:
+                    db.add(models.EventPermission(**row))
+            continue
+        stmt = dialect_insert(models.EventPermission).values(chunk)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["event_id", "user_id"], set_={"role": stmt.excluded.role}))
+
+
+def _delete_permissions(pairs: List[tuple], db: Session):
+    for _, chunk in _chunked(pairs, PERMISSION_CHUNK_SIZE):
+        db.execute(delete(models.EventPermission).where(
+            tuple_(models.EventPermission.event_id, models.EventPermission.user_id).in_(chunk)),
+            execution_options={"synchronize_session": False})
+
+
 def share_event(event_id: int, owner_id: int, users: List[schemas.ShareUser], db: Session):
-    owner_permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=owner_id).first()
-    if not owner_permission or owner_permission.role != "Owner":
+    if permissions.get_role(db, event_id, owner_id) != "Owner":
         raise HTTPException(
             status_code=403, detail="Only owners can share the event.")
 
-    for user in users:
-        existing = db.query(models.EventPermission).filter_by(
-            event_id=event_id, user_id=user.user_id).first()
-        if existing:
-            existing.role = user.role
-        else:
-            db.add(models.EventPermission(event_id=event_id,
-                   user_id=user.user_id, role=user.role))
+    # Later entries for the same user win, as they did when applied one by one
+    roles = {user.user_id: schemas.RoleEnum(user.role).value for user in users}
+    _upsert_permissions([{"event_id": event_id, "user_id": user_id, "role": role}
+                         for user_id, role in roles.items()], db)
     db.commit()
+    for user_id in roles:
+        permissions.invalidate(event_id, user_id)
+    notifications.notify(db, "shared", event_id)
     return {"message": "Permissions updated"}
 
 
+def bulk_update_permissions(requester_id: int, request: schemas.BulkPermissionRequest, db: Session):
+    grants = {(g.event_id, g.user_id): g.role.value for g in request.grants}
+    revocations = dict.fromkeys((r.event_id, r.user_id) for r in request.revocations)
+    pairs = list(grants) + [pair for pair in revocations if pair not in grants]
+    if not pairs:
+        return []
+
+    event_ids = {event_id for event_id, _ in pairs}
+    owned = set(db.scalars(select(models.EventPermission.event_id).where(
+        models.EventPermission.user_id == requester_id, models.EventPermission.role == "Owner",
+        models.EventPermission.event_id.in_(event_ids))))
+    users = set(db.scalars(select(models.User.id).where(
+        models.User.id.in_({user_id for event_id, user_id in grants}))))
+    existing = {}
+    for _, chunk in _chunked(pairs, PERMISSION_CHUNK_SIZE):
+        existing.update(((p.event_id, p.user_id), p.role) for p in db.execute(
+            select(models.EventPermission.event_id, models.EventPermission.user_id,
+                   models.EventPermission.role).where(
+                tuple_(models.EventPermission.event_id, models.EventPermission.user_id).in_(chunk))))
+
+    results, upserts, deletes = [], [], []
+    for (event_id, user_id), role in grants.items():
+        if event_id not in owned:
+            outcome = "forbidden"
+        elif user_id not in users:
+            outcome = "user_not_found"
+        elif (event_id, user_id) not in existing:
+            outcome = "created"
+        else:
+            outcome = "unchanged" if existing[(event_id, user_id)] == role else "updated"
+        if outcome in ("created", "updated"):
+            upserts.append({"event_id": event_id, "user_id": user_id, "role": role})
+        results.append({"action": "grant", "event_id": event_id, "user_id": user_id, "role": role,
+                        "status": outcome})
+
+    for event_id, user_id in revocations:
+        if (event_id, user_id) in grants:
+            outcome = "superseded"
+        elif event_id not in owned:
+            outcome = "forbidden"
+        elif (event_id, user_id) not in existing:
+            outcome = "not_found"
+        else:
+            outcome = "revoked"
+            deletes.append((event_id, user_id))
+        results.append({"action": "revoke", "event_id": event_id, "user_id": user_id, "status": outcome})
+
+    _upsert_permissions(upserts, db)
+    _delete_permissions(deletes, db)
+    db.commit()
+    for row in upserts:
+        permissions.invalidate(row["event_id"], row["user_id"])
+    for event_id, user_id in deletes:
+        permissions.invalidate(event_id, user_id)
+    for event_id in dict.fromkeys(row["event_id"] for row in upserts):
+        notifications.notify(db, "shared", event_id)
+    return results
+
+
 def get_event_permissions(event_id: int, user_id: int, db: Session):
-    permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=user_id).first()
-    if not permission:
+    if not permissions.get_role(db, event_id, user_id):
         raise HTTPException(status_code=403, detail="Permission denied")
 
-    permissions = db.query(models.EventPermission).filter_by(
+    event_permissions = db.query(models.EventPermission).filter_by(
         event_id=event_id).all()
-    return [{"user_id": p.user_id, "role": p.role} for p in permissions]
+    return [{"user_id": p.user_id, "role": p.role} for p in event_permissions]
 
 
 def update_event_permission(event_id: int, requester_id: int, target_user_id: int, role: str, db: Session):
-    requester_permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=requester_id).first()
-    if not requester_permission or requester_permission.role != "Owner":
+    if permissions.get_role(db, event_id, requester_id) != "Owner":
         raise HTTPException(
             status_code=403, detail="Only owners can update permissions")
 
@@ -188,19 +557,19 @@ def update_event_permission(event_id: int, requester_id: int, target_user_id: in
 
     permission.role = role
     db.commit()
+    permissions.invalidate(event_id, target_user_id)
     return {"message": "Permission updated"}
 
 
 def remove_event_permission(event_id: int, requester_id: int, target_user_id: int, db: Session):
-    requester_permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=requester_id).first()
-    if not requester_permission or requester_permission.role != "Owner":
+    if permissions.get_role(db, event_id, requester_id) != "Owner":
         raise HTTPException(
             status_code=403, detail="Only owners can remove permissions")
 
     deleted = db.query(models.EventPermission).filter_by(
         event_id=event_id, user_id=target_user_id).delete()
     db.commit()
+    permissions.invalidate(event_id, target_user_id)
     return {"message": "Permission removed" if deleted else "Permission not found"}
 
 
@@ -208,48 +577,55 @@ def remove_event_permission(event_id: int, requester_id: int, target_user_id: in
 # Events Version History
 # =======================================================================================================================
 
+def get_event_version_body(event_id: int, version_id: int, user_id: int, db: Session):
+    # Versions never change once written, so their serialized form is cached
+    if not permissions.get_role(db, event_id, user_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    key = ("version", event_id, version_id)
+    body = etags.get_cached(key)
+    if body is None:
+        body = etags.cache(key, etags.dump(get_event_version(event_id, version_id, user_id, db)))
+    return etags.content_etag(body), body
+
+
 def get_event_version(event_id: int, version_id: int, user_id: int, db: Session):
-    permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=user_id).first()
-    if not permission:
+    if not permissions.get_role(db, event_id, user_id):
         raise HTTPException(status_code=403, detail="Access denied")
 
     version = db.query(models.EventVersion).filter_by(
         event_id=event_id, id=version_id).first()
     if not version:
-        raise HTTPException(status_code=404, detail="Version not found")
+        archived = archive.fetch(db, event_id, version_id)
+        if archived is None:
+            raise HTTPException(status_code=404, detail="Version not found")
+        return archived
 
     return {
         "version_id": version.id,
         "event_id": version.event_id,
-        "data": version.data,
+        "data": versions.stored_data(db, version),
         "timestamp": version.timestamp
     }
 
 
 def rollback_event_to_version(event_id: int, version_id: int, user_id: int, db: Session):
-    permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=user_id).first()
-    if not permission or permission.role != "Owner":
+    role, event = permissions.get_event_with_role(db, event_id, user_id)
+    if role != "Owner":
         raise HTTPException(status_code=403, detail="Only owners can rollback")
 
-    version = db.query(models.EventVersion).filter_by(
-        event_id=event_id, id=version_id).first()
-    if not version:
+    snapshot = _version_snapshot(db, event_id, version_id)
+    if snapshot is None:
         raise HTTPException(status_code=404, detail="Version not found")
 
-    event = db.query(models.Event).filter_by(id=event_id).first()
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    version_data = json.loads(version.data)
-    for key, value in version_data.items():
-        setattr(event, key, value)
-
-    new_version = models.EventVersion(event_id=event_id, data=json.dumps(
-        version_data), timestamp=datetime.utcnow())
-    db.add(new_version)
+    previous = versions.event_snapshot(event)
+    restored = schemas.EventCreate.model_validate(snapshot)
+    updated = _write_event(db, event, restored)
+    versions.add_version(db, event_id, restored.model_dump(mode="json"), previous)
     db.commit()
+    notifications.notify(db, "rolled_back", event_id, updated)
     return {"message": "Rolled back successfully"}
 
 
@@ -257,44 +633,40 @@ def rollback_event_to_version(event_id: int, version_id: int, user_id: int, db:
 # Events Changelog & Diff
 # =======================================================================================================================
 
-def get_event_changelog(event_id: int, user_id: int, db: Session):
-    permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=user_id).first()
-    if not permission:
+def get_event_changelog(event_id: int, user_id: int, db: Session, limit: Optional[int] = None,
+                        before: Optional[int] = None):
+    if not permissions.get_role(db, event_id, user_id):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    versions = db.query(models.EventVersion).filter_by(
-        event_id=event_id).order_by(models.EventVersion.timestamp.desc()).all()
-    return [{"version_id": v.id, "timestamp": v.timestamp} for v in versions]
+    return versions.changelog(db, event_id, limit=limit, before=before)
 
 
 def get_event_diff(event_id: int, v1: int, v2: int, user_id: int, db: Session):
-    permission = db.query(models.EventPermission).filter_by(
-        event_id=event_id, user_id=user_id).first()
-    if not permission:
+    if not permissions.get_role(db, event_id, user_id):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    ver1 = db.query(models.EventVersion).filter_by(
+    # Only the version numbers are needed, the stored changes are composed instead
+    ver1 = db.query(models.EventVersion).options(defer(models.EventVersion.data)).filter_by(
         event_id=event_id, id=v1).first()
-    ver2 = db.query(models.EventVersion).filter_by(
+    ver2 = db.query(models.EventVersion).options(defer(models.EventVersion.data)).filter_by(
         event_id=event_id, id=v2).first()
 
-    if not ver1 or not ver2:
+    if ver1 and ver2:
+        return versions.diff(db, ver1, ver2)
+
+    # At least one side was archived, compare the snapshots instead
+    data1 = versions.reconstruct(db, ver1) if ver1 else _version_snapshot(db, event_id, v1)
+    data2 = versions.reconstruct(db, ver2) if ver2 else _version_snapshot(db, event_id, v2)
+    if data1 is None or data2 is None:
         raise HTTPException(
             status_code=404, detail="One or both versions not found")
+    return versions.diff_snapshots(data1, data2)
 
-    if isinstance(ver1.data, dict):
-        data1 = ver1.data
-    else:
-        data1 = json.loads(ver1.data)
-    if isinstance(ver2.data, dict):
-        data2 = ver2.data
-    else:
-        data2 = json.loads(ver2.data)
-
-    diff = {}
-    for key in data1.keys():
-        if data1.get(key) != data2.get(key):
-            diff[key] = {"from": data1.get(key), "to": data2.get(key)}
 
-    return diff
+def _version_snapshot(db: Session, event_id: int, version_id: int):
+    # Full snapshot of a version, from event_versions or the archive
+    version = db.query(models.EventVersion).filter_by(event_id=event_id, id=version_id).first()
+    if version:
+        return versions.reconstruct(db, version)
+    archived = archive.fetch(db, event_id, version_id)
+    return versions.load(archived["data"]) if archived else None
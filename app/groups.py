@@ -0,0 +1,178 @@
+from typing import Dict, Iterable, List, Set
+from fastapi import HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from . import models, notifications, permissions, schemas
+
+# Groups can hold direct grants only up to Editor, ownership stays with users
+GROUP_ROLES = ("Viewer", "Editor")
+
+
+# =======================================================================================================================
+# Membership Closure
+# =======================================================================================================================
+
+def _parents(db: Session, group_ids: Iterable[int]) -> Dict[int, List[int]]:
+    # Nesting edges above the given groups only, one query per level of depth
+    parents, seen, frontier = {}, set(), set(group_ids)
+    while frontier:
+        seen |= frontier
+        found = set()
+        for parent_id, child_id in db.query(models.GroupNesting.parent_id, models.GroupNesting.child_id).filter(
+                models.GroupNesting.child_id.in_(frontier)):
+            parents.setdefault(child_id, []).append(parent_id)
+            found.add(parent_id)
+        frontier = found - seen
+    return parents
+
+
+def _ancestors(group_ids: Iterable[int], parents: Dict[int, List[int]]) -> Set[int]:
+    # The groups themselves plus every group that contains them, at any depth
+    found, pending = set(), list(group_ids)
+    while pending:
+        group_id = pending.pop()
+        if group_id not in found:
+            found.add(group_id)
+            pending.extend(parents.get(group_id, ()))
+    return found
+
+
+def _closure_members(db: Session, group_id: int) -> Set[int]:
+    return set(db.scalars(select(models.GroupClosure.user_id).where(models.GroupClosure.group_id == group_id)))
+
+
+def refresh_closure(db: Session, user_ids: Iterable[int]):
+    # Recomputes effective memberships for the given users only, so a change
+    # costs O(affected users x nesting depth) instead of touching event grants
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    db.query(models.GroupClosure).filter(models.GroupClosure.user_id.in_(user_ids)).delete(
+        synchronize_session=False)
+
+    direct = {}
+    for user_id, group_id in db.query(models.GroupMember.user_id, models.GroupMember.group_id).filter(
+            models.GroupMember.user_id.in_(user_ids)):
+        direct.setdefault(user_id, []).append(group_id)
+
+    parents = _parents(db, {group_id for group_ids in direct.values() for group_id in group_ids})
+    rows = [{"user_id": user_id, "group_id": group_id}
+            for user_id, group_ids in direct.items() for group_id in _ancestors(group_ids, parents)]
+    if rows:
+        db.execute(insert(models.GroupClosure), rows)
+
+
+# =======================================================================================================================
+# Groups
+# =======================================================================================================================
+
+def _managed_group(db: Session, group_id: int, user_id: int) -> models.Group:
+    group = db.get(models.Group, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if group.owner_id != user_id:
+        raise HTTPException(status_code=403, detail="Only the group owner can change members")
+    return group
+
+
+def create_group(group: schemas.GroupCreate, owner_id: int, db: Session):
+    if db.query(models.Group).filter_by(name=group.name).first():
+        raise HTTPException(status_code=400, detail="Group name already taken")
+    new_group = models.Group(name=group.name, owner_id=owner_id)
+    db.add(new_group)
+    db.commit()
+    db.refresh(new_group)
+    return new_group
+
+
+def add_group_members(group_id: int, request: schemas.GroupMembersRequest, requester_id: int, db: Session):
+    _managed_group(db, group_id, requester_id)
+    user_ids, group_ids = set(request.user_ids), set(request.group_ids)
+
+    if len(set(db.scalars(select(models.User.id).where(models.User.id.in_(user_ids))))) != len(user_ids):
+        raise HTTPException(status_code=404, detail="User not found")
+    if len(set(db.scalars(select(models.Group.id).where(models.Group.id.in_(group_ids))))) != len(group_ids):
+        raise HTTPException(status_code=404, detail="Group not found")
+    if group_ids & _ancestors([group_id], _parents(db, [group_id])):
+        raise HTTPException(status_code=400, detail="Group nesting cannot contain cycles")
+
+    members = set(db.scalars(select(models.GroupMember.user_id).where(models.GroupMember.group_id == group_id)))
+    children = set(db.scalars(select(models.GroupNesting.child_id).where(models.GroupNesting.parent_id == group_id)))
+    new_users, new_children = user_ids - members, group_ids - children
+    if new_users:
+        db.execute(insert(models.GroupMember), [{"group_id": group_id, "user_id": u} for u in new_users])
+    if new_children:
+        db.execute(insert(models.GroupNesting), [{"parent_id": group_id, "child_id": g} for g in new_children])
+
+    affected = set(new_users)
+    for child_id in new_children:
+        affected |= _closure_members(db, child_id)
+    refresh_closure(db, affected)
+    db.commit()
+    permissions.invalidate_users(affected)
+    return {"message": "Members added"}
+
+
+def remove_group_member(group_id: int, user_id: int, requester_id: int, db: Session):
+    _managed_group(db, group_id, requester_id)
+    deleted = db.query(models.GroupMember).filter_by(group_id=group_id, user_id=user_id).delete()
+    refresh_closure(db, [user_id])
+    db.commit()
+    permissions.invalidate_users([user_id])
+    return {"message": "Member removed" if deleted else "Member not found"}
+
+
+def remove_subgroup(group_id: int, child_id: int, requester_id: int, db: Session):
+    _managed_group(db, group_id, requester_id)
+    affected = _closure_members(db, child_id)
+    deleted = db.query(models.GroupNesting).filter_by(parent_id=group_id, child_id=child_id).delete()
+    refresh_closure(db, affected)
+    db.commit()
+    permissions.invalidate_users(affected)
+    return {"message": "Subgroup removed" if deleted else "Subgroup not found"}
+
+
+# =======================================================================================================================
+# Event Grants
+# =======================================================================================================================
+
+def share_event_with_groups(event_id: int, owner_id: int, groups: List[schemas.ShareGroup], db: Session):
+    if permissions.get_role(db, event_id, owner_id) != "Owner":
+        raise HTTPException(status_code=403, detail="Only owners can share the event.")
+
+    roles = {group.group_id: schemas.RoleEnum(group.role).value for group in groups}
+    if any(role not in GROUP_ROLES for role in roles.values()):
+        raise HTTPException(status_code=400, detail="Groups can only be granted Viewer or Editor")
+    if len(set(db.scalars(select(models.Group.id).where(models.Group.id.in_(roles))))) != len(roles):
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    existing = {p.group_id: p for p in db.query(models.EventGroupPermission).filter(
+        models.EventGroupPermission.event_id == event_id, models.EventGroupPermission.group_id.in_(roles))}
+    for group_id, role in roles.items():
+        if group_id in existing:
+            existing[group_id].role = role
+        else:
+            db.add(models.EventGroupPermission(event_id=event_id, group_id=group_id, role=role))
+    db.commit()
+    permissions.invalidate_event(event_id)
+    notifications.notify(db, "shared", event_id)
+    return {"message": "Permissions updated"}
+
+
+def get_event_group_permissions(event_id: int, user_id: int, db: Session):
+    if not permissions.get_role(db, event_id, user_id):
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    return [{"group_id": p.group_id, "role": p.role}
+            for p in db.query(models.EventGroupPermission).filter_by(event_id=event_id)]
+
+
+def remove_event_group_permission(event_id: int, requester_id: int, group_id: int, db: Session):
+    if permissions.get_role(db, event_id, requester_id) != "Owner":
+        raise HTTPException(status_code=403, detail="Only owners can remove permissions")
+
+    deleted = db.query(models.EventGroupPermission).filter_by(event_id=event_id, group_id=group_id).delete()
+    db.commit()
+    permissions.invalidate_event(event_id)
+    return {"message": "Permission removed" if deleted else "Permission not found"}
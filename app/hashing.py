@@ -0,0 +1,146 @@
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException, status
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+
+# bcrypt runs in a dedicated process pool so that login storms burn CPU there
+# instead of holding the GIL in the API process. At most PASSWORD_HASH_QUEUE
+# hashes may be queued or running, beyond that callers get a 503. The login and
+# register routes await the pool from the event loop, so queued hashes never
+# hold a threadpool slot that the other sync routes need.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 64))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", 1))
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", 0))
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 16
+
+rounds = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+
+
+def _hash(password: str, cost: int):
+    from passlib.hash import bcrypt
+    return bcrypt.using(rounds=cost).hash(password)
+
+
+def _verify(password: str, hashed: str):
+    from passlib.hash import bcrypt
+    return bcrypt.verify(password, hashed)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn keeps the workers free of the parent's threads and sockets
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _submit(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many concurrent password checks, retry later",
+                            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)})
+    try:
+        future = _get_executor().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def _run(fn, *args):
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    return _submit(fn, *args).result()
+
+
+async def _run_async(fn, *args):
+    if PASSWORD_HASH_WORKERS <= 0:
+        # Imported here, the spawned pool workers only need this module
+        from . import instrumentation
+        return await instrumentation.run_in_threadpool(fn, *args)
+    return await asyncio.wrap_future(_submit(fn, *args))
+
+
+def hash_password(password: str):
+    return _run(_hash, password, rounds)
+
+
+def verify_password(plain: str, hashed: str):
+    return _run(_verify, plain, hashed)
+
+
+async def hash_password_async(password: str):
+    return await _run_async(_hash, password, rounds)
+
+
+async def verify_password_async(plain: str, hashed: str):
+    return await _run_async(_verify, plain, hashed)
+
+
+def hash_cost(hashed: str):
+    # $2b$12$<salt+digest>
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed: str):
+    return hash_cost(hashed) != rounds
+
+
+def calibrate(target_ms: float, probe_rounds: int = 8):
+    # bcrypt time doubles with every round, so one cheap probe is enough to
+    # estimate the highest cost that stays within the target latency
+    started = time.perf_counter()
+    _hash("calibration-probe", probe_rounds)
+    probe_ms = max((time.perf_counter() - started) * 1000, 0.001)
+    best = probe_rounds + math.floor(math.log2(target_ms / probe_ms))
+    return max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, best))
+
+
+def configure_rounds(per_worker: bool = False):
+    # Runs once in app.serve before the workers start. They inherit the cost as
+    # BCRYPT_ROUNDS, so every worker hashes alike and needs_rehash agrees across
+    # them. Apps started some other way calibrate in each worker's lifespan.
+    global rounds
+    if BCRYPT_TARGET_MS and "BCRYPT_ROUNDS" not in os.environ:
+        rounds = calibrate(BCRYPT_TARGET_MS)
+        os.environ["BCRYPT_ROUNDS"] = str(rounds)
+        if per_worker:
+            logger.warning("Calibrated bcrypt to %d rounds for BCRYPT_TARGET_MS=%g in this worker only. With "
+                           "several workers, set BCRYPT_ROUNDS or start with `python -m app.serve` so that they "
+                           "all use the same cost.", rounds, BCRYPT_TARGET_MS)
+    return rounds
+
+
+def start():
+    if PASSWORD_HASH_WORKERS > 0:
+        # Spawn the workers up front instead of on the first login
+        executor = _get_executor()
+        for future in [executor.submit(time.sleep, 0) for _ in range(PASSWORD_HASH_WORKERS)]:
+            future.result()
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,253 @@
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool as starlette_run_in_threadpool
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "true").lower() in ("1", "true", "yes")
+# Requests slower than PROFILE_SLOW_MS get their sampled stacks written to
+# PROFILE_DIR in folded format (flamegraph.pl, speedscope). 0 disables profiling.
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 0))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.1))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+REQUEST_DURATION = metrics.Histogram(
+    "http_request_duration_seconds", "Time from request start to the end of the response", ["method", "route"])
+REQUEST_QUERIES = metrics.Histogram(
+    "http_request_queries", "SQL statements executed per request", ["method", "route"], buckets=QUERY_BUCKETS)
+REQUEST_DB_TIME = metrics.Histogram(
+    "http_request_db_seconds", "Time spent executing SQL per request", ["method", "route"])
+REQUEST_SERIALIZATION_TIME = metrics.Histogram(
+    "http_request_serialization_seconds", "Time spent encoding response bodies per request", ["method", "route"])
+PROFILES_WRITTEN = metrics.Counter(
+    "http_request_profiles_total", "Slow request profiles written to PROFILE_DIR", ["method", "route"])
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "serialization_time", "threads")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        # Idents of the threads running the handler: a pool thread for sync
+        # routes, the event loop thread for async ones
+        self.threads = set()
+
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+def current() -> Optional[RequestStats]:
+    return _current.get()
+
+
+@contextmanager
+def timed_serialization():
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serialization_time += time.perf_counter() - started
+
+
+class TimedJSONResponse(JSONResponse):
+    # Default response class, so response_model bodies count as serialization too
+    def render(self, content) -> bytes:
+        with timed_serialization():
+            return super().render(content)
+
+
+def _tracked(call):
+    # Registers the calling thread with the request's stats while the endpoint runs
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def run_async(*args, **kwargs):
+            with _handler_thread(_current.get()):
+                return await call(*args, **kwargs)
+        return run_async
+
+    @functools.wraps(call)
+    def run(*args, **kwargs):
+        with _handler_thread(_current.get()):
+            return call(*args, **kwargs)
+    return run
+
+
+def tracked(fn):
+    # For work a request hands to another thread or executor, so that thread
+    # gets sampled with the request too
+    stats = _current.get()
+    if stats is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        with _handler_thread(stats):
+            return fn(*args, **kwargs)
+    return run
+
+
+async def run_in_threadpool(fn, *args):
+    return await starlette_run_in_threadpool(tracked(fn), *args)
+
+
+@contextmanager
+def _handler_thread(stats: Optional[RequestStats]):
+    if stats is None:
+        yield
+        return
+    ident = threading.get_ident()
+    stats.threads.add(ident)
+    try:
+        yield
+    finally:
+        stats.threads.discard(ident)
+
+
+class TrackedRoute(APIRoute):
+    # Route class for the app's routers, so the profiler knows which thread to sample
+    def get_route_handler(self):
+        self.dependant.call = _tracked(self.dependant.call)
+        return super().get_route_handler()
+
+# =======================================================================================================================
+# SQLAlchemy Hooks
+# =======================================================================================================================
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is dropped with the statement even when it raises
+    if _current.get() is not None and context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = getattr(context, "_query_started", None)
+    if stats is None or started is None:
+        return
+    stats.queries += 1
+    stats.db_time += time.perf_counter() - started
+
+# =======================================================================================================================
+# Slow Request Profiling
+# =======================================================================================================================
+
+
+class StackSampler(threading.Thread):
+    # Samples the stacks of the request's handler threads while it runs. Only
+    # stacks that pass through app code are kept, which drops the loop thread
+    # while it serves other requests.
+    def __init__(self, interval: float, threads: set):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.threads = threads
+        self.samples = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.threads):
+                frame = frames.get(thread_id)
+                stack, in_app = [], False
+                while frame is not None:
+                    code = frame.f_code
+                    in_app = in_app or (code.co_filename.startswith(_APP_DIR) and code.co_filename != __file__)
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if in_app:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self.join()
+        return self.samples
+
+
+def _write_profile(samples: Counter, method: str, route: str, elapsed_ms: float):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", route).strip("-") or "root"
+    path = os.path.join(PROFILE_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{method}-{slug}-{elapsed_ms:.0f}ms.folded")
+    with open(path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+# =======================================================================================================================
+# Middleware
+# =======================================================================================================================
+
+
+def _server_timing(stats: RequestStats, handler_seconds: float) -> str:
+    return (f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+            f"serialize;dur={stats.serialization_time * 1000:.2f}, "
+            f"handler;dur={handler_seconds * 1000:.2f}")
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        sampler = None
+        if PROFILE_SLOW_MS > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            sampler = StackSampler(PROFILE_INTERVAL_MS / 1000, stats.threads)
+            sampler.start()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and SERVER_TIMING_HEADER:
+                header = _server_timing(stats, time.perf_counter() - started).encode("latin-1")
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": route.path if route else "unmatched"}
+            REQUEST_DURATION.observe(elapsed, **labels)
+            REQUEST_QUERIES.observe(stats.queries, **labels)
+            REQUEST_DB_TIME.observe(stats.db_time, **labels)
+            REQUEST_SERIALIZATION_TIME.observe(stats.serialization_time, **labels)
+            if sampler is not None:
+                samples = sampler.stop()
+                if elapsed * 1000 >= PROFILE_SLOW_MS and samples:
+                    _write_profile(samples, labels["method"], labels["route"], elapsed * 1000)
+                    PROFILES_WRITTEN.inc(**labels)
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from . import metrics
+
+# Token revocations and cache invalidations take effect in this process right
+# away. With several workers they are broadcast on a redis channel as well, so
+# every worker applies them. Defaults to the notification channel's server.
+INVALIDATION_REDIS_URL = os.getenv("INVALIDATION_REDIS_URL") or os.getenv("EVENT_STREAM_REDIS_URL")
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_ERRORS = metrics.Counter(
+    "cache_invalidation_errors_total", "Failed broadcasts to, and lost connections from, the invalidation channel",
+    ["operation"])
+
+_handlers: Dict[str, Callable] = {}
+_resets: List[Callable] = []
+
+
+def handler(name: str):
+    # Registers the function that applies the `name` invalidation in this process
+    def register(fn):
+        _handlers[name] = fn
+        return fn
+    return register
+
+
+def on_reset(fn):
+    # Called when this worker may have missed broadcasts: the cache has to be dropped
+    _resets.append(fn)
+    return fn
+
+
+def apply(name: str, args):
+    _handlers[name](*args)
+
+
+def reset():
+    for fn in _resets:
+        fn()
+
+
+class LocalBus:
+    # Single worker: applying the invalidation locally is all there is to do
+    shared = False
+
+    def publish(self, name: str, args: list, until: Optional[float] = None):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class RedisBus:
+    # Several workers: invalidations go out on a redis channel, and each worker
+    # applies what the others sent. Messages with an `until` (revocations) are
+    # also kept in a sorted set scored by expiry, so a worker that starts or
+    # reconnects later replays the ones still in force. Everything else was
+    # missed for good, so a (re)connecting worker drops its caches instead.
+    shared = True
+
+    def __init__(self, client, channel: str = "cache-invalidation",
+                 reconnect_delay: float = 0.5, max_reconnect_delay: float = 30.0):
+        self.client = client
+        self.channel = channel
+        self.replay_key = f"{channel}:replay"
+        self.worker_id = uuid.uuid4().hex
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = threading.Event()
+        self._stopped = threading.Event()
+        self._pubsub = None
+        self._thread = None
+
+    def publish(self, name: str, args: list, until: Optional[float] = None):
+        # Already applied locally: a failure is logged, and the other workers
+        # catch up from the replay set or the cache TTLs
+        message = json.dumps({"origin": self.worker_id, "name": name, "args": list(args)})
+        try:
+            if until is not None:
+                self.client.zadd(self.replay_key, {message: until})
+            self.client.publish(self.channel, message)
+        except Exception:
+            INVALIDATION_ERRORS.inc(operation="publish")
+            logger.exception("Could not broadcast %s on the invalidation channel %s", name, self.channel)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+
+    def _listen(self):
+        delay = self.reconnect_delay
+        while not self._stopped.is_set():
+            try:
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.subscribe(self.channel)
+                self._catch_up()
+                self.connected.set()
+                delay = self.reconnect_delay
+                for item in self._pubsub.listen():
+                    self._receive(item["data"])
+            except Exception:
+                if self._stopped.is_set():
+                    return
+                INVALIDATION_ERRORS.inc(operation="listen")
+                logger.exception("Lost the invalidation channel %s, reconnecting in %.1fs", self.channel, delay)
+            self.connected.clear()
+            self._stopped.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _catch_up(self):
+        # Runs once subscribed, so nothing published from here on is missed
+        now = time.time()
+        self.client.zremrangebyscore(self.replay_key, "-inf", now)
+        for raw in self.client.zrangebyscore(self.replay_key, now, "+inf"):
+            self._receive(raw, replay=True)
+        reset()
+
+    def _receive(self, raw, replay: bool = False):
+        message = json.loads(raw)
+        if message["origin"] == self.worker_id and not replay:
+            return
+        try:
+            apply(message["name"], message["args"])
+        except Exception:
+            logger.exception("Could not apply %s from the invalidation channel", message.get("name"))
+
+
+_bus = LocalBus()
+
+
+def set_bus(bus):
+    global _bus
+    _bus = bus
+
+
+def get_bus():
+    return _bus
+
+
+def configure():
+    if not INVALIDATION_REDIS_URL:
+        return
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("INVALIDATION_REDIS_URL is set but the redis package is not installed")
+    bus = RedisBus(redis.Redis.from_url(INVALIDATION_REDIS_URL))
+    bus.start()
+    set_bus(bus)
+
+
+def broadcast(name: str, *args, until: Optional[float] = None):
+    # Applies the invalidation here, then sends it to the other workers.
+    # `until` keeps it for workers that connect before that time.
+    apply(name, args)
+    _bus.publish(name, list(args), until)
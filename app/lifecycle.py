@@ -0,0 +1,57 @@
+import logging
+import os
+import time
+
+from . import metrics, notifications
+
+logger = logging.getLogger(__name__)
+
+STARTUP_SECONDS = metrics.Gauge(
+    "app_startup_seconds", "Time to become ready, from process start and for the lifespan alone", ["phase"])
+
+# /health/ready answers 503 until the lifespan has warmed the pools, and again
+# from the moment the worker is asked to stop
+_ready = False
+_draining = False
+
+
+def process_age() -> float:
+    # Seconds since this process was created, read from /proc on Linux, 0 elsewhere
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+
+def mark_ready(lifespan_seconds: float):
+    global _ready
+    _ready = True
+    age = process_age()
+    STARTUP_SECONDS.set(age, phase="process")
+    STARTUP_SECONDS.set(lifespan_seconds, phase="lifespan")
+    logger.info("Worker %s ready %.2fs after start (lifespan %.2fs)", os.getpid(), age, lifespan_seconds)
+
+
+def begin_drain():
+    # Safe to call from a signal handler: flips readiness and asks open
+    # server-sent event streams to end so in-flight connections can finish
+    global _draining
+    if _draining:
+        return
+    _draining = True
+    notifications.close_streams()
+
+
+def is_ready() -> bool:
+    return _ready and not _draining
+
+
+def is_draining() -> bool:
+    return _draining
+
+
+def reset():
+    global _ready, _draining
+    _ready = _draining = False
@@ -1,29 +1,88 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, status
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from typing import List
-
-from . import models, auth, schemas, database, events
-
-models.Base.metadata.create_all(bind=database.engine)
-app = FastAPI()
+from typing import List, Optional
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+import hmac
+import os
+import time
+
+from . import (models, auth, schemas, database, archive, etags, events, groups, background, hashing, instrumentation,
+               invalidation, lifecycle, metrics, notifications, pool, serialization)
+
+TOKEN_SWEEP_INTERVAL = float(os.getenv("TOKEN_SWEEP_INTERVAL", 300))
+TOKEN_SWEEP_BATCH_SIZE = int(os.getenv("TOKEN_SWEEP_BATCH_SIZE", 1000))
+# Scrapers send `Authorization: Bearer <METRICS_TOKEN>`. Without a token the
+# metrics are only served to clients connecting over loopback.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+LOOPBACK_HOSTS = ("127.0.0.1", "::1")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is created by `python -m app.migrate`, not by every worker
+    started = time.perf_counter()
+    lifecycle.reset()
+    hashing.configure_rounds(per_worker=True)
+    hashing.start()
+    notifications.configure()
+    invalidation.configure()
+    await run_in_threadpool(pool.warm, database.engine)
+    if database.DB_MODE == "async":
+        await pool.warm_async(database.get_async_engine())
+    jobs = [background.start(TOKEN_SWEEP_INTERVAL, auth.sweep_expired_tokens, TOKEN_SWEEP_BATCH_SIZE)]
+    if archive.VERSION_ARCHIVE_INTERVAL:
+        jobs.append(background.start(archive.VERSION_ARCHIVE_INTERVAL, archive.archive_versions))
+    lifecycle.mark_ready(time.perf_counter() - started)
+    yield
+    lifecycle.begin_drain()
+    await background.stop(*jobs)
+    hashing.shutdown()
+    invalidation.get_bus().stop()
+    await database.dispose()
+
+
+router = APIRouter(route_class=instrumentation.TrackedRoute)
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan, default_response_class=instrumentation.TimedJSONResponse)
+    app.add_middleware(instrumentation.RequestMetricsMiddleware)
+    if database.DB_MODE == "async":
+        from . import async_api
+
+        # Included first so the async routes take precedence over the sync ones
+        app.include_router(async_api.router)
+    app.include_router(router)
+    return app
+
+
+def __getattr__(name):
+    # `app.main:app` is built on first access, importing the module only declares the routes
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # =======================================================================================================================
 # Authentcation APIs
 # =======================================================================================================================
 
 
-@app.post("/api/auth/register", tags=["Auth"])
-def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    return auth.register_user(user, db)
+@router.post("/api/auth/register", tags=["Auth"])
+async def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+    return await auth.register_user(user, db)
 
 
-@app.post("/api/auth/login", response_model=schemas.Token, tags=["Auth"])
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    return auth.login_user(form_data.username, form_data.password, db)
+@router.post("/api/auth/login", response_model=schemas.Token, tags=["Auth"])
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+    return await auth.login_user(form_data.username, form_data.password, db)
 
 
-@app.post("/api/auth/refresh", response_model=schemas.Token, tags=["Auth"])
+@router.post("/api/auth/refresh", response_model=schemas.Token, tags=["Auth"])
 def refresh(request: Request, db: Session = Depends(database.get_db)):
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
@@ -33,7 +92,7 @@ def refresh(request: Request, db: Session = Depends(database.get_db)):
     return auth.refresh_user_token(refresh_token, db)
 
 
-@app.post("/api/auth/logout", tags=["Auth"])
+@router.post("/api/auth/logout", tags=["Auth"])
 def logout(request: Request, db: Session = Depends(database.get_db)):
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
@@ -47,82 +106,202 @@ def logout(request: Request, db: Session = Depends(database.get_db)):
 # =======================================================================================================================
 
 
-@app.post("/api/events", response_model=schemas.EventOut, tags=["Events"])
-def create_event(event: schemas.EventCreate, db: Session = Depends(database.get_db),
+@router.post("/api/events", response_model=schemas.EventOut, tags=["Events"])
+def create_event(event: schemas.EventCreate, check_conflicts: bool = False, db: Session = Depends(database.get_db),
                  current_user: models.User = Depends(events.get_current_user)):
-    return events.create_event_logic(event=event, db=db, current_user=current_user)
+    return events.create_event_logic(event=event, db=db, current_user=current_user,
+                                     check_conflicts=check_conflicts)
 
 
-@app.get("/api/events", response_model=List[schemas.EventOut], tags=["Events"])
-def list_events(skip: int = 0, limit: int = 10, db: Session = Depends(database.get_db),
+@router.get("/api/events", response_model=List[schemas.EventOut], tags=["Events"])
+def list_events(skip: int = 0, limit: int = Query(10, ge=0), cursor: Optional[str] = None,
+                start: Optional[datetime] = None, end: Optional[datetime] = None, location: Optional[str] = None,
+                role: Optional[schemas.RoleEnum] = None, db: Session = Depends(database.get_db),
                 current_user: models.User = Depends(events.get_current_user)):
-    return events.list_events_logic(skip=skip, limit=limit, db=db, current_user=current_user)
+    body, next_cursor = events.list_events_json(skip=skip, limit=limit, db=db, current_user=current_user,
+                                                cursor=cursor, start=start, end=end, location=location,
+                                                role=role.value if role else None)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.post("/api/events/import", tags=["Events"])
+async def import_events(request: Request, chunk_size: int = Query(events.BATCH_CHUNK_SIZE, ge=1),
+                        db: Session = Depends(database.get_db),
+                        current_user: models.User = Depends(events.get_current_user)):
+    return await events.import_events_ndjson(request.stream(), db=db, current_user=current_user,
+                                             chunk_size=chunk_size)
+
+
+@router.get("/api/events/export", tags=["Events"])
+def export_events(db: Session = Depends(database.get_db),
+                  current_user: models.User = Depends(events.get_current_user)):
+    return StreamingResponse(events.export_events_ndjson(db=db, current_user=current_user),
+                             media_type="application/x-ndjson")
 
 
-@app.get("/api/events/{event_id}", response_model=schemas.EventOut, tags=["Events"])
-def get_event(event_id: int, db: Session = Depends(database.get_db),
+@router.get("/api/events/stream", tags=["Events"])
+async def stream_events(request: Request, current_user: models.User = Depends(events.get_current_user)):
+    if lifecycle.is_draining():
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is shutting down")
+    subscriber = notifications.subscribe(current_user.id)
+    return StreamingResponse(notifications.stream(subscriber, request.is_disconnected),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/api/events/{event_id}", response_model=schemas.EventOut, tags=["Events"])
+def get_event(event_id: int, if_none_match: Optional[str] = Header(None), db: Session = Depends(database.get_db),
               current_user: models.User = Depends(events.get_current_user)):
-    return events.get_event_logic(event_id=event_id, db=db, current_user=current_user)
+    etag, body = events.get_event_body(event_id=event_id, db=db, current_user=current_user)
+    return etags.respond(body, etag, if_none_match)
 
 
-@app.put("/api/events/{event_id}", response_model=schemas.EventOut, tags=["Events"])
-def update_event(event_id: int, event_data: schemas.EventCreate, db: Session = Depends(database.get_db),
+@router.put("/api/events/{event_id}", response_model=schemas.EventOut, tags=["Events"])
+def update_event(event_id: int, event_data: schemas.EventCreate, response: Response,
+                 if_match: Optional[str] = Header(None), db: Session = Depends(database.get_db),
                  current_user: models.User = Depends(events.get_current_user)):
-    return events.update_event_logic(event_id=event_id, event_data=event_data, db=db, current_user=current_user)
+    event = events.update_event_logic(event_id=event_id, event_data=event_data, db=db, current_user=current_user,
+                                      if_match=if_match)
+    response.headers["ETag"] = etags.revision_etag(event["id"], event["revision"])
+    return event
 
 
-@app.delete("/api/events/{event_id}", tags=["Events"])
+@router.delete("/api/events/{event_id}", tags=["Events"])
 def delete_event(event_id: int, db: Session = Depends(database.get_db),
                  current_user: models.User = Depends(events.get_current_user)):
     return events.delete_event_logic(event_id=event_id, db=db, current_user=current_user)
 
 
-@app.post("/api/events/batch", response_model=List[schemas.EventOut], tags=["Events"])
-def create_batch_events(events_list: List[schemas.EventCreate], db: Session = Depends(database.get_db),
+@router.post("/api/events/batch", response_model=List[schemas.EventOut], tags=["Events"])
+def create_batch_events(events_list: List[schemas.EventCreate], chunk_size: int = Query(events.BATCH_CHUNK_SIZE, ge=1),
+                        check_conflicts: bool = False, db: Session = Depends(database.get_db),
                         current_user: models.User = Depends(events.get_current_user)):
-    print(events_list)
-    return events.create_batch_events_logic(events=events_list, db=db, current_user=current_user)
+    created = events.create_batch_events_logic(events=events_list, db=db, current_user=current_user,
+                                               chunk_size=chunk_size, check_conflicts=check_conflicts)
+    return Response(serialization.dump_events(created), media_type="application/json")
+
+
+@router.post("/api/events/batch/report", response_model=List[schemas.BatchItemResult], tags=["Events"])
+def create_batch_events_report(events_list: List[schemas.EventCreate],
+                               chunk_size: int = Query(events.BATCH_CHUNK_SIZE, ge=1),
+                               db: Session = Depends(database.get_db),
+                               current_user: models.User = Depends(events.get_current_user)):
+    return events.create_batch_events_report_logic(events=events_list, db=db, current_user=current_user,
+                                                   chunk_size=chunk_size)
+
+@router.get("/api/occurrences", response_model=List[schemas.OccurrenceOut], tags=["Events"])
+def list_occurrences(start: datetime, end: datetime, db: Session = Depends(database.get_db),
+                     current_user: models.User = Depends(events.get_current_user)):
+    return events.list_occurrences_logic(start=start, end=end, db=db, current_user=current_user)
+
+@router.post("/api/events/conflicts", response_model=List[schemas.OccurrenceOut], tags=["Events"])
+def check_conflicts(time_range: schemas.TimeRange, db: Session = Depends(database.get_db),
+                    current_user: models.User = Depends(events.get_current_user)):
+    return events.check_conflicts_logic(time_range=time_range, db=db, current_user=current_user)
+
+
+@router.post("/api/freebusy", tags=["Events"])
+def free_busy(request: schemas.FreeBusyRequest, db: Session = Depends(database.get_db),
+              current_user: models.User = Depends(events.get_current_user)):
+    return events.free_busy_logic(request=request, db=db, current_user=current_user)
 
 # =======================================================================================================================
 # Collaboration APIs
 # =======================================================================================================================
 
 
-@app.post("/api/events/{id}/share", tags=["Collaboration"])
+@router.post("/api/events/{id}/share", tags=["Collaboration"])
 def share_event(id: int, request: schemas.ShareRequest, db: Session = Depends(database.get_db),
                 current_user: models.User = Depends(events.get_current_user)):
     return events.share_event(id, current_user.id, request.users, db)
 
 
-@app.get("/api/events/{id}/permissions", tags=["Collaboration"])
-def list_permissions(id: int, db: Session = Depends(database.get_db),
+@router.post("/api/events/permissions/bulk", response_model=List[schemas.PermissionChangeResult],
+          tags=["Collaboration"])
+def bulk_update_permissions(request: schemas.BulkPermissionRequest, db: Session = Depends(database.get_db),
+                            current_user: models.User = Depends(events.get_current_user)):
+    return events.bulk_update_permissions(current_user.id, request, db)
+
+
+@router.get("/api/events/{id}/permissions", tags=["Collaboration"])
+def list_permissions(id: int, if_none_match: Optional[str] = Header(None), db: Session = Depends(database.get_db),
                      current_user: models.User = Depends(events.get_current_user)):
-    return events.get_event_permissions(id, current_user.id, db)
+    body = etags.dump(events.get_event_permissions(id, current_user.id, db))
+    return etags.respond(body, etags.content_etag(body), if_none_match)
 
 
-@app.put("/api/events/{id}/permissions/{userId}", tags=["Collaboration"])
-def update_permission(id: int, userId: int, role: str, db: Session = Depends(database.get_db),
+@router.put("/api/events/{id}/permissions/{userId}", tags=["Collaboration"])
+def update_permission(id: int, userId: int, role: schemas.RoleEnum, db: Session = Depends(database.get_db),
                       current_user: models.User = Depends(events.get_current_user)):
-    return events.update_event_permission(id, current_user.id, userId, role, db)
+    return events.update_event_permission(id, current_user.id, userId, role.value, db)
 
 
-@app.delete("/api/events/{id}/permissions/{userId}", tags=["Collaboration"])
+@router.delete("/api/events/{id}/permissions/{userId}", tags=["Collaboration"])
 def remove_permission(id: int, userId: int, db: Session = Depends(database.get_db),
                       current_user: models.User = Depends(events.get_current_user)):
     return events.remove_event_permission(id, current_user.id, userId, db)
 
+
+@router.post("/api/events/{id}/share/groups", tags=["Collaboration"])
+def share_event_with_groups(id: int, request: schemas.GroupShareRequest, db: Session = Depends(database.get_db),
+                            current_user: models.User = Depends(events.get_current_user)):
+    return groups.share_event_with_groups(id, current_user.id, request.groups, db)
+
+
+@router.get("/api/events/{id}/groups", tags=["Collaboration"])
+def list_group_permissions(id: int, db: Session = Depends(database.get_db),
+                           current_user: models.User = Depends(events.get_current_user)):
+    return groups.get_event_group_permissions(id, current_user.id, db)
+
+
+@router.delete("/api/events/{id}/groups/{groupId}", tags=["Collaboration"])
+def remove_group_permission(id: int, groupId: int, db: Session = Depends(database.get_db),
+                            current_user: models.User = Depends(events.get_current_user)):
+    return groups.remove_event_group_permission(id, current_user.id, groupId, db)
+
+# =======================================================================================================================
+# Group APIs
+# =======================================================================================================================
+
+
+@router.post("/api/groups", response_model=schemas.GroupOut, tags=["Groups"])
+def create_group(group: schemas.GroupCreate, db: Session = Depends(database.get_db),
+                 current_user: models.User = Depends(events.get_current_user)):
+    return groups.create_group(group, current_user.id, db)
+
+
+@router.post("/api/groups/{id}/members", tags=["Groups"])
+def add_group_members(id: int, request: schemas.GroupMembersRequest, db: Session = Depends(database.get_db),
+                      current_user: models.User = Depends(events.get_current_user)):
+    return groups.add_group_members(id, request, current_user.id, db)
+
+
+@router.delete("/api/groups/{id}/members/{userId}", tags=["Groups"])
+def remove_group_member(id: int, userId: int, db: Session = Depends(database.get_db),
+                        current_user: models.User = Depends(events.get_current_user)):
+    return groups.remove_group_member(id, userId, current_user.id, db)
+
+
+@router.delete("/api/groups/{id}/subgroups/{groupId}", tags=["Groups"])
+def remove_subgroup(id: int, groupId: int, db: Session = Depends(database.get_db),
+                    current_user: models.User = Depends(events.get_current_user)):
+    return groups.remove_subgroup(id, groupId, current_user.id, db)
+
 # =======================================================================================================================
 # Versioning APIs
 # =======================================================================================================================
 
 
-@app.get("/api/events/{id}/history/{versionId}", tags=["Version History"])
-def get_version(id: int, versionId: int, db: Session = Depends(database.get_db),
+@router.get("/api/events/{id}/history/{versionId}", tags=["Version History"])
+def get_version(id: int, versionId: int, if_none_match: Optional[str] = Header(None),
+                db: Session = Depends(database.get_db),
                 current_user: models.User = Depends(events.get_current_user)):
-    return events.get_event_version(id, versionId, current_user.id, db)
+    etag, body = events.get_event_version_body(id, versionId, current_user.id, db)
+    return etags.respond(body, etag, if_none_match)
 
 
-@app.post("/api/events/{id}/rollback/{versionId}", tags=["Version History"])
+@router.post("/api/events/{id}/rollback/{versionId}", tags=["Version History"])
 def rollback_version(id: int, versionId: int, db: Session = Depends(database.get_db),
                      current_user: models.User = Depends(events.get_current_user)):
     return events.rollback_event_to_version(id, versionId, current_user.id, db)
@@ -132,13 +311,48 @@ def rollback_version(id: int, versionId: int, db: Session = Depends(database.get
 # =======================================================================================================================
 
 
-@app.get("/api/events/{id}/changelog", tags=["Changelog"])
-def get_event_changelog(id: int, db: Session = Depends(database.get_db),
+@router.get("/api/events/{id}/changelog", tags=["Changelog"])
+def get_event_changelog(id: int, limit: Optional[int] = Query(None, ge=1), before: Optional[int] = None,
+                        db: Session = Depends(database.get_db),
                         current_user: models.User = Depends(events.get_current_user)):
-    return events.get_event_changelog(id, current_user.id, db)
+    return events.get_event_changelog(id, current_user.id, db, limit=limit, before=before)
 
 
-@app.get("/api/events/{id}/diff/{versionId1}/{versionId2}", tags=["Changelog"])
+@router.get("/api/events/{id}/diff/{versionId1}/{versionId2}", tags=["Changelog"])
 def get_event_diff(id: int, versionId1: int, versionId2: int, db: Session = Depends(database.get_db),
                    current_user: models.User = Depends(events.get_current_user)):
     return events.get_event_diff(id, versionId1, versionId2, current_user.id, db)
+
+# =======================================================================================================================
+# Internal APIs
+# =======================================================================================================================
+
+
+def _authorize_metrics(request: Request):
+    if METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "")
+        allowed = hmac.compare_digest(supplied.encode(), f"Bearer {METRICS_TOKEN}".encode())
+    else:
+        allowed = request.client is not None and request.client.host in LOOPBACK_HOSTS
+    if not allowed:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to read metrics")
+
+
+@router.get("/internal/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def internal_metrics(request: Request):
+    _authorize_metrics(request)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Both run on the event loop, so a saturated threadpool does not fail the probes
+@router.get("/health/live", include_in_schema=False)
+async def health_live():
+    return {"status": "ok"}
+
+
+@router.get("/health/ready", include_in_schema=False)
+async def health_ready():
+    if not lifecycle.is_ready():
+        status_text = "draining" if lifecycle.is_draining() else "starting"
+        return JSONResponse({"status": status_text}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"status": "ready"}
@@ -0,0 +1,202 @@
+import argparse
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from sqlalchemy import DateTime, bindparam, column, inspect, select, table as sql_table, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+
+from . import database, models, recurrence, versions
+
+# Any constant works, it only has to be the same in every replica
+MIGRATION_LOCK_KEY = 72406131
+BACKFILL_BATCH_SIZE = 1000
+
+
+def migrate(engine=None):
+    # Runs once per deploy, before the workers start. Concurrent runs on
+    # Postgres queue behind an advisory lock instead of racing on the DDL. Every
+    # step inspects the live schema first, so running it again changes nothing.
+    engine = engine or database.engine
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        existing = set(inspect(conn).get_table_names())
+        models.Base.metadata.create_all(bind=conn)
+        added = _add_missing_columns(conn, existing)
+
+        if ("event_versions", "version_number") in added:
+            _number_versions(conn)
+        if ("event_versions", "kind") in added:
+            conn.execute(text("UPDATE event_versions SET kind = 'snapshot' WHERE kind IS NULL"))
+        if ("event_versions", "changes") in added:
+            _backfill_changes(conn)
+        if ("refresh_tokens", "token_hash") in added or ("refresh_tokens", "expires_at") in added:
+            _backfill_refresh_tokens(conn)
+        if "token" in _columns(conn, "refresh_tokens"):
+            _drop_plaintext_tokens(conn)
+
+        _sync_indexes(conn)
+        if "event_occurrences" not in existing or ("event_occurrences", "long_end_time") in added:
+            _materialize_occurrences(conn)
+
+
+def _columns(conn, table: str):
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+# =======================================================================================================================
+# Columns
+# =======================================================================================================================
+
+
+def _add_missing_columns(conn, existing):
+    # Columns are added nullable unless they have a server default; NOT NULL
+    # is enforced by the steps that backfill them
+    added = set()
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        present = _columns(conn, table.name)
+        for column in table.columns:
+            if column.name in present:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg.text}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            conn.execute(text(ddl))
+            added.add((table.name, column.name))
+    return added
+
+
+def _number_versions(conn):
+    # History written before version numbers, numbered per event in write order
+    conn.execute(text(
+        "UPDATE event_versions SET version_number = numbered.number FROM ("
+        "SELECT id, row_number() OVER (PARTITION BY event_id ORDER BY timestamp, id) AS number "
+        "FROM event_versions WHERE event_id IS NOT NULL) AS numbered "
+        "WHERE numbered.id = event_versions.id"))
+
+
+def _backfill_changes(conn):
+    # Each version's changes against the one before, as add_version records them
+    table = models.EventVersion.__table__
+    rows = conn.execute(select(table.c.id, table.c.event_id, table.c.data).where(
+        table.c.event_id.isnot(None)).order_by(table.c.event_id, table.c.version_number))
+    statement = update(table).where(table.c.id == bindparam("version_id")).values(changes=bindparam("changes"))
+
+    batch, current_event, previous = [], None, None
+    for version_id, event_id, data in rows.fetchall():
+        snapshot = versions.load(data)
+        if event_id != current_event:
+            current_event, previous = event_id, None
+        batch.append({"version_id": version_id, "changes": versions.field_changes(previous, snapshot)})
+        previous = snapshot
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            conn.execute(statement, batch)
+            batch = []
+    if batch:
+        conn.execute(statement, batch)
+
+
+def _token_expiry(token: str, fallback: datetime):
+    # The exp claim, read without verifying the signature. Tokens it cannot be
+    # read from get `fallback` and are swept as expired.
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(token.split(".")[1] + "=="))
+        return datetime.utcfromtimestamp(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return fallback
+
+
+def _backfill_refresh_tokens(conn):
+    table = models.RefreshToken.__table__
+    # token is no longer mapped, so it is read through a lightweight table
+    baseline = sql_table("refresh_tokens", column("id"), column("token"), column("created_at", DateTime))
+    rows = conn.execute(select(baseline)).fetchall()
+    statement = update(table).where(table.c.id == bindparam("token_id")).values(
+        token_hash=bindparam("token_hash"), expires_at=bindparam("expires_at"))
+    now = datetime.utcnow()
+    for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+        conn.execute(statement, [
+            {"token_id": token_id, "token_hash": hashlib.sha256(token.encode()).hexdigest(),
+             "expires_at": _token_expiry(token, created_at or now)}
+            for token_id, token, created_at in rows[start:start + BACKFILL_BATCH_SIZE]])
+
+
+def _drop_plaintext_tokens(conn):
+    # Refresh tokens are only stored as digests now
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE refresh_tokens DROP COLUMN token"))
+        conn.execute(text("ALTER TABLE refresh_tokens ALTER COLUMN token_hash SET NOT NULL"))
+        conn.execute(text("ALTER TABLE refresh_tokens ALTER COLUMN expires_at SET NOT NULL"))
+        conn.execute(text(
+            "ALTER TABLE refresh_tokens ADD CONSTRAINT refresh_tokens_token_hash_key UNIQUE (token_hash)"))
+        return
+
+    # SQLite cannot drop a UNIQUE column or add constraints, so the table is rebuilt
+    table = models.RefreshToken.__table__
+    conn.execute(text("ALTER TABLE refresh_tokens RENAME TO refresh_tokens_old"))
+    for index in inspect(conn).get_indexes("refresh_tokens_old"):
+        conn.execute(text(f"DROP INDEX {index['name']}"))
+    table.create(conn)
+    columns = ", ".join(column.name for column in table.columns)
+    conn.execute(text(f"INSERT INTO refresh_tokens ({columns}) SELECT {columns} FROM refresh_tokens_old"))
+    conn.execute(text("DROP TABLE refresh_tokens_old"))
+
+# =======================================================================================================================
+# Indexes
+# =======================================================================================================================
+
+
+def _sync_indexes(conn):
+    # Creates the model's missing indexes and rebuilds those whose columns
+    # changed. Indexes following the ix_ naming that the models no longer
+    # define are dropped, such as ix_event_occurrences_event_id.
+    for table in models.Base.metadata.sorted_tables:
+        present = {index["name"]: index for index in inspect(conn).get_indexes(table.name)}
+        wanted = {index.name: index for index in table.indexes}
+        for name in present.keys() - wanted.keys():
+            if name.startswith("ix_"):
+                conn.execute(text(f"DROP INDEX {name}"))
+        for name, index in sorted(wanted.items()):
+            current = present.get(name)
+            if current is not None:
+                if (current["column_names"] == [column.name for column in index.columns]
+                        and bool(current["unique"]) == bool(index.unique)):
+                    continue
+                conn.execute(text(f"DROP INDEX {name}"))
+            conn.execute(CreateIndex(index))
+
+# =======================================================================================================================
+# Data
+# =======================================================================================================================
+
+
+def _materialize_occurrences(conn):
+    # Events written before event_occurrences existed, or before long_end_time
+    db = Session(bind=conn)
+    last_id = 0
+    while True:
+        batch = db.query(models.Event).filter(models.Event.id > last_id).order_by(
+            models.Event.id).limit(BACKFILL_BATCH_SIZE).all()
+        if not batch:
+            break
+        for event in batch:
+            recurrence.materialize(db, event)
+        db.flush()
+        last_id = batch[-1].id
+    db.close()
+
+
+def main():
+    argparse.ArgumentParser(description="Create or upgrade the database schema").parse_args()
+    migrate()
+    print("Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
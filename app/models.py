@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Index, LargeBinary, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -21,32 +21,49 @@ class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
 
     id = Column(Integer, primary_key=True, index=True)
-    token = Column(String, unique=True, nullable=False)
+    token_hash = Column(String(64), unique=True, nullable=False)  # SHA-256 hex digest of the JWT
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
     user = relationship("User", back_populates="tokens")
 
 
 class Event(Base):
     __tablename__ = "events"
+    __table_args__ = (
+        Index("ix_events_start_time_id", "start_time", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String)
     description = Column(String)
     start_time = Column(DateTime)
     end_time = Column(DateTime)
-    location = Column(String)
+    location = Column(String, index=True)
     is_recurring = Column(String)
     recurrence_pattern = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # Range of materialized occurrences, NULL when all of them are materialized
+    occurrences_from = Column(DateTime)
+    occurrences_until = Column(DateTime)
+    # Bumped by the ORM on every update, doubles as the ETag and the optimistic lock
+    revision = Column(Integer, nullable=False, default=1, server_default=text("1"))
 
     owner = relationship("User", back_populates="events")
     permissions = relationship("EventPermission", back_populates="event")
     versions = relationship("EventVersion", back_populates="event")
 
+    __mapper_args__ = {"version_id_col": revision}
+
 
 class EventPermission(Base):
     __tablename__ = "event_permissions"
+    __table_args__ = (
+        Index("ix_event_permissions_event_user",
+              "event_id", "user_id", unique=True),
+        Index("ix_event_permissions_user_role_event",
+              "user_id", "role", "event_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     event_id = Column(Integer, ForeignKey("events.id"))
@@ -57,12 +74,113 @@ class EventPermission(Base):
     user = relationship("User", back_populates="permissions")
 
 
+class Group(Base):
+    __tablename__ = "groups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"))
+
+
+class GroupMember(Base):
+    __tablename__ = "group_members"
+    __table_args__ = (
+        Index("ix_group_members_group_user", "group_id", "user_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+
+
+class GroupNesting(Base):
+    __tablename__ = "group_nesting"
+    __table_args__ = (
+        Index("ix_group_nesting_parent_child", "parent_id", "child_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    parent_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
+    child_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False, index=True)
+
+
+class GroupClosure(Base):
+    # Every group a user belongs to, directly or through nested groups.
+    # Derived from group_members and group_nesting, rebuilt per user on change.
+    __tablename__ = "group_closure"
+    __table_args__ = (
+        Index("ix_group_closure_user_group", "user_id", "group_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False, index=True)
+
+
+class EventGroupPermission(Base):
+    __tablename__ = "event_group_permissions"
+    __table_args__ = (
+        Index("ix_event_group_permissions_event_group", "event_id", "group_id", unique=True),
+        Index("ix_event_group_permissions_group_event", "group_id", "event_id", "role"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
+    role = Column(String, nullable=False)
+
+
 class EventVersion(Base):
     __tablename__ = "event_versions"
+    __table_args__ = (
+        Index("ix_event_versions_event_number",
+              "event_id", "version_number", unique=True),
+        # Covers the archival scans by time: the events with versions before the
+        # cutoff, and each event's last version number before it. The changelog
+        # is served by ix_event_versions_event_number. Plain key columns rather
+        # than postgresql_include, which would load the Postgres dialect on every import.
+        Index("ix_event_versions_event_timestamp", "event_id", "timestamp", "id", "version_number"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     event_id = Column(Integer, ForeignKey("events.id"))
-    data = Column(JSON)  # Store full snapshot of event data
+    version_number = Column(Integer)  # Monotonic per event
+    kind = Column(String, default="snapshot")  # "snapshot" or "delta"
+    data = Column(JSON)  # Full snapshot, or only the changed fields for a delta
+    changes = Column(JSON)  # {field: {"from": old, "to": new}} against the previous version
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     event = relationship("Event", back_populates="versions")
+
+
+class EventVersionArchive(Base):
+    # Versions moved out of event_versions by app.archive, under their original ids
+    __tablename__ = "event_version_archive"
+    __table_args__ = (
+        Index("ix_event_version_archive_event_number", "event_id", "version_number"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer)
+    version_number = Column(Integer)
+    timestamp = Column(DateTime)
+    codec = Column(String, nullable=False)  # "zstd" or "zlib"
+    payload = Column(LargeBinary, nullable=False)  # Compressed JSON {"data": ..., "changes": ...}
+
+
+class EventOccurrence(Base):
+    __tablename__ = "event_occurrences"
+    __table_args__ = (
+        Index("ix_event_occurrences_start_end", "start_time", "end_time"),
+        # Window lookups seek each accessible event and read only its occurrences in range
+        Index("ix_event_occurrences_event_start", "event_id", "start_time", "end_time"),
+        Index("ix_event_occurrences_event_long_end", "event_id", "long_end_time"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, ForeignKey("events.id"))
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    # Only set for occurrences longer than recurrence.LONG_OCCURRENCE, which window
+    # queries find through an index on it rather than by scanning back on start_time
+    long_end_time = Column(DateTime)
@@ -0,0 +1,304 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+
+from . import metrics, permissions, schemas
+
+EVENT_STREAM_QUEUE_SIZE = int(os.getenv("EVENT_STREAM_QUEUE_SIZE", 100))
+# "drop_oldest" keeps the connection and tells the client how much it missed,
+# "disconnect" closes the stream so the client reconnects and refetches
+EVENT_STREAM_SLOW_POLICY = os.getenv("EVENT_STREAM_SLOW_POLICY", "drop_oldest")
+EVENT_STREAM_HEARTBEAT = float(os.getenv("EVENT_STREAM_HEARTBEAT", 15))
+# Set when running several workers so every worker sees every notification
+EVENT_STREAM_REDIS_URL = os.getenv("EVENT_STREAM_REDIS_URL")
+
+logger = logging.getLogger(__name__)
+
+DROPPED_NOTIFICATIONS = metrics.Counter(
+    "event_stream_dropped_total", "Notifications discarded because a subscriber fell behind", ["policy"])
+FANOUT_ERRORS = metrics.Counter(
+    "event_stream_fanout_errors_total", "Failed publishes to, and lost connections from, the shared channel",
+    ["operation"])
+
+_CLOSE = object()
+_SHUTDOWN = object()
+
+
+class Subscriber:
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop, maxsize: int = EVENT_STREAM_QUEUE_SIZE,
+                 policy: str = EVENT_STREAM_SLOW_POLICY):
+        self.user_id = user_id
+        self.loop = loop
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, message):
+        # Runs on the subscriber's loop, never blocks the publisher
+        if self.closed:
+            return
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+            return
+
+        DROPPED_NOTIFICATIONS.inc(policy=self.policy)
+        if self.policy == "disconnect":
+            self.closed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(_CLOSE)
+        else:
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+            self.dropped += 1
+
+    def close(self):
+        # The worker is shutting down, end the stream so the client reconnects elsewhere
+        if self.closed:
+            return
+        self.closed = True
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_SHUTDOWN)
+
+
+class Broker:
+    # Subscribers are indexed by user so a notification only visits the
+    # subscribers in its audience
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int, loop: Optional[asyncio.AbstractEventLoop] = None, **options) -> Subscriber:
+        subscriber = Subscriber(user_id, loop or asyncio.get_running_loop(), **options)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.user_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(subscriber.user_id, None)
+
+    def deliver(self, message: dict):
+        # Safe to call from any thread
+        with self._lock:
+            targets = [s for user_id in message["audience"] for s in self._subscribers.get(user_id, ())]
+        for subscriber in targets:
+            subscriber.loop.call_soon_threadsafe(subscriber.offer, message)
+
+    def close_all(self):
+        with self._lock:
+            targets = [s for subscribers in self._subscribers.values() for s in subscribers]
+        for subscriber in targets:
+            subscriber.loop.call_soon_threadsafe(subscriber.close)
+
+    def __len__(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+class LocalFanout:
+    # Single worker: notifications only need to reach this process
+    def __init__(self, broker: Broker):
+        self.broker = broker
+
+    def has_listeners(self) -> bool:
+        return len(self.broker) > 0
+
+    def listeners_changed(self):
+        pass
+
+    def publish(self, message: dict):
+        self.broker.deliver(message)
+
+
+class RedisFanout:
+    # Several workers: every process publishes to a redis channel and delivers
+    # what it receives to its own subscribers. Workers also announce on the
+    # channel whether they have subscribers at all, so a mutation only computes
+    # its audience when some worker will deliver it. A crashed worker's
+    # announcement lingers until the others reconnect, which only costs extra
+    # audience queries.
+    def __init__(self, client, broker: Broker, channel: str = "event-notifications",
+                 reconnect_delay: float = 0.5, max_reconnect_delay: float = 30.0):
+        self.client = client
+        self.broker = broker
+        self.channel = channel
+        self.worker_id = uuid.uuid4().hex
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._listening: Set[str] = set()
+        self._announced = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._pubsub = None
+        self._thread = None
+
+    def has_listeners(self) -> bool:
+        return len(self.broker) > 0 or bool(self._listening)
+
+    def publish(self, message: dict):
+        # Runs after the commit: a failure is logged, never turned into an error
+        # for a change that is already stored
+        try:
+            self.client.publish(self.channel, json.dumps(message))
+        except Exception:
+            FANOUT_ERRORS.inc(operation="publish")
+            logger.exception("Could not publish to the notification channel %s", self.channel)
+
+    def listeners_changed(self):
+        with self._lock:
+            listening = len(self.broker) > 0
+            if listening == self._announced:
+                return
+            self._announced = listening
+        self.publish({"presence": self.worker_id, "listening": listening})
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+
+    def _listen(self):
+        delay = self.reconnect_delay
+        while not self._stopped.is_set():
+            try:
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.subscribe(self.channel)
+                # Announcements made while disconnected were missed, ask again
+                self._listening = set()
+                self._announced = False
+                self.publish({"presence_query": self.worker_id})
+                self.listeners_changed()
+                delay = self.reconnect_delay
+                for item in self._pubsub.listen():
+                    self._receive(json.loads(item["data"]))
+            except Exception:
+                if self._stopped.is_set():
+                    return
+                FANOUT_ERRORS.inc(operation="listen")
+                logger.exception("Lost the notification channel %s, reconnecting in %.1fs", self.channel, delay)
+            self._stopped.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _receive(self, message: dict):
+        if "presence" in message:
+            if message["listening"]:
+                self._listening.add(message["presence"])
+            else:
+                self._listening.discard(message["presence"])
+        elif "presence_query" in message:
+            if len(self.broker) > 0:
+                self.publish({"presence": self.worker_id, "listening": True})
+        else:
+            self.broker.deliver(message)
+
+
+broker = Broker()
+_backend = LocalFanout(broker)
+# Message ids are unique across workers: this process's prefix plus a counter
+_id_prefix = uuid.uuid4().hex[:12]
+_ids = itertools.count(1)
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+def configure():
+    if not EVENT_STREAM_REDIS_URL:
+        return
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("EVENT_STREAM_REDIS_URL is set but the redis package is not installed")
+    backend = RedisFanout(redis.Redis.from_url(EVENT_STREAM_REDIS_URL), broker)
+    backend.start()
+    set_backend(backend)
+
+
+def close_streams():
+    broker.close_all()
+
+
+def has_listeners() -> bool:
+    # Lets publishers skip computing the audience when nobody is listening
+    return _backend.has_listeners()
+
+
+def publish(kind: str, event_id: int, audience: Iterable[int], event=None):
+    _backend.publish({"id": f"{_id_prefix}-{next(_ids)}", "type": kind, "event_id": event_id,
+                      "event": jsonable_encoder(event), "audience": sorted(set(audience))})
+
+
+def notify(db: Session, kind: str, event_id: int, event=None, audience: Optional[List[int]] = None):
+    # Called after commit, so subscribers never hear about changes that were rolled back
+    if not has_listeners():
+        return
+    if audience is None:
+        audience = permissions.event_audience(db, event_id)
+    publish(kind, event_id, audience, event and schemas.EventOut.model_validate(event))
+
+
+def subscribe(user_id: int, loop: Optional[asyncio.AbstractEventLoop] = None, **options) -> Subscriber:
+    subscriber = broker.subscribe(user_id, loop, **options)
+    _backend.listeners_changed()
+    return subscriber
+
+
+def unsubscribe(subscriber: Subscriber):
+    broker.unsubscribe(subscriber)
+    _backend.listeners_changed()
+
+
+def _frame(kind: str, data: dict, message_id=None) -> str:
+    head = f"id: {message_id}\n" if message_id is not None else ""
+    return f"{head}event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream(subscriber: Subscriber, is_disconnected, heartbeat: float = EVENT_STREAM_HEARTBEAT):
+    try:
+        while not await is_disconnected():
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if message is _CLOSE:
+                yield _frame("overflow", {"disconnected": True})
+                return
+            if message is _SHUTDOWN:
+                yield _frame("shutdown", {})
+                return
+            if subscriber.dropped:
+                yield _frame("overflow", {"dropped": subscriber.dropped})
+                subscriber.dropped = 0
+            yield _frame(message["type"], {key: value for key, value in message.items() if key != "audience"},
+                         message["id"])
+    finally:
+        unsubscribe(subscriber)
@@ -0,0 +1,156 @@
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import and_, case, func, literal, or_, select, union, union_all
+from sqlalchemy.orm import Session
+import os
+
+from . import invalidation, models
+from .cache import TTLCache, publish_stats
+
+# Roles are cached per process. Changes invalidate the affected entries right
+# away, in this worker and, through app.invalidation, in every other one.
+PERMISSION_CACHE_TTL = float(os.getenv("PERMISSION_CACHE_TTL", 30))
+PERMISSION_CACHE_MAXSIZE = int(os.getenv("PERMISSION_CACHE_MAXSIZE", 50000))
+
+# A user granted an event both directly and through groups gets the strongest role
+ROLE_RANKS = {"Viewer": 1, "Editor": 2, "Owner": 3}
+_ROLES_BY_RANK = {rank: role for role, rank in ROLE_RANKS.items()}
+
+_roles = TTLCache(maxsize=PERMISSION_CACHE_MAXSIZE, ttl=PERMISSION_CACHE_TTL)
+
+
+def _grants(user_id: int, event_id: Optional[int] = None):
+    # Direct grants plus grants to any group in the user's precomputed closure
+    direct = select(models.EventPermission.event_id, models.EventPermission.role).where(
+        models.EventPermission.user_id == user_id)
+    via_groups = select(models.EventGroupPermission.event_id, models.EventGroupPermission.role).join(
+        models.GroupClosure, models.GroupClosure.group_id == models.EventGroupPermission.group_id).where(
+        models.GroupClosure.user_id == user_id)
+    if event_id is not None:
+        direct = direct.where(models.EventPermission.event_id == event_id)
+        via_groups = via_groups.where(models.EventGroupPermission.event_id == event_id)
+    return union_all(direct, via_groups).subquery()
+
+
+def accessible_events(user_id: int, role: Optional[str] = None, event_id: Optional[int] = None):
+    # Subquery of (event_id, rank) for every event the user can see. It groups all
+    # of the user's grants, so queries over many events use can_access instead.
+    grants = _grants(user_id, event_id)
+    rank = func.max(case(ROLE_RANKS, value=grants.c.role))
+    query = select(grants.c.event_id, rank.label("rank")).where(
+        grants.c.event_id.isnot(None)).group_by(grants.c.event_id)
+    if role:
+        query = query.having(rank == ROLE_RANKS[role])
+    return query.subquery()
+
+
+def accessible_event_ids(user_id: int):
+    # Every event id the user can reach, possibly repeated, for `event_id IN (...)`
+    direct = select(models.EventPermission.event_id).where(models.EventPermission.user_id == user_id)
+    via_groups = select(models.EventGroupPermission.event_id).join(
+        models.GroupClosure, models.GroupClosure.group_id == models.EventGroupPermission.group_id).where(
+        models.GroupClosure.user_id == user_id)
+    return union_all(direct, via_groups)
+
+
+def _has_grant(user_id: int, event_id, roles: Optional[List[str]] = None):
+    direct = select(literal(1)).where(models.EventPermission.event_id == event_id,
+                                      models.EventPermission.user_id == user_id)
+    via_groups = select(literal(1)).select_from(models.EventGroupPermission).join(
+        models.GroupClosure, models.GroupClosure.group_id == models.EventGroupPermission.group_id).where(
+        models.EventGroupPermission.event_id == event_id, models.GroupClosure.user_id == user_id)
+    if roles:
+        direct = direct.where(models.EventPermission.role.in_(roles))
+        via_groups = via_groups.where(models.EventGroupPermission.role.in_(roles))
+    return or_(direct.exists(), via_groups.exists())
+
+
+def can_access(user_id: int, event_id=models.Event.id, role: Optional[str] = None):
+    # Row filter for queries over events. Each row costs two index probes, on
+    # (event_id, user_id) and on (event_id, group_id), so the query's own index
+    # drives the scan and a LIMIT stops it, whatever the user's number of grants.
+    # With a role, the user's strongest role on the event must be exactly that one.
+    if not role:
+        return _has_grant(user_id, event_id)
+    stronger = [other for other, rank in ROLE_RANKS.items() if rank > ROLE_RANKS[role]]
+    condition = _has_grant(user_id, event_id, [role])
+    if stronger:
+        condition = and_(condition, ~_has_grant(user_id, event_id, stronger))
+    return condition
+
+
+def get_role(db: Session, event_id: int, user_id: int) -> Optional[str]:
+    key = (event_id, user_id)
+    role = _roles.get(key)
+    if role is not None:
+        return role
+
+    role = _ROLES_BY_RANK.get(db.execute(
+        select(accessible_events(user_id, event_id=event_id).c.rank)).scalar())
+    if role is not None:
+        _roles.set(key, role)
+    return role
+
+
+def get_event_with_role(db: Session, event_id: int, user_id: int) -> Tuple[Optional[str], Optional[models.Event]]:
+    # Permission and event in one round trip. A missing row means no access,
+    # a row without an event means the event no longer exists.
+    ranks = accessible_events(user_id, event_id=event_id)
+    row = db.query(ranks.c.rank, models.Event).outerjoin(
+        models.Event, models.Event.id == ranks.c.event_id).first()
+    if not row:
+        return None, None
+
+    rank, event = row
+    role = _ROLES_BY_RANK.get(rank)
+    if role is not None:
+        _roles.set((event_id, user_id), role)
+    return role, event
+
+
+def event_audience(db: Session, event_id: int) -> List[int]:
+    # Every user who can see the event, directly or through a group
+    direct = select(models.EventPermission.user_id).where(models.EventPermission.event_id == event_id)
+    via_groups = select(models.GroupClosure.user_id).join(
+        models.EventGroupPermission, models.EventGroupPermission.group_id == models.GroupClosure.group_id).where(
+        models.EventGroupPermission.event_id == event_id)
+    return list(db.scalars(union(direct, via_groups)))
+
+
+def invalidate(event_id: int, user_id: int):
+    invalidation.broadcast("permissions.role", event_id, user_id)
+
+
+def invalidate_event(event_id: int):
+    invalidation.broadcast("permissions.event", event_id)
+
+
+def invalidate_users(user_ids: Iterable[int]):
+    invalidation.broadcast("permissions.users", sorted(set(user_ids)))
+
+
+@invalidation.handler("permissions.role")
+def _forget_role(event_id: int, user_id: int):
+    _roles.delete((event_id, user_id))
+
+
+@invalidation.handler("permissions.event")
+def _forget_event(event_id: int):
+    _roles.delete_matching(lambda key: key[0] == event_id)
+
+
+@invalidation.handler("permissions.users")
+def _forget_users(user_ids: List[int]):
+    user_ids = set(user_ids)
+    _roles.delete_matching(lambda key: key[1] in user_ids)
+
+
+@invalidation.on_reset
+def clear_cache():
+    _roles.clear()
+
+
+def cache_stats():
+    return _roles.stats()
+
+
+publish_stats("permission_roles", cache_stats)
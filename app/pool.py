@@ -0,0 +1,104 @@
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+import os
+import time
+import weakref
+
+from . import metrics
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+POOL_CHECKOUT_WAIT = metrics.Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["pool"])
+POOL_TIMEOUTS = metrics.Counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT", ["pool"])
+
+_pools = weakref.WeakValueDictionary()
+
+
+def _pool_gauge(read):
+    return lambda: {(name,): read(pool) for name, pool in list(_pools.items())}
+
+
+metrics.Gauge("db_pool_connections_in_use", "Connections currently checked out", ["pool"],
+              callback=_pool_gauge(lambda pool: pool.checkedout()))
+metrics.Gauge("db_pool_overflow", "Connections open beyond DB_POOL_SIZE", ["pool"],
+              callback=_pool_gauge(lambda pool: max(0, pool.overflow())))
+metrics.Gauge("db_pool_size", "Configured number of persistent connections", ["pool"],
+              callback=_pool_gauge(lambda pool: pool.size()))
+
+
+class _InstrumentedPoolMixin:
+    metrics_name = "sync"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc(pool=self.metrics_name)
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(
+                time.perf_counter() - started, pool=self.metrics_name)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metrics_name = "sync"
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+def engine_options(url: str, is_async: bool = False):
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite keeps a single connection per thread, there is no queue to size
+        return options
+
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return options
+
+
+def register(engine, name: str):
+    # Makes the engine's pool visible to the gauges above
+    _pools[name] = engine.pool
+    return engine
+
+
+def warm(engine, connections: int = DB_POOL_SIZE):
+    # Opens the persistent connections up front so the first requests after a
+    # deploy do not each pay for a connect
+    held = []
+    try:
+        for _ in range(connections):
+            conn = engine.connect()
+            held.append(conn)
+            conn.exec_driver_sql("SELECT 1")
+    finally:
+        for conn in held:
+            conn.close()
+
+
+async def warm_async(engine, connections: int = DB_POOL_SIZE):
+    held = []
+    try:
+        for _ in range(connections):
+            conn = await engine.connect()
+            held.append(conn)
+            await conn.exec_driver_sql("SELECT 1")
+    finally:
+        for conn in held:
+            await conn.close()
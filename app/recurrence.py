@@ -0,0 +1,248 @@
+import argparse
+import calendar
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional, Tuple
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.orm import Session
+
+from . import models, permissions
+
+# Occurrences of recurring events are materialized from RECURRENCE_LOOKBACK_DAYS
+# in the past to RECURRENCE_HORIZON_DAYS ahead. Windows outside that range are
+# expanded on the fly. Run `python -m app.recurrence` periodically to roll the
+# horizon forward.
+RECURRENCE_HORIZON_DAYS = int(os.getenv("RECURRENCE_HORIZON_DAYS", 365))
+RECURRENCE_LOOKBACK_DAYS = int(os.getenv("RECURRENCE_LOOKBACK_DAYS", 90))
+
+# Window queries scan start_time from this far before the window. Longer
+# occurrences are flagged with long_end_time and looked up through its index.
+# Changing it needs the existing occurrences rematerialized.
+LONG_OCCURRENCE = timedelta(days=7)
+
+# Larger values are rejected, they only ever step past datetime.max
+RECURRENCE_MAX_INTERVAL = 1000
+RECURRENCE_MAX_COUNT = 10000
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+
+def naive_utc(value: Optional[datetime]):
+    # Event times are stored as naive UTC
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def is_recurring(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+def parse_rule(pattern: Optional[str]):
+    """Parse the RRULE subset we support, e.g. "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE;COUNT=10".
+
+    A bare frequency such as "weekly" is accepted too. Returns None when the
+    pattern cannot be interpreted.
+    """
+    if not pattern:
+        return None
+    pattern = pattern.strip()
+    if pattern.upper().startswith("RRULE:"):
+        pattern = pattern[6:]
+    if pattern.upper() in FREQUENCIES:
+        pattern = f"FREQ={pattern}"
+
+    try:
+        parts = dict(part.split("=", 1) for part in pattern.upper().split(";") if part)
+        rule = {"freq": parts["FREQ"], "interval": int(parts.get("INTERVAL", 1)),
+                "count": int(parts["COUNT"]) if "COUNT" in parts else None, "until": None, "byday": None}
+        if "UNTIL" in parts:
+            until = parts["UNTIL"].rstrip("Z")
+            rule["until"] = datetime.strptime(until, "%Y%m%dT%H%M%S" if "T" in until else "%Y%m%d")
+        if "BYDAY" in parts:
+            rule["byday"] = sorted(WEEKDAYS.index(day) for day in parts["BYDAY"].split(","))
+    except (KeyError, ValueError):
+        return None
+    if rule["freq"] not in FREQUENCIES or not 1 <= rule["interval"] <= RECURRENCE_MAX_INTERVAL:
+        return None
+    if rule["count"] is not None and not 1 <= rule["count"] <= RECURRENCE_MAX_COUNT:
+        return None
+    return rule
+
+
+def rule_for(event):
+    if not is_recurring(event.is_recurring) or not event.start_time or not event.end_time:
+        return None
+    return parse_rule(event.recurrence_pattern)
+
+
+def _add_months(start: datetime, months: int):
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    if start.day > calendar.monthrange(year, month)[1]:
+        return None  # e.g. the 31st in a 30-day month is skipped, as in RFC 5545
+    return start.replace(year=year, month=month)
+
+
+def _candidate_starts(start: datetime, rule: dict) -> Iterator[datetime]:
+    # Unbounded rules end at datetime.max rather than raising from the date arithmetic
+    freq, interval = rule["freq"], rule["interval"]
+    step = 0
+    try:
+        while True:
+            if freq == "DAILY":
+                yield start + timedelta(days=step * interval)
+            elif freq == "WEEKLY" and rule["byday"]:
+                week_start = start - timedelta(days=start.weekday()) + timedelta(weeks=step * interval)
+                for weekday in rule["byday"]:
+                    candidate = week_start + timedelta(days=weekday)
+                    if candidate >= start:
+                        yield candidate
+            elif freq == "WEEKLY":
+                yield start + timedelta(weeks=step * interval)
+            else:
+                candidate = _add_months(start, step * interval * (12 if freq == "YEARLY" else 1))
+                if candidate:
+                    yield candidate
+            step += 1
+    except (OverflowError, ValueError):
+        return
+
+
+def iter_occurrences(start: datetime, end: datetime, rule: Optional[dict], window_start: Optional[datetime] = None,
+                     window_end: Optional[datetime] = None) -> Iterator[Tuple[datetime, datetime]]:
+    """Lazily yield (start, end) of every occurrence overlapping the window."""
+    duration = end - start
+    if rule is None:
+        if (window_end is None or start < window_end) and (window_start is None or end > window_start):
+            yield start, end
+        return
+
+    for n, occurrence_start in enumerate(_candidate_starts(start, rule)):
+        if rule["count"] is not None and n >= rule["count"]:
+            return
+        if rule["until"] is not None and occurrence_start > rule["until"]:
+            return
+        if window_end is not None and occurrence_start >= window_end:
+            return
+        try:
+            occurrence_end = occurrence_start + duration
+        except OverflowError:
+            return
+        if window_start is None or occurrence_end > window_start:
+            yield occurrence_start, occurrence_end
+
+
+def plan(start: datetime, end: datetime, rule: Optional[dict], now: Optional[datetime] = None):
+    """Occurrences to materialize for an event, and the range they cover.
+
+    The range is (None, None) when every occurrence has been materialized.
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    if rule is None:
+        return [(start, end)], None, None
+
+    now = now or datetime.utcnow()
+    covered_from = max(start, now - timedelta(days=RECURRENCE_LOOKBACK_DAYS))
+    covered_until = now + timedelta(days=RECURRENCE_HORIZON_DAYS)
+    occurrences = iter_occurrences(start, end, rule, window_start=covered_from)
+    rows, complete = [], covered_from == start
+    for occurrence in occurrences:
+        if occurrence[0] >= covered_until:
+            complete = False
+            break
+        rows.append(occurrence)
+    if complete:
+        return rows, None, None
+    return rows, covered_from, covered_until
+
+
+def occurrence_rows(event_id: int, occurrences):
+    return [{"event_id": event_id, "start_time": start, "end_time": end,
+             "long_end_time": end if end - start > LONG_OCCURRENCE else None} for start, end in occurrences]
+
+
+def overlapping(query, window_start: datetime, window_end: datetime):
+    # Ordinary occurrences are bounded on both sides of start_time, so the index is
+    # read from window_start - LONG_OCCURRENCE to window_end only. Long ones come
+    # from the (event_id, long_end_time) index in a second branch, which leaves the
+    # start_time < window_end check to the caller: with it in SQL, SQLite reads that
+    # branch from the start_time index instead.
+    occurrence = models.EventOccurrence
+    ordinary = query.filter(occurrence.long_end_time.is_(None),
+                            occurrence.start_time >= window_start - LONG_OCCURRENCE,
+                            occurrence.start_time < window_end, occurrence.end_time > window_start)
+    long_running = query.filter(occurrence.long_end_time > window_start)
+    return ordinary.union_all(long_running)
+
+
+def materialize(db: Session, event: models.Event, now: Optional[datetime] = None):
+    clear(db, event.id)
+    occurrences, event.occurrences_from, event.occurrences_until = plan(
+        event.start_time, event.end_time, rule_for(event), now)
+    if occurrences:
+        db.execute(insert(models.EventOccurrence), occurrence_rows(event.id, occurrences))
+
+
+def clear(db: Session, event_id: int):
+    db.query(models.EventOccurrence).filter_by(event_id=event_id).delete(synchronize_session=False)
+
+
+def query_window(db: Session, user_id: int, window_start: datetime, window_end: datetime):
+    window_start, window_end = naive_utc(window_start), naive_utc(window_end)
+    accessible = permissions.accessible_event_ids(user_id)
+    # Recurring events whose materialized range does not cover the whole window
+    uncovered = and_(models.Event.occurrences_until.isnot(None),
+                     or_(models.Event.occurrences_from > window_start,
+                         models.Event.occurrences_until < window_end))
+
+    materialized = [row for row in overlapping(db.query(
+        models.EventOccurrence.start_time, models.EventOccurrence.end_time, models.Event).join(
+        models.Event, models.Event.id == models.EventOccurrence.event_id).filter(
+        models.EventOccurrence.event_id.in_(accessible), ~uncovered), window_start, window_end)
+        if row[0] < window_end]
+
+    expanded = []
+    for event in db.query(models.Event).filter(
+            models.Event.id.in_(accessible), uncovered, models.Event.start_time < window_end):
+        expanded.extend((start, end, event) for start, end in iter_occurrences(
+            event.start_time, event.end_time, rule_for(event), window_start, window_end))
+
+    occurrences = sorted(materialized + expanded, key=lambda row: (row[0], row[2].id))
+    return [{"event_id": event.id, "title": event.title, "location": event.location,
+             "start_time": start, "end_time": end} for start, end, event in occurrences]
+
+
+def refresh_all(db: Session, batch_size: int = 500):
+    # Rolls the materialized horizon forward for every recurring event
+    refreshed = 0
+    query = db.query(models.Event).filter(models.Event.occurrences_until.isnot(None)).order_by(models.Event.id)
+    last_id = 0
+    while True:
+        batch = query.filter(models.Event.id > last_id).limit(batch_size).all()
+        if not batch:
+            return refreshed
+        for event in batch:
+            materialize(db, event)
+        db.commit()
+        refreshed += len(batch)
+        last_id = batch[-1].id
+
+
+def main():
+    from .database import SessionLocal
+
+    argparse.ArgumentParser(description="Roll the materialized occurrence horizon forward").parse_args()
+    db = SessionLocal()
+    try:
+        count = refresh_all(db)
+    finally:
+        db.close()
+    print(f"Refreshed occurrences of {count} recurring event(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import hashlib
+import threading
+import time
+
+
+class BloomFilter:
+    def __init__(self, bits: int = 1 << 20, hashes: int = 7):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str):
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    """Revoked token identifiers until they expire.
+
+    The bloom filter answers the common "not revoked" case without touching
+    the exact set, which is only consulted on a (possibly false) positive.
+    Bloom filters cannot forget, so the filter is rebuilt from the exact set
+    once expired entries have been pruned.
+    """
+
+    def __init__(self, bits: int = 1 << 20, hashes: int = 7, prune_interval: float = 60.0, clock=time.time):
+        self._bits = bits
+        self._hashes = hashes
+        self._bloom = BloomFilter(bits, hashes)
+        self._exact = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._prune_interval = prune_interval
+        self._next_prune = clock() + prune_interval
+        self.bloom_negatives = 0
+        self.exact_checks = 0
+
+    def revoke(self, key: str, expires_at: float):
+        with self._lock:
+            self._exact[key] = max(expires_at, self._exact.get(key, 0))
+            self._bloom.add(key)
+
+    def is_revoked(self, key: str):
+        if key not in self._bloom:
+            self.bloom_negatives += 1
+            return False
+        self.exact_checks += 1
+        now = self._clock()
+        if now >= self._next_prune:
+            self.prune(now)
+        expires_at = self._exact.get(key)
+        return expires_at is not None and expires_at > now
+
+    def prune(self, now: float = None):
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._exact = {key: expires for key, expires in self._exact.items() if expires > now}
+            bloom = BloomFilter(self._bits, self._hashes)
+            for key in self._exact:
+                bloom.add(key)
+            self._bloom = bloom
+            self._next_prune = now + self._prune_interval
+
+    def __len__(self):
+        return len(self._exact)
@@ -0,0 +1,119 @@
+from datetime import datetime
+from typing import List
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, recurrence, schemas
+
+
+class IntervalTree:
+    """Static interval tree over half-open [start, end) intervals.
+
+    Items are kept sorted by start as an implicit balanced tree, each node
+    remembering the largest end in its subtree, so an overlap query visits
+    O(log n + k) nodes once the tree is built in O(n log n). It only pays off
+    when many queries share one tree, as the occurrences of a batch do.
+    """
+
+    def __init__(self, intervals):
+        self._items = sorted(intervals, key=lambda item: item[0])
+        self._max_end = [None] * len(self._items)
+        self._build(0, len(self._items))
+
+    def _build(self, lo: int, hi: int):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self._items[mid][1]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > max_end:
+                max_end = child
+        self._max_end[mid] = max_end
+        return max_end
+
+    def overlapping(self, start, end):
+        stack = [(0, len(self._items))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_end[mid] <= start:
+                continue  # everything below ends before the query starts
+            stack.append((lo, mid))
+            item_start, item_end, _ = self._items[mid]
+            if item_start < end:
+                if item_end > start:
+                    yield self._items[mid]
+                stack.append((mid + 1, hi))
+
+    def __len__(self):
+        return len(self._items)
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [{"start_time": start, "end_time": end} for start, end in merged]
+
+
+def find_conflicts(db: Session, user_id: int, start: datetime, end: datetime):
+    # The occurrence index already answers "what overlaps this window"
+    return recurrence.query_window(db, user_id, start, end)
+
+
+def visible_calendars(db: Session, requester_id: int, user_ids: List[int]):
+    # Free/busy is shared within groups: the requester sees their own calendar and
+    # those of users who belong, directly or through nesting, to one of their groups
+    own_groups = select(models.GroupClosure.group_id).where(models.GroupClosure.user_id == requester_id)
+    members = db.scalars(select(models.GroupClosure.user_id).where(
+        models.GroupClosure.group_id.in_(own_groups), models.GroupClosure.user_id.in_(user_ids)).distinct())
+    return set(members) | {requester_id}
+
+
+def free_busy(db: Session, requester_id: int, user_ids: List[int], start: datetime, end: datetime):
+    hidden = sorted(set(user_ids) - visible_calendars(db, requester_id, user_ids))
+    if hidden:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail={"message": "No shared group with these users", "user_ids": hidden})
+    return [{"user_id": user_id,
+             "busy": merge_intervals((o["start_time"], o["end_time"])
+                                     for o in recurrence.query_window(db, user_id, start, end))}
+            for user_id in user_ids]
+
+
+def batch_conflicts(db: Session, user_id: int, events: List[schemas.EventCreate]):
+    # Every planned occurrence of the new events, checked against the existing
+    # calendar in their overall window and against each other
+    planned = [(index, start, end) for index, event in enumerate(events)
+               for start, end in recurrence.plan(event.start_time, event.end_time, recurrence.rule_for(event))[0]]
+    if not planned:
+        return []
+
+    window_start = min(start for _, start, _ in planned)
+    window_end = max(end for _, _, end in planned)
+    existing = recurrence.query_window(db, user_id, window_start, window_end)
+    tree = IntervalTree([(o["start_time"], o["end_time"], {"event_id": o["event_id"]}) for o in existing] +
+                        [(start, end, {"batch_index": index}) for index, start, end in planned])
+
+    conflicts = {}
+    for index, start, end in planned:
+        for other_start, other_end, other in tree.overlapping(start, end):
+            if other.get("batch_index") == index:
+                continue
+            conflicts.setdefault(index, []).append(
+                {**other, "start_time": other_start, "end_time": other_end})
+    return [{"index": index, "conflicts": items} for index, items in sorted(conflicts.items())]
+
+
+def ensure_no_conflicts(conflicts):
+    if conflicts:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail={"message": "Event conflicts with existing events",
+                                    "conflicts": jsonable_encoder(conflicts)})
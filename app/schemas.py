@@ -39,6 +39,30 @@ class EventOut(EventCreate):
         from_attributes = True
 
 
+class BatchItemResult(BaseModel):
+    index: int
+    ok: bool
+    event: Optional[EventOut] = None
+    error: Optional[str] = None
+
+
+class OccurrenceOut(BaseModel):
+    event_id: int
+    title: Optional[str] = None
+    location: Optional[str] = None
+    start_time: datetime
+    end_time: datetime
+
+
+class TimeRange(BaseModel):
+    start_time: datetime
+    end_time: datetime
+
+
+class FreeBusyRequest(TimeRange):
+    user_ids: List[int]
+
+
 class ShareUser(BaseModel):
     user_id: int
     role: RoleEnum
@@ -48,6 +72,56 @@ class ShareRequest(BaseModel):
     users: List[ShareUser]
 
 
+class PermissionGrant(BaseModel):
+    event_id: int
+    user_id: int
+    role: RoleEnum
+
+
+class PermissionRevocation(BaseModel):
+    event_id: int
+    user_id: int
+
+
+class BulkPermissionRequest(BaseModel):
+    grants: List[PermissionGrant] = []
+    revocations: List[PermissionRevocation] = []
+
+
+class PermissionChangeResult(BaseModel):
+    action: str
+    event_id: int
+    user_id: int
+    role: Optional[RoleEnum] = None
+    status: str
+
+
+class GroupCreate(BaseModel):
+    name: str
+
+
+class GroupOut(GroupCreate):
+    id: int
+    owner_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class GroupMembersRequest(BaseModel):
+    user_ids: List[int] = []
+    group_ids: List[int] = []
+
+
+class ShareGroup(BaseModel):
+    group_id: int
+    role: RoleEnum
+
+
+class GroupShareRequest(BaseModel):
+    groups: List[ShareGroup]
+
+
 class EventPermissionOut(BaseModel):
     user_id: int
     role: RoleEnum
@@ -0,0 +1,52 @@
+import json
+from datetime import date, datetime
+from typing import Iterable, Mapping
+
+from . import instrumentation
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder produces the same bytes
+    orjson = None
+
+# Field order of schemas.EventOut on the wire: EventCreate's fields, then id and owner_id
+EVENT_OUT_FIELDS = ("title", "description", "start_time", "end_time", "location", "is_recurring",
+                    "recurrence_pattern", "id", "owner_id")
+
+# is_recurring is stored as text, these are the strings Pydantic reads as True
+_TRUE_STRINGS = frozenset(("1", "on", "t", "true", "y", "yes"))
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() in _TRUE_STRINGS
+    return bool(value)
+
+
+def _default(value):
+    # Pydantic writes a zero UTC offset as "Z"
+    if isinstance(value, datetime):
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    with instrumentation.timed_serialization():
+        if orjson is not None:
+            return orjson.dumps(payload, option=orjson.OPT_UTC_Z)
+        return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def event_out(row: Mapping) -> dict:
+    # Plain dict with the same keys and values EventOut would produce, from
+    # a row mapping or a dict holding the EVENT_OUT_COLUMNS
+    payload = {field: row[field] for field in EVENT_OUT_FIELDS}
+    payload["is_recurring"] = _as_bool(payload["is_recurring"])
+    return payload
+
+
+def dump_events(rows: Iterable[Mapping]) -> bytes:
+    return dumps([event_out(row) for row in rows])
@@ -0,0 +1,86 @@
+import argparse
+import math
+import os
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from . import hashing, invalidation
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+# Seconds a stopping worker waits for in-flight requests before cancelling them
+GRACEFUL_SHUTDOWN_TIMEOUT = float(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", 30))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cpus = os.cpu_count() or 1
+    # A cgroup v2 quota (docker --cpus, Kubernetes limits) caps what the affinity mask reports
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def default_workers() -> int:
+    # One worker per CPU: each has an event loop plus a threadpool for the sync
+    # routes, and bcrypt runs in a process pool of its own. Without a shared
+    # invalidation channel the workers' caches would drift apart, so one worker.
+    configured = int(os.getenv("WEB_CONCURRENCY") or 0)
+    if configured:
+        return configured
+    return available_cpus() if invalidation.INVALIDATION_REDIS_URL else 1
+
+
+def configure_hash_workers(workers: int) -> int:
+    # The workers share the CPUs, so each gets its share of bcrypt processes.
+    # Inherited through the environment like BCRYPT_ROUNDS.
+    if "PASSWORD_HASH_WORKERS" not in os.environ:
+        hashing.PASSWORD_HASH_WORKERS = max(1, available_cpus() // workers)
+        os.environ["PASSWORD_HASH_WORKERS"] = str(hashing.PASSWORD_HASH_WORKERS)
+    return hashing.PASSWORD_HASH_WORKERS
+
+
+class DrainingServer(uvicorn.Server):
+    def handle_exit(self, sig, frame):
+        # Flip readiness and end event streams first, then let uvicorn stop
+        # accepting and wait for the in-flight requests
+        from . import lifecycle
+
+        lifecycle.begin_drain()
+        super().handle_exit(sig, frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with several worker processes")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None, help="defaults to WEB_CONCURRENCY or the CPU count")
+    args = parser.parse_args()
+
+    workers = args.workers or default_workers()
+    if workers > 1 and not invalidation.INVALIDATION_REDIS_URL:
+        parser.error("several workers need INVALIDATION_REDIS_URL or EVENT_STREAM_REDIS_URL, so that token "
+                     "revocations and cache invalidations reach every worker")
+    hashing.configure_rounds()
+    configure_hash_workers(workers)
+    config = uvicorn.Config("app.main:create_app", factory=True, host=args.host, port=args.port,
+                            workers=workers, log_level=LOG_LEVEL,
+                            timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT, proxy_headers=True)
+    server = DrainingServer(config)
+    if config.workers > 1:
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    main()
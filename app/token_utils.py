@@ -1,16 +1,20 @@
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import jwt, JWTError
-from dotenv import load_dotenv
+from functools import lru_cache
+import hashlib
 import os
+import time
+import uuid
 
-load_dotenv()
+from . import hashing, invalidation
+from .cache import TTLCache
+from .revocation import RevocationList
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 REFRESH_SECRET_KEY = os.getenv("REFRESH_SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_EXPIRE_MIN = int(os.getenv("ACCESS_EXPIRE_MIN", 15))
 REFRESH_EXPIRE_MIN = int(os.getenv("REFRESH_EXPIRE_MIN", 60 * 24))
+TOKEN_CACHE_MAXSIZE = int(os.getenv("TOKEN_CACHE_MAXSIZE", 10000))
 
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY not found in .env file")
@@ -19,26 +23,78 @@ if not REFRESH_SECRET_KEY:
 if not ALGORITHM:
     raise ValueError("ALGORITHM not found in .env file")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Access tokens that already passed signature and expiry checks, kept until they
+# expire. Revocations are checked after this cache, so it never needs invalidating.
+_verified_tokens = TTLCache(maxsize=TOKEN_CACHE_MAXSIZE, ttl=ACCESS_EXPIRE_MIN * 60)
+# Revoked session ids ("sid") and token ids ("jti"). Each worker keeps its own
+# list, filled through app.invalidation, which also replays them to workers
+# that start later.
+revoked = RevocationList()
 
 
 def hash_password(password: str):
-    return pwd_context.hash(password)
+    return hashing.hash_password(password)
 
 
 def verify_password(plain: str, hashed: str):
-    return pwd_context.verify(plain, hashed)
+    return hashing.verify_password(plain, hashed)
+
+
+@lru_cache(maxsize=8)
+def _prepared_key(secret: str):
+    # jose would otherwise try to parse the secret as a JWK and build a key object on every call
+    from jose import jwk
+    return jwk.construct(secret, ALGORITHM)
 
 
 def create_token(data: dict, expire_minutes: int, secret: str):
+    # jose and cryptography are imported on first use, they are slow to load
+    from jose import jwt
     to_encode = data.copy()
     to_encode.update({"exp": datetime.utcnow() +
-                     timedelta(minutes=expire_minutes)})
+                     timedelta(minutes=expire_minutes), "jti": uuid.uuid4().hex})
     return jwt.encode(to_encode, secret, algorithm=ALGORITHM)
 
 
+def token_digest(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
 def decode_token(token: str, secret: str):
+    from jose import JWTError, jwt
     try:
-        return jwt.decode(token, secret, algorithms=[ALGORITHM])
+        return jwt.decode(token, _prepared_key(secret), algorithms=[ALGORITHM])
     except JWTError:
         return None
+
+
+def verify_access_token(token: str):
+    payload = _verified_tokens.get(token)
+    if payload is None:
+        payload = decode_token(token, SECRET_KEY)
+        if not payload:
+            return None
+        _verified_tokens.set(token, payload, ttl=payload["exp"] - time.time())
+
+    if payload["exp"] <= time.time():
+        return None
+    for key in (payload.get("sid"), payload.get("jti")):
+        if key and revoked.is_revoked(key):
+            return None
+    return payload
+
+
+def revoke_session(session_id: str):
+    # Access tokens of the session stay valid for at most ACCESS_EXPIRE_MIN, remember it that long
+    if session_id:
+        expires_at = time.time() + ACCESS_EXPIRE_MIN * 60
+        invalidation.broadcast("tokens.revoke", session_id, expires_at, until=expires_at)
+
+
+@invalidation.handler("tokens.revoke")
+def _revoke(key: str, expires_at: float):
+    revoked.revoke(key, expires_at)
@@ -0,0 +1,82 @@
+from typing import NamedTuple, Optional
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+import os
+
+from . import invalidation, models
+from .cache import TTLCache, publish_stats
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_MAXSIZE = int(os.getenv("USER_CACHE_MAXSIZE", 10000))
+
+
+class CachedUser(NamedTuple):
+    id: int
+    username: str
+
+
+_backend = TTLCache(maxsize=USER_CACHE_MAXSIZE, ttl=USER_CACHE_TTL)
+
+
+def set_backend(backend):
+    # Swap in a shared backend (see cache.SharedCache) when running several workers
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+def stats():
+    # Hits and misses of whichever backend is in use, on /internal/metrics
+    return _backend.stats()
+
+
+publish_stats("users", stats)
+
+
+def get_user(username: str, db: Session) -> Optional[CachedUser]:
+    if not username:
+        return None
+    cached = _backend.get(username)
+    if cached is not None:
+        return CachedUser(*cached)
+
+    row = db.query(models.User.id, models.User.username).filter(
+        models.User.username == username).first()
+    if not row:
+        return None
+    _backend.set(username, [row.id, row.username])
+    return CachedUser(row.id, row.username)
+
+
+def invalidate(username: str):
+    if username:
+        invalidation.broadcast("users.username", username)
+
+
+@invalidation.handler("users.username")
+def _forget(username: str):
+    _backend.delete(username)
+
+
+@invalidation.on_reset
+def _clear():
+    _backend.clear()
+
+
+@event.listens_for(models.User, "after_update")
+def _invalidate_on_update(mapper, connection, target):
+    state = inspect(target)
+    username_history = state.attrs.username.history
+    if username_history.deleted:
+        for old_username in username_history.deleted:
+            invalidate(old_username)
+    if username_history.deleted or state.attrs.hashed_password.history.has_changes():
+        invalidate(target.username)
+
+
+@event.listens_for(models.User, "after_delete")
+def _invalidate_on_delete(mapper, connection, target):
+    invalidate(target.username)
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+
+# "delta" keeps a full snapshot every VERSION_SNAPSHOT_INTERVAL versions and
+# only the changed fields in between, "full" stores a snapshot every time.
+# Rows written before version numbers existed are read as snapshots.
+VERSION_STORAGE = os.getenv("VERSION_STORAGE", "delta")
+VERSION_SNAPSHOT_INTERVAL = int(os.getenv("VERSION_SNAPSHOT_INTERVAL", 20))
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+
+def dump(data: dict):
+    # Same compact layout as pydantic's model_dump_json, which earlier versions stored
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def load(data):
+    return data if isinstance(data, dict) else json.loads(data)
+
+
+def event_snapshot(event):
+    return schemas.EventCreate.model_validate(event, from_attributes=True).model_dump(mode="json")
+
+
+def field_changes(previous: Optional[dict], snapshot: dict):
+    previous = previous or {}
+    return {key: {"from": previous.get(key), "to": value}
+            for key, value in snapshot.items() if previous.get(key) != value}
+
+
+def compose_changes(history):
+    # Folds consecutive per-version changes into one {field: {"from", "to"}}
+    composed = {}
+    for changes in history:
+        for key, change in changes.items():
+            if key in composed:
+                composed[key]["to"] = change["to"]
+            else:
+                composed[key] = {"from": change["from"], "to": change["to"]}
+    return {key: change for key, change in composed.items() if change["from"] != change["to"]}
+
+
+def _kind_for(number: int):
+    if VERSION_STORAGE == DELTA and (number - 1) % VERSION_SNAPSHOT_INTERVAL:
+        return DELTA
+    return SNAPSHOT
+
+
+def add_version(db: Session, event_id: int, snapshot: dict, previous: Optional[dict] = None):
+    # `previous` is the snapshot of the latest version, which is what the event
+    # row holds right before a mutation
+    number = (db.query(func.max(models.EventVersion.version_number)).filter_by(
+        event_id=event_id).scalar() or 0) + 1
+    version = models.EventVersion(**version_row(event_id, number, snapshot, previous, datetime.utcnow()))
+    db.add(version)
+    return version
+
+
+def version_row(event_id: int, number: int, snapshot: dict, previous: Optional[dict], timestamp: datetime):
+    kind = _kind_for(number) if previous is not None else SNAPSHOT
+    payload = snapshot if kind == SNAPSHOT else {
+        key: value for key, value in snapshot.items() if previous.get(key) != value}
+    return {"event_id": event_id, "version_number": number, "kind": kind, "data": dump(payload),
+            "changes": field_changes(previous, snapshot), "timestamp": timestamp}
+
+
+def initial_version_row(event_id: int, snapshot: dict, timestamp: datetime):
+    return version_row(event_id, 1, snapshot, None, timestamp)
+
+
+def reconstruct(db: Session, version: models.EventVersion):
+    if version.kind != DELTA:
+        return load(version.data)
+
+    base = db.query(func.max(models.EventVersion.version_number)).filter(
+        models.EventVersion.event_id == version.event_id,
+        models.EventVersion.kind == SNAPSHOT,
+        models.EventVersion.version_number <= version.version_number).scalar()
+    chain = db.query(models.EventVersion.kind, models.EventVersion.data).filter(
+        models.EventVersion.event_id == version.event_id,
+        models.EventVersion.version_number >= base,
+        models.EventVersion.version_number <= version.version_number).order_by(
+        models.EventVersion.version_number).all()
+
+    snapshot = {}
+    for kind, data in chain:
+        snapshot.update(load(data))
+    return snapshot
+
+
+def changelog(db: Session, event_id: int, limit: Optional[int] = None, before: Optional[int] = None):
+    # Newest first, continuing into the archive once the hot versions run out
+    from . import archive
+
+    query = db.query(models.EventVersion.id, models.EventVersion.version_number,
+                     models.EventVersion.timestamp, models.EventVersion.changes).filter(
+        models.EventVersion.event_id == event_id)
+    if before is not None:
+        query = query.filter(models.EventVersion.version_number < before)
+    query = query.order_by(models.EventVersion.version_number.desc(), models.EventVersion.timestamp.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    history = [{"version_id": v.id, "version_number": v.version_number, "timestamp": v.timestamp,
+                "changes": v.changes} for v in query.all()]
+
+    # Archived versions are numbered below the hot ones, so a full page of hot
+    # versions only needs the archive for numbers that fall inside the page
+    above = None
+    if limit is not None and len(history) == limit:
+        above = min(v["version_number"] or 0 for v in history)
+    archived = archive.changelog(db, event_id, limit=limit, before=before, above=above)
+    if not archived:
+        return history
+    history = sorted(history + archived, key=lambda v: v["version_number"] or 0, reverse=True)
+    return history if limit is None else history[:limit]
+
+
+def diff(db: Session, v1: models.EventVersion, v2: models.EventVersion):
+    if v1.version_number is None or v2.version_number is None:
+        # History written before version numbers, compare the snapshots
+        return diff_snapshots(reconstruct(db, v1), reconstruct(db, v2))
+
+    low, high = sorted((v1.version_number, v2.version_number))
+    history = db.query(models.EventVersion.changes).filter(
+        models.EventVersion.event_id == v1.event_id,
+        models.EventVersion.version_number > low,
+        models.EventVersion.version_number <= high).order_by(
+        models.EventVersion.version_number).all()
+    composed = compose_changes(changes or {} for (changes,) in history)
+    if v1.version_number > v2.version_number:
+        composed = {key: {"from": change["to"], "to": change["from"]} for key, change in composed.items()}
+    return composed
+
+
+def diff_snapshots(data1: dict, data2: dict):
+    return {key: {"from": data1.get(key), "to": data2.get(key)}
+            for key in data1.keys() if data1.get(key) != data2.get(key)}
+
+
+def stored_data(db: Session, version: models.EventVersion):
+    # The value get_event_version has always returned: the stored snapshot as is
+    if version.kind != DELTA:
+        return version.data
+    return dump(reconstruct(db, version))
+
+
+def compact_history(db: Session, event_id: Optional[int] = None):
+    # Renumbers the history of each event in write order and rewrites it in
+    # the current storage layout. Numbering continues after the archived
+    # versions, and the first hot version keeps its changes against them.
+    from . import archive
+
+    query = db.query(models.EventVersion.event_id).distinct()
+    if event_id is not None:
+        query = query.filter(models.EventVersion.event_id == event_id)
+
+    compacted = 0
+    for (current_event_id,) in query.all():
+        history = db.query(models.EventVersion).filter_by(event_id=current_event_id).order_by(
+            models.EventVersion.version_number.is_(None), models.EventVersion.version_number,
+            models.EventVersion.timestamp, models.EventVersion.id).all()
+        snapshots = [reconstruct(db, version) for version in history]
+        archived_number, previous = archive.latest(db, current_event_id)
+
+        # Clear the numbers first so renumbering never trips the unique index
+        for version in history:
+            version.version_number = None
+        db.flush()
+
+        for number, (version, snapshot) in enumerate(zip(history, snapshots), start=archived_number + 1):
+            kind = _kind_for(number) if number > archived_number + 1 else SNAPSHOT
+            payload = snapshot if kind == SNAPSHOT else {
+                key: value for key, value in snapshot.items() if previous.get(key) != value}
+            version.version_number, version.kind, version.data = number, kind, dump(payload)
+            version.changes = field_changes(previous, snapshot)
+            previous = snapshot
+        db.commit()
+        compacted += 1
+    return compacted
+
+def main():
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rewrite event version history in the current storage layout")
+    parser.add_argument("--event-id", type=int, default=None)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        count = compact_history(db, event_id=args.event_id)
+    finally:
+        db.close()
+    print(f"Compacted the history of {count} event(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Compare sync and async request throughput at high concurrency.
+
+Starts the API twice with uvicorn, once with DB_MODE=sync and once with
+DB_MODE=async, against the database in DATABASE_URL (use a local Postgres),
+then drives both with the same read-heavy workload.
+
+    python -m benchmarks.bench_async --concurrency 200 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+
+def start_server(mode: str, port: int, workers: int):
+    env = {**os.environ, "DB_MODE": mode}
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--port", str(port), "--workers", str(workers)], env=env)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+async def seed(client: httpx.AsyncClient, events: int):
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    await client.post("/api/auth/register", json={"username": username, "password": "bench"})
+    token = (await client.post("/api/auth/login", data={"username": username, "password": "bench"})).json()
+    headers = {"Authorization": f"Bearer {token['access_token']}"}
+    batch = [{"title": f"Bench {i}", "description": "benchmark", "start_time": "2025-01-01T09:00:00",
+              "end_time": "2025-01-01T10:00:00"} for i in range(events)]
+    created = (await client.post("/api/events/batch", json=batch, headers=headers)).json()
+    return headers, [e["id"] for e in created]
+
+
+async def run_load(client: httpx.AsyncClient, headers: dict, event_ids: list, concurrency: int, duration: float):
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def worker(n: int):
+        nonlocal errors
+        i = n
+        while time.monotonic() < deadline:
+            url = "/api/events?limit=20" if i % 5 == 0 else f"/api/events/{event_ids[i % len(event_ids)]}"
+            started = time.perf_counter()
+            try:
+                response = await client.get(url, headers=headers)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+            i += concurrency
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def bench_mode(mode: str, port: int, args):
+    server = start_server(mode, port, args.workers)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+            await wait_until_ready(client)
+            headers, event_ids = await seed(client, args.events)
+            await run_load(client, headers, event_ids, args.concurrency, min(args.duration, 2))  # warm up
+            return await run_load(client, headers, event_ids, args.concurrency, args.duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    subprocess.run([sys.executable, "-m", "app.migrate"], check=True)
+    results = {}
+    for offset, mode in enumerate(["sync", "async"]):
+        results[mode] = asyncio.run(bench_mode(mode, args.port + offset, args))
+    print(json.dumps({"concurrency": args.concurrency, "duration_s": args.duration, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""CPU time per page of GET /api/events, ORM + Pydantic versus the column path.
+
+Loads --rows events into an in-memory SQLite database and times one page of
+--rows items each way, including the query:
+
+  orm_pydantic     list_events_logic, then validate and dump through
+                   List[EventOut] the way response_model does
+  columns_orjson   list_events_json with orjson
+  columns_json     list_events_json with the standard library fallback
+
+    python -m benchmarks.bench_serialization --rows 1000 --repeat 20
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import events, models, schemas, serialization
+from app.database import Base
+from app.user_cache import CachedUser
+
+
+def seed(db, rows: int):
+    db.add(models.User(id=1, username="bench", hashed_password="unused"))
+    start = datetime(2025, 1, 1, 9)
+    db.execute(insert(models.Event), [
+        {"id": i, "title": f"Event {i}", "description": "Benchmark event", "location": f"Room {i % 10}",
+         "start_time": start + timedelta(hours=i), "end_time": start + timedelta(hours=i, minutes=30),
+         "is_recurring": False, "owner_id": 1} for i in range(1, rows + 1)])
+    db.execute(insert(models.EventPermission), [
+        {"event_id": i, "user_id": 1, "role": "Owner"} for i in range(1, rows + 1)])
+    db.commit()
+
+
+def cpu_ms(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.process_time()
+        fn()
+        best = min(best, time.process_time() - started)
+    return round(best * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        seed(db, args.rows)
+
+    user = CachedUser(1, "bench")
+    adapter = TypeAdapter(List[schemas.EventOut])
+
+    def orm_pydantic():
+        with Session() as db:
+            page, _ = events.list_events_logic(skip=0, limit=args.rows, db=db, current_user=user)
+            content = adapter.dump_python(adapter.validate_python(page, from_attributes=True), mode="json")
+            return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def columns():
+        with Session() as db:
+            return events.list_events_json(skip=0, limit=args.rows, db=db, current_user=user)[0]
+
+    encoder = serialization.orjson
+    results = {"rows": args.rows, "orm_pydantic_ms": cpu_ms(orm_pydantic, args.repeat)}
+    if encoder is not None:
+        results["columns_orjson_ms"] = cpu_ms(columns, args.repeat)
+    serialization.orjson = None
+    results["columns_json_ms"] = cpu_ms(columns, args.repeat)
+    results["same_bytes"] = columns() == orm_pydantic()
+    serialization.orjson = encoder
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
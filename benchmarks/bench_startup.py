@@ -0,0 +1,76 @@
+"""Time from launch to ready, and from SIGTERM to exit, for `python -m app.serve`.
+
+Runs the one-shot migration, then starts the server with each --workers
+count against the database in DATABASE_URL. It polls /health/ready until it
+answers 200, reads the app_startup_seconds gauge of the worker that answered,
+and stops the server with SIGTERM. More than one worker needs
+INVALIDATION_REDIS_URL (or EVENT_STREAM_REDIS_URL), app.serve refuses otherwise.
+
+    python -m benchmarks.bench_startup --workers 1,2,4 --repeat 3
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def startup_gauges(client: httpx.Client):
+    gauges = {}
+    token = os.getenv("METRICS_TOKEN")
+    headers = {"Authorization": f"Bearer {token}"} if token else None
+    for line in client.get("/internal/metrics", headers=headers).text.splitlines():
+        if line.startswith("app_startup_seconds{"):
+            labels, value = line.rsplit(" ", 1)
+            gauges[labels.split('"')[1]] = round(float(value), 3)
+    return gauges
+
+
+def measure(workers: int, port: int, timeout: float):
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "app.serve", "--port", str(port), "--workers", str(workers)],
+                              env={**os.environ, "LOG_LEVEL": "warning"}, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=2) as client:
+            deadline = started + timeout
+            while True:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f"Not ready after {timeout}s with {workers} worker(s)")
+                try:
+                    if client.get("/health/ready").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.05)
+            ready = time.perf_counter() - started
+            gauges = startup_gauges(client)
+    finally:
+        stopping = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    return {"ready_s": round(ready, 3), "stop_s": round(time.perf_counter() - stopping, 3), **gauges}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=lambda value: [int(n) for n in value.split(",")], default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    subprocess.run([sys.executable, "-m", "app.migrate"], check=True, stdout=subprocess.DEVNULL)
+    results = {}
+    for workers in args.workers:
+        runs = [measure(workers, args.port, args.timeout) for _ in range(args.repeat)]
+        results[workers] = {key: round(statistics.median(run[key] for run in runs), 3) for key in runs[0]}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
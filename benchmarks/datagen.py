@@ -0,0 +1,103 @@
+"""Synthetic users, events, permissions and version histories for the benchmark suite.
+
+Rows are written with multi-row INSERT ... RETURNING, so large datasets load
+in seconds on SQLite and Postgres alike. Usernames carry a random prefix,
+which lets several runs share one database.
+"""
+import random
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from app import hashing, models, schemas, versions
+
+CHUNK_SIZE = 1000
+ROLES = ("Viewer", "Editor")
+
+
+@dataclass
+class Dataset:
+    password: str
+    usernames: List[str] = field(default_factory=list)
+    user_ids: List[int] = field(default_factory=list)
+    # Events owned by each user id, in creation order
+    events: Dict[int, List[int]] = field(default_factory=dict)
+    # Version ids of the long-history events, oldest first
+    histories: Dict[int, List[int]] = field(default_factory=dict)
+
+    def username_of(self, user_id: int) -> str:
+        return self.usernames[self.user_ids.index(user_id)]
+
+
+def _insert_returning_ids(db: Session, table, rows: List[dict]) -> List[int]:
+    ids = []
+    for start in range(0, len(rows), CHUNK_SIZE):
+        ids.extend(db.scalars(insert(table).returning(table.id, sort_by_parameter_order=True),
+                              rows[start:start + CHUNK_SIZE]))
+    return ids
+
+
+def _event(rng: random.Random, owner_id: int, index: int, base: datetime) -> dict:
+    start = base + timedelta(hours=rng.randrange(24 * 365))
+    return {"title": f"Event {owner_id}-{index}", "description": f"Generated event {index}",
+            "start_time": start, "end_time": start + timedelta(minutes=rng.choice((15, 30, 60, 90))),
+            "location": f"Room {rng.randrange(50)}", "is_recurring": False, "recurrence_pattern": None,
+            "owner_id": owner_id}
+
+
+def generate(db: Session, users: int = 100, events_per_user: int = 100, shares_per_event: int = 3,
+             history_events: int = 10, history_depth: int = 200, seed: int = 0) -> Dataset:
+    rng = random.Random(seed)
+    dataset = Dataset(password="bench-password")
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+
+    # One bcrypt hash for everybody, hashing every user would dominate the load
+    hashed = hashing.hash_password(dataset.password)
+    dataset.usernames = [f"{prefix}-{i}" for i in range(users)]
+    dataset.user_ids = _insert_returning_ids(db, models.User, [
+        {"username": name, "hashed_password": hashed} for name in dataset.usernames])
+
+    base = datetime(2025, 1, 1)
+    rows = [_event(rng, owner_id, i, base) for owner_id in dataset.user_ids for i in range(events_per_user)]
+    event_ids = _insert_returning_ids(db, models.Event, rows)
+
+    permissions, version_rows = [], []
+    for event_id, row in zip(event_ids, rows):
+        dataset.events.setdefault(row["owner_id"], []).append(event_id)
+        permissions.append({"event_id": event_id, "user_id": row["owner_id"], "role": "Owner"})
+        others = [u for u in rng.sample(dataset.user_ids, min(shares_per_event + 1, users)) if u != row["owner_id"]]
+        permissions.extend({"event_id": event_id, "user_id": u, "role": rng.choice(ROLES)}
+                           for u in others[:shares_per_event])
+        snapshot = schemas.EventCreate.model_validate(row).model_dump(mode="json")
+        if len(dataset.histories) < history_events:
+            dataset.histories[event_id] = []
+            version_rows.extend(_history(event_id, snapshot, history_depth, base))
+        else:
+            version_rows.append(versions.initial_version_row(event_id, snapshot, base))
+
+    for start in range(0, len(permissions), CHUNK_SIZE):
+        db.execute(insert(models.EventPermission), permissions[start:start + CHUNK_SIZE])
+    for version_id, row in zip(_insert_returning_ids(db, models.EventVersion, version_rows), version_rows):
+        if row["event_id"] in dataset.histories:
+            dataset.histories[row["event_id"]].append(version_id)
+
+    # Leave the long-history events in the state of their last version
+    if dataset.histories and history_depth:
+        db.execute(update(models.Event).where(models.Event.id.in_(dataset.histories)).values(
+            description=f"Revision {history_depth}"))
+    db.commit()
+    return dataset
+
+
+def _history(event_id: int, snapshot: dict, depth: int, base: datetime):
+    previous = None
+    for number in range(1, depth + 1):
+        current = {**snapshot, "description": f"Revision {number}"}
+        if number % 7 == 0:
+            current["location"] = f"Room {number % 50}"
+        yield versions.version_row(event_id, number, current, previous, base + timedelta(minutes=number))
+        previous = current
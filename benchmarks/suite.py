@@ -0,0 +1,314 @@
+"""Scenario-based load test with latency percentiles and query counts per endpoint.
+
+Generates a dataset (see benchmarks.datagen) in the database from
+DATABASE_URL or --database-url, then drives the app in-process over ASGI.
+Every SQL statement is attributed to the request that issued it. Use a
+dedicated database: the generated rows are left in place.
+
+Scenarios:
+  login_storm       concurrent logins, bcrypt bound
+  deep_pagination   walk every page of a large calendar with the keyset cursor
+  batch_import      POST /api/events/batch and NDJSON /api/events/import
+  share_fanout      share events with many users through /share and /permissions/bulk
+  history_diff      changelog and diffs across long version histories
+
+Results are written as JSON. With --compare, the run fails if any endpoint's
+p95 latency or mean query count has regressed beyond --tolerance.
+
+    python -m benchmarks.suite --database-url sqlite:////tmp/bench.db --output results.json
+    python -m benchmarks.suite --output new.json --compare results.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+SCENARIOS = ("login_storm", "deep_pagination", "batch_import", "share_fanout", "history_diff")
+
+_queries = contextvars.ContextVar("bench_queries", default=None)
+
+
+class Recorder:
+    # ASGI wrapper recording latency, status and SQL statements per request
+    def __init__(self, app):
+        self.app = app
+        self.samples = []
+
+    def count_query(self, *args):
+        counter = _queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        counter, status = [0], [500]
+        token = _queries.set(counter)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _queries.reset(token)
+            route = scope.get("route")
+            endpoint = f"{scope['method']} {route.path if route else scope['path']}"
+            self.samples.append((endpoint, elapsed, status[0], counter[0]))
+
+
+class Context:
+    def __init__(self, client, dataset, args, token_for):
+        self.client = client
+        self.dataset = dataset
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.token_for = token_for
+
+    def headers(self, username: str):
+        return {"Authorization": f"Bearer {self.token_for(username)}"}
+
+
+async def run_concurrently(calls, concurrency: int):
+    calls = iter(calls)
+
+    async def worker():
+        for call in calls:
+            await call()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+# =======================================================================================================================
+# Scenarios
+# =======================================================================================================================
+
+async def login_storm(ctx: Context):
+    def call(username):
+        return lambda: ctx.client.post("/api/auth/login", data={"username": username,
+                                                                 "password": ctx.dataset.password})
+
+    names = [ctx.rng.choice(ctx.dataset.usernames) for _ in range(ctx.args.requests)]
+    await run_concurrently((call(name) for name in names), ctx.args.concurrency)
+
+
+async def deep_pagination(ctx: Context):
+    async def walk(username):
+        headers, cursor = ctx.headers(username), None
+        while True:
+            url = f"/api/events?limit={ctx.args.page_size}" + (f"&cursor={cursor}" if cursor else "")
+            cursor = (await ctx.client.get(url, headers=headers)).headers.get("x-next-cursor")
+            if not cursor:
+                return
+
+    walkers = ctx.rng.sample(ctx.dataset.usernames, min(ctx.args.concurrency, len(ctx.dataset.usernames)))
+    await run_concurrently((lambda name=name: walk(name) for name in walkers), ctx.args.concurrency)
+
+
+async def batch_import(ctx: Context):
+    def payload(i):
+        return [{"title": f"Imported {i}-{n}", "description": "bench", "start_time": "2026-01-01T09:00:00",
+                 "end_time": "2026-01-01T10:00:00"} for n in range(ctx.args.batch_size)]
+
+    def call(i):
+        headers = ctx.headers(ctx.rng.choice(ctx.dataset.usernames))
+        if i % 2:
+            body = "\n".join(json.dumps(event) for event in payload(i))
+            return lambda: ctx.client.post("/api/events/import", content=body, headers=headers)
+        return lambda: ctx.client.post("/api/events/batch", json=payload(i), headers=headers)
+
+    calls = max(1, ctx.args.requests // 10)
+    await run_concurrently((call(i) for i in range(calls)), ctx.args.concurrency)
+
+
+async def share_fanout(ctx: Context):
+    def call(i):
+        owner_id = ctx.rng.choice(list(ctx.dataset.events))
+        headers = ctx.headers(ctx.dataset.username_of(owner_id))
+        event_id = ctx.rng.choice(ctx.dataset.events[owner_id])
+        targets = ctx.rng.sample(ctx.dataset.user_ids, min(ctx.args.fanout, len(ctx.dataset.user_ids)))
+        targets = [user_id for user_id in targets if user_id != owner_id]
+        if i % 2:
+            grants = [{"event_id": event_id, "user_id": user_id, "role": "Viewer"} for user_id in targets]
+            return lambda: ctx.client.post("/api/events/permissions/bulk", json={"grants": grants}, headers=headers)
+        users = [{"user_id": user_id, "role": "Editor"} for user_id in targets]
+        return lambda: ctx.client.post(f"/api/events/{event_id}/share", json={"users": users}, headers=headers)
+
+    calls = max(1, ctx.args.requests // 5)
+    await run_concurrently((call(i) for i in range(calls)), ctx.args.concurrency)
+
+
+async def history_diff(ctx: Context):
+    histories = ctx.dataset.histories
+    if not histories:
+        return
+    owner_of = {event_id: owner for owner, ids in ctx.dataset.events.items() for event_id in ids}
+
+    def call(i):
+        event_id = ctx.rng.choice(list(histories))
+        headers = ctx.headers(ctx.dataset.username_of(owner_of[event_id]))
+        if i % 4 == 0:
+            return lambda: ctx.client.get(f"/api/events/{event_id}/changelog?limit=50", headers=headers)
+        v1, v2 = sorted(ctx.rng.sample(histories[event_id], 2))
+        return lambda: ctx.client.get(f"/api/events/{event_id}/diff/{v1}/{v2}", headers=headers)
+
+    await run_concurrently((call(i) for i in range(ctx.args.requests)), ctx.args.concurrency)
+
+
+# =======================================================================================================================
+# Reporting
+# =======================================================================================================================
+
+def percentile(ordered, q: float):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples, wall_seconds: float):
+    by_endpoint = defaultdict(list)
+    for endpoint, elapsed, status, queries in samples:
+        by_endpoint[endpoint].append((elapsed, status, queries))
+
+    report = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in rows)
+        queries = [count for _, _, count in rows]
+        report[endpoint] = {
+            "requests": len(rows),
+            "errors": sum(1 for _, status, _ in rows if status >= 400),
+            "throughput_rps": round(len(rows) / wall_seconds, 2) if wall_seconds else None,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "mean_queries": round(sum(queries) / len(queries), 2),
+            "max_queries": max(queries),
+        }
+    return report
+
+
+def compare(current: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for scenario, result in current["scenarios"].items():
+        for endpoint, stats in result["endpoints"].items():
+            before = baseline.get("scenarios", {}).get(scenario, {}).get("endpoints", {}).get(endpoint)
+            if not before:
+                continue
+            if stats["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{scenario} {endpoint}: p95 {before['p95_ms']} -> {stats['p95_ms']} ms")
+            if stats["mean_queries"] > before["mean_queries"]:
+                regressions.append(
+                    f"{scenario} {endpoint}: queries {before['mean_queries']} -> {stats['mean_queries']}")
+    return regressions
+
+
+# =======================================================================================================================
+# Runner
+# =======================================================================================================================
+
+async def run(args):
+    import httpx
+    from sqlalchemy import event as sa_event
+
+    from app import database, migrate, token_utils
+    from app.main import app
+
+    from .datagen import generate
+
+    migrate.migrate()
+    recorder = Recorder(app)
+    sa_event.listen(database.engine, "before_cursor_execute", recorder.count_query)
+    tokens = {}
+
+    def token_for(username):
+        if username not in tokens:
+            tokens[username] = token_utils.create_token(
+                {"sub": username}, token_utils.ACCESS_EXPIRE_MIN, token_utils.SECRET_KEY)
+        return tokens[username]
+
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        with database.SessionLocal() as db:
+            dataset = generate(db, users=args.users, events_per_user=args.events_per_user,
+                               shares_per_event=args.shares_per_event, history_events=args.history_events,
+                               history_depth=args.history_depth, seed=args.seed)
+        results = {
+            "meta": {"started_at": datetime.utcnow().isoformat(), "dialect": database.engine.dialect.name,
+                     "generate_seconds": round(time.perf_counter() - started, 2),
+                     "parameters": {key: value for key, value in vars(args).items()
+                                    if key not in ("output", "compare", "database_url")}},
+            "scenarios": {},
+        }
+
+        transport = httpx.ASGITransport(app=recorder)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for name in args.scenarios:
+                ctx = Context(client, dataset, args, token_for)
+                recorder.samples = []
+                started = time.perf_counter()
+                await globals()[name](ctx)
+                wall = time.perf_counter() - started
+                results["scenarios"][name] = {"wall_seconds": round(wall, 3),
+                                              "endpoints": summarize(recorder.samples, wall)}
+                print(f"{name}: {len(recorder.samples)} requests in {wall:.2f}s", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="overrides DATABASE_URL")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS))
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--events-per-user", type=int, default=100)
+    parser.add_argument("--shares-per-event", type=int, default=3)
+    parser.add_argument("--history-events", type=int, default=10)
+    parser.add_argument("--history-depth", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--fanout", type=int, default=100, help="users per share request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results JSON here instead of stdout")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.database_url:
+        # Must be in place before app.database builds the engine
+        os.environ["DATABASE_URL"] = args.database_url
+
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+
+
+@pytest.fixture
+def sqlite_engine():
+    # Makes private in-memory databases, with the models' tables unless create_all=False
+    engines = []
+
+    def make(create_all: bool = True):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        if create_all:
+            Base.metadata.create_all(engine)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def sqlite_session(sqlite_engine):
+    # Makes sessions on `engine`, or on a new in-memory database with the models' tables
+    sessions = []
+
+    def make(engine=None):
+        db = sessionmaker(bind=engine or sqlite_engine())()
+        sessions.append(db)
+        return db
+
+    yield make
+    for db in sessions:
+        db.close()
+
+
+@pytest.fixture
+def vm_steps():
+    # Runs query() and counts the SQLite virtual machine instructions it took,
+    # in units of 100. Unlike wall-clock time, the count is the same on any machine.
+    def run(engine, query):
+        steps = [0]
+
+        def count():
+            steps[0] += 1
+            return 0
+
+        connection = engine.raw_connection().driver_connection
+        connection.set_progress_handler(count, 100)
+        try:
+            return query(), steps[0]
+        finally:
+            connection.set_progress_handler(None, 100)
+
+    return run
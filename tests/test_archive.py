@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from app import archive, database, events, models, permissions, versions
+
+BASE = datetime(2024, 1, 1)
+
+
+def snapshot(number):
+    return {"title": "Archived", "description": f"Revision {number}", "start_time": "2024-01-01T09:00:00",
+            "end_time": "2024-01-01T10:00:00", "location": f"Room {number % 3}", "is_recurring": False,
+            "recurrence_pattern": None}
+
+
+@pytest.fixture
+def make_session(sqlite_session):
+    return lambda depth: add_history(sqlite_session(), depth)
+
+
+def add_history(db, depth):
+    db.add(models.User(id=1, username="archivist", hashed_password="unused"))
+    db.add(models.Event(id=1, owner_id=1, title="Archived", description=f"Revision {depth}",
+                        start_time=BASE, end_time=BASE + timedelta(hours=1), is_recurring=False))
+    db.add(models.EventPermission(event_id=1, user_id=1, role="Owner"))
+    db.execute(insert(models.EventVersion), [
+        versions.version_row(1, number, snapshot(number), snapshot(number - 1) if number > 1 else None,
+                             BASE + timedelta(days=number)) for number in range(1, depth + 1)])
+    db.commit()
+    return db
+
+
+def test_compress_round_trip_falls_back_to_zlib(monkeypatch):
+    monkeypatch.setattr(archive, "zstandard", None)
+    codec, blob = archive.compress({"data": snapshot(1), "changes": {}})
+    assert codec == "zlib"
+    assert archive.decompress(codec, blob) == {"data": snapshot(1), "changes": {}}
+
+
+def test_archive_keeps_history_reconstructable(monkeypatch, make_session):
+    monkeypatch.setattr(versions, "VERSION_SNAPSHOT_INTERVAL", 20)
+    db = make_session(30)
+    ids = dict(db.query(models.EventVersion.version_number, models.EventVersion.id))
+
+    # Versions 1-25 are older than the cutoff
+    moved = archive.archive_versions(db, retention_days=5, now=BASE + timedelta(days=30, hours=12))
+    assert moved == 25
+    hot = db.query(models.EventVersion).order_by(models.EventVersion.version_number).all()
+    assert [v.version_number for v in hot] == list(range(26, 31))
+    assert hot[0].kind == versions.SNAPSHOT
+    assert all(versions.reconstruct(db, v) == snapshot(v.version_number) for v in hot)
+    assert db.query(models.EventVersionArchive).count() == 25
+
+    permissions.clear_cache()
+    fetched = events.get_event_version(1, ids[10], 1, db)
+    assert fetched["version_id"] == ids[10] and fetched["timestamp"] == BASE + timedelta(days=10)
+    assert versions.load(fetched["data"]) == snapshot(10)
+
+    # The changelog goes on into the archive, page by page
+    history = events.get_event_changelog(1, 1, db)
+    assert [v["version_number"] for v in history] == list(range(30, 0, -1))
+    assert history[20]["version_id"] == ids[10]
+    assert history[20]["changes"] == versions.field_changes(snapshot(9), snapshot(10))
+    page = events.get_event_changelog(1, 1, db, limit=4, before=28)
+    assert [v["version_number"] for v in page] == [27, 26, 25, 24]
+    assert [v["version_number"] for v in events.get_event_changelog(1, 1, db, limit=3)] == [30, 29, 28]
+
+    # The latest version never leaves event_versions, and a second run is a no-op
+    assert archive.archive_versions(db, retention_days=0, now=BASE + timedelta(days=365)) == 4
+    assert [v.version_number for v in db.query(models.EventVersion)] == [30]
+    assert archive.archive_versions(db, retention_days=0, now=BASE + timedelta(days=365)) == 0
+
+
+def test_partition_statements():
+    statements = archive.partition_statements(4)
+    assert "PARTITION BY HASH (event_id)" in statements[2]
+    assert sum("PARTITION OF event_versions_partitioned" in s for s in statements) == 4
+    assert any("ix_event_versions_event_timestamp ON event_versions (event_id, timestamp, id, version_number)" in s
+               for s in statements)
+
+
+def test_archived_versions_stay_usable_after_compaction(monkeypatch, make_session):
+    monkeypatch.setattr(versions, "VERSION_SNAPSHOT_INTERVAL", 20)
+    db = make_session(30)
+    ids = dict(db.query(models.EventVersion.version_number, models.EventVersion.id))
+    archive.archive_versions(db, retention_days=5, now=BASE + timedelta(days=30, hours=12))
+
+    # Hot versions keep their numbers, and their changes still read against the archived history
+    versions.compact_history(db, event_id=1)
+    hot = db.query(models.EventVersion).order_by(models.EventVersion.version_number).all()
+    assert [v.version_number for v in hot] == list(range(26, 31))
+    assert set(hot[0].changes) == {"description", "location"}
+    assert all(versions.reconstruct(db, v) == snapshot(v.version_number) for v in hot)
+
+    permissions.clear_cache()
+    assert events.get_event_diff(1, ids[10], ids[28], 1, db) == {
+        "description": {"from": "Revision 10", "to": "Revision 28"}}
+    assert events.get_event_diff(1, ids[3], ids[4], 1, db)["location"] == {"from": "Room 0", "to": "Room 1"}
+    events.rollback_event_to_version(1, ids[10], 1, db)
+    assert db.get(models.Event, 1).description == "Revision 10"
+
+
+def test_archive_run_skips_while_another_holds_the_lock(monkeypatch, make_session):
+    @contextmanager
+    def held_elsewhere(bind, key):
+        yield False
+
+    db = make_session(30)
+    monkeypatch.setattr(database, "advisory_lock", held_elsewhere)
+    assert archive.archive_versions(db, retention_days=5, now=BASE + timedelta(days=30, hours=12)) == 0
+    assert db.query(models.EventVersionArchive).count() == 0
@@ -0,0 +1,61 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import async_api, models, permissions, token_utils, user_cache
+from app.database import Base, get_async_db
+
+
+@pytest.fixture
+async def async_client(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'async.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    AsyncTestingSession = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with AsyncTestingSession() as db:
+            yield db
+
+    async with AsyncTestingSession() as db:
+        db.add(models.User(username="async-user", hashed_password="unused"))
+        await db.commit()
+
+    user_cache.get_backend().clear()
+    permissions.clear_cache()
+    app = FastAPI()
+    app.include_router(async_api.router)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+    user_cache.get_backend().clear()
+    permissions.clear_cache()
+    await engine.dispose()
+
+
+async def test_async_event_routes(async_client):
+    token = token_utils.create_token({"sub": "async-user"}, 5, token_utils.SECRET_KEY)
+    headers = {"Authorization": f"Bearer {token}"}
+    event = {
+        "title": "Async Event",
+        "description": "Served by the async router",
+        "start_time": "2025-09-01T09:00:00",
+        "end_time": "2025-09-01T10:00:00",
+    }
+
+    response = await async_client.post("/api/events", json=event, headers=headers)
+    assert response.status_code == 200
+    event_id = response.json()["id"]
+
+    response = await async_client.put(f"/api/events/{event_id}", json={**event, "title": "Renamed"},
+                                      headers=headers)
+    assert response.json()["title"] == "Renamed"
+
+    response = await async_client.get("/api/events", headers=headers)
+    assert [e["title"] for e in response.json()] == ["Renamed"]
+
+    response = await async_client.delete(f"/api/events/{event_id}", headers=headers)
+    assert response.status_code == 200
+    response = await async_client.get(f"/api/events/{event_id}", headers=headers)
+    assert response.status_code == 403
@@ -0,0 +1,76 @@
+from app import models, user_cache
+from app.cache import SharedCache, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSharedClient:
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    clock.now = 5
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_user_cache_with_shared_backend_and_invalidation(sqlite_session):
+    db = sqlite_session()
+    user = models.User(username="cached", hashed_password="x")
+    db.add(user)
+    db.commit()
+
+    client = FakeSharedClient()
+    previous = user_cache.get_backend()
+    user_cache.set_backend(SharedCache(client, prefix="user:"))
+    try:
+        assert user_cache.get_user("cached", db) == (user.id, "cached")
+        assert "user:cached" in client.store
+        assert user_cache.get_user("cached", db).id == user.id
+        assert user_cache.get_backend().stats() == {"hits": 1, "misses": 1}
+
+        user.hashed_password = "changed"
+        db.commit()
+        assert "user:cached" not in client.store
+
+        user_cache.get_user("cached", db)
+        db.delete(user)
+        db.commit()
+        assert "user:cached" not in client.store
+        assert user_cache.get_user("cached", db) is None
+    finally:
+        user_cache.set_backend(previous)
+        db.close()
@@ -0,0 +1,64 @@
+import os
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app import hashing
+
+
+@pytest.fixture
+def inline_hashing(monkeypatch):
+    monkeypatch.setattr(hashing, "PASSWORD_HASH_WORKERS", 0)
+    monkeypatch.setattr(hashing, "rounds", 4)
+
+
+def test_hash_and_verify_inline(inline_hashing):
+    hashed = hashing.hash_password("secret")
+    assert hashing.hash_cost(hashed) == 4
+    assert hashing.verify_password("secret", hashed)
+    assert not hashing.verify_password("wrong", hashed)
+    assert not hashing.needs_rehash(hashed)
+
+
+def test_needs_rehash_when_cost_differs(inline_hashing, monkeypatch):
+    hashed = hashing.hash_password("secret")
+    monkeypatch.setattr(hashing, "rounds", 5)
+    assert hashing.needs_rehash(hashed)
+
+
+def test_saturated_pool_returns_503(monkeypatch):
+    monkeypatch.setattr(hashing, "PASSWORD_HASH_WORKERS", 1)
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(hashing, "_slots", slots)
+    with pytest.raises(HTTPException) as excinfo:
+        hashing.hash_password("secret")
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers["Retry-After"] == str(hashing.PASSWORD_HASH_RETRY_AFTER)
+
+
+def test_calibrate_stays_within_bounds():
+    assert hashing.calibrate(0.001) == hashing.BCRYPT_MIN_ROUNDS
+    assert hashing.calibrate(10 ** 9) == hashing.BCRYPT_MAX_ROUNDS
+
+
+def test_configure_rounds_calibrates_once_for_all_workers(monkeypatch):
+    monkeypatch.setattr(hashing, "BCRYPT_TARGET_MS", 10 ** 9)
+    monkeypatch.setattr(hashing, "rounds", 12)
+    monkeypatch.delenv("BCRYPT_ROUNDS", raising=False)
+    assert hashing.configure_rounds() == hashing.BCRYPT_MAX_ROUNDS
+    assert os.environ["BCRYPT_ROUNDS"] == str(hashing.BCRYPT_MAX_ROUNDS)
+
+    # Workers started afterwards find BCRYPT_ROUNDS set and keep it
+    monkeypatch.setattr(hashing, "BCRYPT_TARGET_MS", 0.001)
+    assert hashing.configure_rounds() == hashing.BCRYPT_MAX_ROUNDS
+
+
+def test_configure_rounds_warns_when_each_worker_calibrates(monkeypatch, caplog):
+    # The app's lifespan, when it was not started through app.serve
+    monkeypatch.setattr(hashing, "BCRYPT_TARGET_MS", 10 ** 9)
+    monkeypatch.setattr(hashing, "rounds", 12)
+    monkeypatch.delenv("BCRYPT_ROUNDS", raising=False)
+    assert hashing.configure_rounds(per_worker=True) == hashing.BCRYPT_MAX_ROUNDS
+    assert "in this worker only" in caplog.text
@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Cold start budget: importing app.main may take at most this many times as long
+# as importing FastAPI and SQLAlchemy on their own, both read from -X importtime
+# in fresh interpreters. Being relative, it holds on slow and fast machines alike.
+# Raise it only together with whatever made the import slower.
+IMPORT_TIME_BUDGET_RATIO = float(os.getenv("IMPORT_TIME_BUDGET_RATIO", 1.5))
+FRAMEWORK_MODULES = ("fastapi", "sqlalchemy.orm")
+# Absolute budget for importing app.main and calling create_app(), checked only
+# when set, e.g. in a CI job on known hardware
+IMPORT_TIME_BUDGET_MS = os.getenv("IMPORT_TIME_BUDGET_MS")
+# Loaded on first use: token handling, password hashing and the database drivers
+LAZY_MODULES = ("jose", "cryptography", "passlib", "bcrypt", "psycopg2", "asyncpg",
+                "sqlalchemy.dialects.postgresql")
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def import_times(statement):
+    # Cumulative import time in ms per module, as -X importtime reports it
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            cumulative[fields[2].strip()] = int(fields[1]) / 1000
+    return cumulative, result.stdout
+
+
+def cold_start():
+    statement = ("import json, sys, time; started = time.perf_counter(); from app.main import create_app; "
+                 "create_app(); print(json.dumps({'ms': (time.perf_counter() - started) * 1000, "
+                 "'modules': list(sys.modules)}))")
+    cumulative, stdout = import_times(statement)
+    return cumulative, json.loads(stdout)
+
+
+def test_cold_start_stays_lazy():
+    _, started = cold_start()
+    assert not [name for name in LAZY_MODULES if name in started["modules"]]
+
+
+def test_cold_start_within_budget():
+    # Best of three, so a busy machine does not fail the run
+    floor_ms = min(sum(import_times(f"import {', '.join(FRAMEWORK_MODULES)}")[0][name] for name in FRAMEWORK_MODULES)
+                   for _ in range(3))
+    runs = [cold_start() for _ in range(3)]
+    app_ms = min(cumulative["app.main"] for cumulative, _ in runs)
+    slowest = sorted(runs[0][0].items(), key=lambda item: -item[1])[:10]
+    assert app_ms <= floor_ms * IMPORT_TIME_BUDGET_RATIO, (
+        f"importing app.main took {app_ms:.0f} ms, {app_ms / floor_ms:.2f}x the {floor_ms:.0f} ms of "
+        f"{' and '.join(FRAMEWORK_MODULES)} alone, slowest imports: {slowest}")
+
+    if IMPORT_TIME_BUDGET_MS:
+        cold_start_ms = min(started["ms"] for _, started in runs)
+        assert cold_start_ms <= float(IMPORT_TIME_BUDGET_MS), (
+            f"importing app.main and create_app() took {cold_start_ms:.0f} ms, slowest imports: {slowest}")
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+from fastapi import APIRouter, FastAPI
+from sqlalchemy import create_engine, text
+
+from app import instrumentation
+
+
+def make_app(barrier):
+    router = APIRouter(route_class=instrumentation.TrackedRoute)
+
+    def wait_for_the_other_request():
+        barrier.wait(timeout=5)
+        time.sleep(0.1)
+
+    @router.get("/first")
+    def first_handler():
+        wait_for_the_other_request()
+        return {}
+
+    @router.get("/second")
+    def second_handler():
+        wait_for_the_other_request()
+        return {}
+
+    app = FastAPI()
+    app.add_middleware(instrumentation.RequestMetricsMiddleware)
+    app.include_router(router)
+    return app
+
+
+async def test_profiles_only_sample_their_own_handler_thread(monkeypatch, tmp_path):
+    monkeypatch.setattr(instrumentation, "_APP_DIR", os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.setattr(instrumentation, "PROFILE_SLOW_MS", 0.001)
+    monkeypatch.setattr(instrumentation, "PROFILE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(instrumentation, "PROFILE_INTERVAL_MS", 1)
+    monkeypatch.setattr(instrumentation, "PROFILE_DIR", str(tmp_path))
+
+    transport = httpx.ASGITransport(app=make_app(threading.Barrier(2)))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        responses = await asyncio.gather(http.get("/first"), http.get("/second"))
+    assert [response.status_code for response in responses] == [200, 200]
+
+    for name, other in (("first", "second"), ("second", "first")):
+        profile = next(tmp_path.glob(f"*-GET-{name}-*.folded")).read_text()
+        assert f"{name}_handler" in profile and f"{other}_handler" not in profile
+
+
+def test_failed_statements_leave_no_timing_state_on_the_connection():
+    engine = create_engine("sqlite://")
+    token = instrumentation._current.set(stats := instrumentation.RequestStats())
+    try:
+        with engine.connect() as connection:
+            info = dict(connection.info)
+            for _ in range(3):
+                try:
+                    connection.execute(text("SELECT * FROM missing"))
+                except Exception:
+                    pass
+            connection.execute(text("SELECT 1"))
+            assert connection.info == info
+    finally:
+        instrumentation._current.reset(token)
+    assert stats.queries == 1
@@ -0,0 +1,113 @@
+import multiprocessing
+import time
+
+from app import invalidation
+
+
+class SharedRedis:
+    # The part of redis that RedisBus uses, shared between processes through a manager
+    def __init__(self, inbox, subscribers, replay):
+        self.inbox = inbox
+        self.subscribers = subscribers
+        self.replay = replay
+
+    def publish(self, channel, data):
+        for inbox in list(self.subscribers):
+            inbox.put(data)
+
+    def zadd(self, key, mapping):
+        self.replay.update(mapping)
+
+    def zremrangebyscore(self, key, low, high):
+        for member, score in list(self.replay.items()):
+            if score <= high:
+                self.replay.pop(member, None)
+
+    def zrangebyscore(self, key, low, high):
+        return [member for member, score in list(self.replay.items()) if score >= low]
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return SharedPubSub(self)
+
+
+class SharedPubSub:
+    def __init__(self, client):
+        self.client = client
+
+    def subscribe(self, channel):
+        self.client.subscribers.append(self.client.inbox)
+
+    def listen(self):
+        for data in iter(self.client.inbox.get, None):
+            yield {"data": data}
+
+    def close(self):
+        self.client.inbox.put(None)
+
+
+def worker(inbox, subscribers, replay, commands, results):
+    # One API worker process: its own caches and revocation list, joined by the bus
+    from app import permissions, token_utils
+
+    bus = invalidation.RedisBus(SharedRedis(inbox, subscribers, replay), reconnect_delay=0.01)
+    invalidation.set_bus(bus)
+    bus.start()
+    bus.connected.wait(10)
+    results.put("ready")
+    commands_by_name = {
+        "revoke": token_utils.revoke_session,
+        "revoked": token_utils.revoked.is_revoked,
+        "cache_role": lambda *key: permissions._roles.set(key, "Owner"),
+        "role": lambda *key: permissions._roles.get(key),
+        "invalidate_event": permissions.invalidate_event,
+    }
+    for command, args in iter(commands.get, None):
+        results.put(commands_by_name[command](*args))
+    bus.stop()
+
+
+class Worker:
+    def __init__(self, context, manager, subscribers, replay):
+        self.commands, self.results, self.inbox = context.Queue(), context.Queue(), manager.Queue()
+        self.process = context.Process(target=worker, args=(
+            self.inbox, subscribers, replay, self.commands, self.results), daemon=True)
+        self.process.start()
+        assert self.results.get(timeout=60) == "ready"
+
+    def call(self, command, *args):
+        self.commands.put((command, list(args)))
+        return self.results.get(timeout=10)
+
+    def eventually(self, command, *args, expected):
+        deadline = time.monotonic() + 10
+        while (result := self.call(command, *args)) != expected and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return result
+
+    def stop(self):
+        self.commands.put(None)
+        self.process.join(10)
+
+
+def test_revocations_and_invalidations_reach_other_worker_processes():
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        subscribers, replay = manager.list(), manager.dict()
+        first, second = (Worker(context, manager, subscribers, replay) for _ in range(2))
+        try:
+            second.call("cache_role", 1, 2)
+            assert second.call("role", 1, 2) == "Owner"
+            first.call("invalidate_event", 1)
+            assert second.eventually("role", 1, 2, expected=None) is None
+
+            first.call("revoke", "session-1")
+            assert first.call("revoked", "session-1") is True
+            assert second.eventually("revoked", "session-1", expected=True) is True
+
+            # A worker started after the revocation replays it
+            late = Worker(context, manager, subscribers, replay)
+            assert late.call("revoked", "session-1") is True
+            late.stop()
+        finally:
+            first.stop()
+            second.stop()
@@ -1,10 +1,20 @@
+import asyncio
+import json
 import os
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+import anyio
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from app import (auth, events, hashing, instrumentation, lifecycle, main, models, notifications, permissions,
+                 token_utils, versions)
 from app.main import app
+from app import database
 from app.database import Base, get_db
 
 TEST_DB = "./test.db"
@@ -52,6 +62,12 @@ def user_tokens():
         },
     }
 
+@pytest.fixture(scope="module")
+def user2_headers(user_tokens):
+    # A session of its own, user_tokens["user2"] is logged out by test_logout
+    response = client.post("/api/auth/login", data={"username": "user2", "password": "password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
 def test_refresh_token(user_tokens):
     headers = {"Authorization": f"Bearer {user_tokens['user1']['refresh']}"}
     response = client.post("/api/auth/refresh", headers=headers)
@@ -63,6 +79,11 @@ def test_logout(user_tokens):
     response = client.post("/api/auth/logout", headers=headers)
     assert response.status_code == 200
 
+def test_logout_revokes_access_tokens_of_the_session(user_tokens):
+    headers = {"Authorization": f"Bearer {user_tokens['user2']['access']}"}
+    response = client.get("/api/events", headers=headers)
+    assert response.status_code == 401
+
 def test_create_event(user_tokens):
     event = {
         "title": "Test Event",
@@ -110,6 +131,586 @@ def test_delete_event(user_tokens):
     response = client.delete("/api/events/1", headers=headers)
     assert response.status_code == 200
 
+def test_create_batch_events(user_tokens):
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    batch = [
+        {
+            "title": f"Batch Event {i}",
+            "description": "Batch import",
+            "start_time": "2025-06-01T09:00:00",
+            "end_time": "2025-06-01T10:00:00",
+            "location": "Remote",
+        }
+        for i in range(5)
+    ]
+    response = client.post("/api/events/batch?chunk_size=2", json=batch, headers=headers)
+    assert response.status_code == 200
+    created = response.json()
+    assert [e["title"] for e in created] == [e["title"] for e in batch]
+    assert len({e["id"] for e in created}) == 5
+
+    for event in created:
+        response = client.get(f"/api/events/{event['id']}", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["title"] == event["title"]
+
+def test_create_batch_events_report(user_tokens):
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    batch = [
+        {
+            "title": f"Report Event {i}",
+            "description": "Batch import",
+            "start_time": "2025-06-02T09:00:00",
+            "end_time": "2025-06-02T10:00:00",
+        }
+        for i in range(3)
+    ]
+    response = client.post("/api/events/batch/report", json=batch, headers=headers)
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert all(r["ok"] and r["event"]["id"] for r in results)
+
+def test_import_and_export_ndjson(user2_headers):
+    headers = user2_headers
+    lines = [
+        '{"title": "Imported 1", "description": "ndjson", "start_time": "2025-07-01T09:00:00", "end_time": "2025-07-01T10:00:00"}',
+        '{"title": "Missing fields"}',
+        '',
+        '{"title": "Imported 2", "description": "ndjson", "start_time": "2025-07-02T09:00:00", "end_time": "2025-07-02T10:00:00"}',
+    ]
+    response = client.post("/api/events/import?chunk_size=1", content="\n".join(lines).encode(),
+                           headers={**headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["imported"] == 2
+    assert body["failed"] == 1
+    assert body["errors"][0]["line"] == 2
+
+    response = client.get("/api/events/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["title"] for e in exported] == ["Imported 1", "Imported 2"]
+    assert set(exported[0]) == {"id", "owner_id", "title", "description", "start_time", "end_time",
+                                "location", "is_recurring", "recurrence_pattern"}
+
+def test_import_reports_oversized_lines(user2_headers):
+    event = {"title": "After long line", "description": "ndjson", "start_time": "2025-07-03T09:00:00",
+             "end_time": "2025-07-03T10:00:00"}
+    oversized = json.dumps({**event, "description": "x" * events.IMPORT_MAX_LINE_BYTES})
+    response = client.post("/api/events/import", content=f"{oversized}\n{json.dumps(event)}\n".encode(),
+                           headers={**user2_headers, "Content-Type": "application/x-ndjson"})
+    body = response.json()
+    assert body["imported"] == 1 and body["failed"] == 1
+    assert body["errors"][0]["line"] == 1 and "longer than" in body["errors"][0]["error"]
+
+def test_share_update_and_remove_permission(user_tokens, user2_headers):
+    owner = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    other = user2_headers
+    event = {
+        "title": "Shared Event",
+        "description": "Collaboration",
+        "start_time": "2025-08-01T09:00:00",
+        "end_time": "2025-08-01T10:00:00",
+    }
+    event_id = client.post("/api/events", json=event, headers=owner).json()["id"]
+    assert client.get(f"/api/events/{event_id}", headers=other).status_code == 403
+
+    response = client.post(f"/api/events/{event_id}/share",
+                           json={"users": [{"user_id": 2, "role": "Viewer"}]}, headers=owner)
+    assert response.status_code == 200
+    assert client.get(f"/api/events/{event_id}", headers=other).status_code == 200
+    assert client.put(f"/api/events/{event_id}", json=event, headers=other).status_code == 403
+
+    response = client.put(f"/api/events/{event_id}/permissions/2?role=Editor", headers=owner)
+    assert response.status_code == 200
+    assert client.put(f"/api/events/{event_id}", json=event, headers=other).status_code == 200
+
+    assert client.put(f"/api/events/{event_id}/permissions/2?role=viewer", headers=owner).status_code == 422
+    # A role written before roles were validated grants nothing
+    db = TestingSessionLocal()
+    db.query(models.EventPermission).filter_by(event_id=event_id, user_id=2).update({"role": "editor"})
+    db.commit()
+    db.close()
+    permissions.invalidate(event_id, 2)
+    assert client.put(f"/api/events/{event_id}", json=event, headers=other).status_code == 403
+    assert client.delete(f"/api/events/{event_id}", headers=other).status_code == 403
+
+    response = client.delete(f"/api/events/{event_id}/permissions/2", headers=owner)
+    assert response.json() == {"message": "Permission removed"}
+    assert client.get(f"/api/events/{event_id}", headers=other).status_code == 403
+
+def test_list_events_keyset_pagination(user_tokens):
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    everything = client.get("/api/events?limit=1000", headers=headers).json()
+    assert "x-next-cursor" not in client.get("/api/events?limit=1000", headers=headers).headers
+    keys = [(e["start_time"], e["id"]) for e in everything]
+    assert keys == sorted(keys)
+
+    seen, cursor = [], None
+    while True:
+        url = "/api/events?limit=2" + (f"&cursor={cursor}" if cursor else "")
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        seen.extend(e["id"] for e in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == [e["id"] for e in everything]
+
+    assert client.get("/api/events?cursor=not-a-cursor", headers=headers).status_code == 400
+
+def test_list_events_filters(user_tokens):
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    response = client.get("/api/events?limit=100&location=Remote&start=2025-06-01T00:00:00"
+                          "&end=2025-06-01T23:59:59&role=Owner", headers=headers)
+    assert response.status_code == 200
+    titles = [e["title"] for e in response.json()]
+    assert titles and all(t.startswith("Batch Event") for t in titles)
+
+@pytest.fixture
+def metrics_headers(monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape")
+    return {"Authorization": "Bearer scrape"}
+
+def test_internal_metrics_requires_token_or_loopback(metrics_headers, monkeypatch):
+    assert client.get("/internal/metrics").status_code == 403
+    assert client.get("/internal/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert client.get("/internal/metrics", headers=metrics_headers).status_code == 200
+
+    monkeypatch.setattr(main, "METRICS_TOKEN", None)
+    assert client.get("/internal/metrics").status_code == 403
+    assert TestClient(app, client=("127.0.0.1", 50000)).get("/internal/metrics").status_code == 200
+
+def test_internal_metrics_exposes_pool_stats(metrics_headers):
+    database.get_engine()  # created on first use, normally by the lifespan warming the pool
+    response = client.get("/internal/metrics", headers=metrics_headers)
+    assert response.status_code == 200
+    assert "# TYPE db_pool_checkout_wait_seconds histogram" in response.text
+    assert 'db_pool_connections_in_use{pool="sync"}' in response.text
+
+def test_internal_metrics_exposes_cache_stats(user_tokens, metrics_headers):
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    client.get("/api/events?limit=1", headers=headers)
+    text = client.get("/internal/metrics", headers=metrics_headers).text
+    for cache in ("users", "permission_roles", "responses"):
+        assert f'cache_hits_total{{cache="{cache}"}}' in text
+        assert f'cache_misses_total{{cache="{cache}"}}' in text
+    assert "# TYPE cache_hits_total counter" in text
+    assert 'cache_entries{cache="users"}' in text
+
+def test_login_rehashes_password_with_current_cost(monkeypatch):
+    client.post("/api/auth/register", json={"username": "rehash", "password": "password"})
+    monkeypatch.setattr(hashing, "rounds", 4)
+    response = client.post("/api/auth/login", data={"username": "rehash", "password": "password"})
+    assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.username == "rehash").first()
+        assert hashing.hash_cost(user.hashed_password) == 4
+    finally:
+        db.close()
+
+def test_version_history_with_delta_storage(user_tokens, monkeypatch):
+    monkeypatch.setattr(versions, "VERSION_SNAPSHOT_INTERVAL", 3)
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    event = {
+        "title": "Versioned v1",
+        "description": "History",
+        "start_time": "2025-10-01T09:00:00",
+        "end_time": "2025-10-01T10:00:00",
+        "location": "Room 1",
+    }
+    event_id = client.post("/api/events", json=event, headers=headers).json()["id"]
+    for n in range(2, 6):
+        event = {**event, "title": f"Versioned v{n}", "location": f"Room {n % 2}"}
+        assert client.put(f"/api/events/{event_id}", json=event, headers=headers).status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        stored = db.query(models.EventVersion).filter_by(event_id=event_id).order_by(
+            models.EventVersion.version_number).all()
+        assert [v.version_number for v in stored] == [1, 2, 3, 4, 5]
+        assert [v.kind for v in stored] == ["snapshot", "delta", "delta", "snapshot", "delta"]
+        assert json.loads(stored[1].data) == {"title": "Versioned v2", "location": "Room 0"}
+    finally:
+        db.close()
+
+    changelog = client.get(f"/api/events/{event_id}/changelog", headers=headers).json()
+    ids = sorted(v["version_id"] for v in changelog)
+    data = json.loads(client.get(f"/api/events/{event_id}/history/{ids[2]}", headers=headers).json()["data"])
+    assert data["title"] == "Versioned v3"
+    assert data["description"] == "History"
+    assert data["start_time"] == "2025-10-01T09:00:00"
+
+    diff = client.get(f"/api/events/{event_id}/diff/{ids[1]}/{ids[4]}", headers=headers).json()
+    assert diff == {"title": {"from": "Versioned v2", "to": "Versioned v5"},
+                    "location": {"from": "Room 0", "to": "Room 1"}}
+
+    response = client.post(f"/api/events/{event_id}/rollback/{ids[2]}", headers=headers)
+    assert response.status_code == 200
+    restored = client.get(f"/api/events/{event_id}", headers=headers).json()
+    assert restored["title"] == "Versioned v3"
+    assert restored["location"] == "Room 1"
+
+    db = TestingSessionLocal()
+    try:
+        monkeypatch.setattr(versions, "VERSION_STORAGE", "full")
+        assert versions.compact_history(db, event_id=event_id) == 1
+        stored = db.query(models.EventVersion).filter_by(event_id=event_id).order_by(
+            models.EventVersion.version_number).all()
+        assert {v.kind for v in stored} == {"snapshot"}
+        assert json.loads(stored[2].data)["title"] == "Versioned v3"
+        assert json.loads(stored[-1].data)["title"] == "Versioned v3"
+    finally:
+        db.close()
+
+def test_changelog_pagination_and_composed_diff(user_tokens):
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    event = {
+        "title": "Timeline",
+        "description": "v1",
+        "start_time": "2025-11-01T09:00:00",
+        "end_time": "2025-11-01T10:00:00",
+    }
+    event_id = client.post("/api/events", json=event, headers=headers).json()["id"]
+    for n in range(2, 5):
+        client.put(f"/api/events/{event_id}", json={**event, "description": f"v{n}"}, headers=headers)
+
+    first_page = client.get(f"/api/events/{event_id}/changelog?limit=2", headers=headers).json()
+    assert [v["version_number"] for v in first_page] == [4, 3]
+    assert first_page[0]["changes"] == {"description": {"from": "v3", "to": "v4"}}
+    second_page = client.get(f"/api/events/{event_id}/changelog?limit=2&before=3", headers=headers).json()
+    assert [v["version_number"] for v in second_page] == [2, 1]
+    assert second_page[-1]["changes"]["title"] == {"from": None, "to": "Timeline"}
+
+    newest, oldest = first_page[0]["version_id"], second_page[-1]["version_id"]
+    forward = client.get(f"/api/events/{event_id}/diff/{oldest}/{newest}", headers=headers).json()
+    assert forward == {"description": {"from": "v1", "to": "v4"}}
+    backward = client.get(f"/api/events/{event_id}/diff/{newest}/{oldest}", headers=headers).json()
+    assert backward == {"description": {"from": "v4", "to": "v1"}}
+
+def test_occurrences_window(user_tokens, user2_headers):
+    headers = user2_headers
+    weekly = {
+        "title": "Standup",
+        "description": "Weekly",
+        "start_time": "2030-01-07T09:00:00",
+        "end_time": "2030-01-07T09:15:00",
+        "is_recurring": True,
+        "recurrence_pattern": "FREQ=WEEKLY;BYDAY=MO,TH",
+    }
+    event_id = client.post("/api/events", json=weekly, headers=headers).json()["id"]
+    window = "start=2030-01-08T00:00:00&end=2030-01-15T00:00:00"
+
+    response = client.get(f"/api/occurrences?{window}", headers=headers)
+    assert response.status_code == 200
+    assert [(o["event_id"], o["start_time"]) for o in response.json()] == [
+        (event_id, "2030-01-10T09:00:00"), (event_id, "2030-01-14T09:00:00")]
+
+    client.put(f"/api/events/{event_id}", json={**weekly, "recurrence_pattern": "FREQ=WEEKLY;BYDAY=TU"},
+               headers=headers)
+    response = client.get(f"/api/occurrences?{window}", headers=headers)
+    assert [o["start_time"] for o in response.json()] == ["2030-01-08T09:00:00"]
+
+    client.delete(f"/api/events/{event_id}", headers=headers)
+    assert client.get(f"/api/occurrences?{window}", headers=headers).json() == []
+    assert client.get("/api/occurrences?start=2030-01-02&end=2030-01-01", headers=headers).status_code == 400
+
+    owner = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    response = client.get("/api/occurrences?start=2025-06-01T00:00:00&end=2025-06-02T00:00:00", headers=owner)
+    assert {o["title"] for o in response.json()} == {f"Batch Event {i}" for i in range(5)}
+
+def test_out_of_range_recurrence_does_not_fail_create(user2_headers):
+    event = {"title": "Far apart", "description": "Overflow", "start_time": "2024-01-01T09:00:00",
+             "end_time": "2024-01-01T10:00:00", "is_recurring": True}
+    for pattern in ("FREQ=YEARLY;INTERVAL=9000", "FREQ=DAILY;INTERVAL=5000000", "FREQ=YEARLY;INTERVAL=1000"):
+        response = client.post("/api/events", json={**event, "recurrence_pattern": pattern}, headers=user2_headers)
+        assert response.status_code == 200
+    batch = client.post("/api/events/batch", json=[{**event, "recurrence_pattern": "FREQ=YEARLY;INTERVAL=9000"}],
+                        headers=user2_headers)
+    assert batch.status_code == 200
+
+def test_conflicts_and_free_busy(user2_headers):
+    headers = user2_headers
+    meeting = {
+        "title": "Planning",
+        "description": "Conflict detection",
+        "start_time": "2031-03-03T10:00:00",
+        "end_time": "2031-03-03T11:00:00",
+    }
+    event_id = client.post("/api/events?check_conflicts=true", json=meeting, headers=headers).json()["id"]
+
+    response = client.post("/api/events/conflicts", headers=headers,
+                           json={"start_time": "2031-03-03T10:30:00", "end_time": "2031-03-03T12:00:00"})
+    assert [o["event_id"] for o in response.json()] == [event_id]
+    response = client.post("/api/events/conflicts", headers=headers,
+                           json={"start_time": "2031-03-03T11:00:00", "end_time": "2031-03-03T12:00:00"})
+    assert response.json() == []
+
+    response = client.post("/api/events?check_conflicts=true", json=meeting, headers=headers)
+    assert response.status_code == 409
+    assert response.json()["detail"]["conflicts"][0]["conflicts"][0]["event_id"] == event_id
+
+    overlapping_batch = [
+        {**meeting, "start_time": "2031-03-04T10:00:00", "end_time": "2031-03-04T11:00:00"},
+        {**meeting, "start_time": "2031-03-04T10:30:00", "end_time": "2031-03-04T11:30:00"},
+    ]
+    response = client.post("/api/events/batch?check_conflicts=true", json=overlapping_batch, headers=headers)
+    assert response.status_code == 409
+    assert [c["index"] for c in response.json()["detail"]["conflicts"]] == [0, 1]
+
+    client.post("/api/events", json={**meeting, "start_time": "2031-03-03T10:45:00",
+                                     "end_time": "2031-03-03T12:00:00"}, headers=headers)
+    response = client.post("/api/freebusy", headers=headers, json={
+        "user_ids": [2], "start_time": "2031-03-03T00:00:00", "end_time": "2031-03-04T00:00:00"})
+    assert response.json() == [{"user_id": 2, "busy": [
+        {"start_time": "2031-03-03T10:00:00", "end_time": "2031-03-03T12:00:00"}]}]
+    # Other calendars are only visible to users who share a group with them
+    response = client.post("/api/freebusy", headers=headers, json={
+        "user_ids": [1, 2], "start_time": "2031-03-03T00:00:00", "end_time": "2031-03-04T00:00:00"})
+    assert response.status_code == 403 and response.json()["detail"]["user_ids"] == [1]
+
+def test_refresh_token_rotation_and_sweep():
+    login = client.post("/api/auth/login", data={"username": "user1", "password": "password"}).json()
+    headers = {"Authorization": f"Bearer {login['refresh_token']}"}
+    rotated = client.post("/api/auth/refresh", headers=headers)
+    assert rotated.status_code == 200
+    assert client.post("/api/auth/refresh", headers=headers).status_code == 401
+
+    db = TestingSessionLocal()
+    try:
+        stored = db.query(models.RefreshToken).filter_by(
+            token_hash=token_utils.token_digest(rotated.json()["refresh_token"])).one()
+        assert len(stored.token_hash) == 64
+
+        expired_at = datetime.utcnow() - timedelta(minutes=1)
+        db.add_all([models.RefreshToken(token_hash=f"{i:064x}", user_id=1, expires_at=expired_at)
+                    for i in range(3)])
+        db.commit()
+        assert auth.sweep_expired_tokens(db, batch_size=2) == 3
+        assert db.query(models.RefreshToken).filter(models.RefreshToken.expires_at <= datetime.utcnow()).count() == 0
+        assert db.query(models.RefreshToken).filter_by(id=stored.id).count() == 1
+    finally:
+        db.close()
+
+def test_bulk_permission_changes(user_tokens, user2_headers):
+    owner = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    event = {"title": "Bulk Shared", "description": "Bulk", "start_time": "2031-01-01T09:00:00", "end_time": "2031-01-01T10:00:00"}
+    first, second = (client.post("/api/events", json=event, headers=owner).json()["id"] for _ in range(2))
+    foreign = client.post("/api/events", json=event, headers=user2_headers).json()["id"]
+    client.post(f"/api/events/{second}/share", json={"users": [{"user_id": 2, "role": "Viewer"}]}, headers=owner)
+
+    response = client.post("/api/events/permissions/bulk", headers=owner, json={
+        "grants": [{"event_id": first, "user_id": 2, "role": "Editor"},
+                   {"event_id": foreign, "user_id": 1, "role": "Owner"},
+                   {"event_id": first, "user_id": 999, "role": "Viewer"}],
+        "revocations": [{"event_id": second, "user_id": 2}, {"event_id": first, "user_id": 2},
+                        {"event_id": second, "user_id": 999}]})
+    assert response.status_code == 200
+    assert [(r["action"], r["event_id"], r["user_id"], r["status"]) for r in response.json()] == [
+        ("grant", first, 2, "created"), ("grant", foreign, 1, "forbidden"),
+        ("grant", first, 999, "user_not_found"), ("revoke", second, 2, "revoked"),
+        ("revoke", first, 2, "superseded"), ("revoke", second, 999, "not_found")]
+    assert client.put(f"/api/events/{first}", json=event, headers=user2_headers).status_code == 200
+    assert client.get(f"/api/events/{second}", headers=user2_headers).status_code == 403
+
+    response = client.post("/api/events/permissions/bulk", headers=owner, json={
+        "grants": [{"event_id": first, "user_id": 2, "role": "Editor"}]})
+    assert response.json()[0]["status"] == "unchanged"
+    client.post(f"/api/events/{first}/share", json={"users": [{"user_id": 2, "role": "Viewer"}]}, headers=owner)
+    assert client.put(f"/api/events/{first}", json=event, headers=user2_headers).status_code == 403
+
+def test_nested_group_grants(user_tokens, user2_headers):
+    owner = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    event = {"title": "Team Event", "description": "Groups", "start_time": "2032-01-01T09:00:00",
+             "end_time": "2032-01-01T10:00:00"}
+    event_id = client.post("/api/events", json=event, headers=owner).json()["id"]
+    org = client.post("/api/groups", json={"name": "org"}, headers=owner).json()["id"]
+    team = client.post("/api/groups", json={"name": "team"}, headers=owner).json()["id"]
+    assert client.post("/api/groups", json={"name": "org"}, headers=owner).status_code == 400
+
+    assert client.post(f"/api/groups/{team}/members", json={"user_ids": [2]}, headers=owner).status_code == 200
+    assert client.post(f"/api/groups/{org}/members", json={"group_ids": [team]}, headers=owner).status_code == 200
+    assert client.post(f"/api/groups/{team}/members", json={"group_ids": [org]}, headers=owner).status_code == 400
+    assert client.post(f"/api/groups/{org}/members", json={"user_ids": [1]},
+                       headers=user2_headers).status_code == 403
+
+    assert client.post(f"/api/events/{event_id}/share/groups", json={"groups": [{"group_id": org, "role": "Owner"}]},
+                       headers=owner).status_code == 400
+    client.post(f"/api/events/{event_id}/share", json={"users": [{"user_id": 2, "role": "Viewer"}]}, headers=owner)
+    client.post(f"/api/events/{event_id}/share/groups", json={"groups": [{"group_id": org, "role": "Editor"}]},
+                headers=owner)
+    assert client.get(f"/api/events/{event_id}/groups", headers=owner).json() == [{"group_id": org, "role": "Editor"}]
+    # The stronger group grant wins over the direct Viewer grant
+    assert client.put(f"/api/events/{event_id}", json=event, headers=user2_headers).status_code == 200
+    listed = client.get("/api/events?role=Editor&limit=1000", headers=user2_headers).json()
+    assert [e["id"] for e in listed if e["id"] == event_id] == [event_id]
+
+    client.delete(f"/api/groups/{org}/subgroups/{team}", headers=owner)
+    assert client.put(f"/api/events/{event_id}", json=event, headers=user2_headers).status_code == 403
+    assert client.get(f"/api/events/{event_id}", headers=user2_headers).status_code == 200
+
+def test_change_notifications_follow_visibility(user_tokens, user2_headers):
+    owner = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    event = {"title": "Watched", "description": "SSE", "start_time": "2033-01-01T09:00:00",
+             "end_time": "2033-01-01T10:00:00"}
+    loop = asyncio.new_event_loop()
+    subscriber = notifications.subscribe(2, loop)
+
+    def received():
+        loop.run_until_complete(asyncio.sleep(0))
+        messages = []
+        while not subscriber.queue.empty():
+            messages.append(subscriber.queue.get_nowait())
+        return [(m["type"], m["event_id"]) for m in messages]
+
+    try:
+        event_id = client.post("/api/events", json=event, headers=owner).json()["id"]
+        assert received() == []
+        client.post(f"/api/events/{event_id}/share", json={"users": [{"user_id": 2, "role": "Viewer"}]},
+                    headers=owner)
+        client.put(f"/api/events/{event_id}", json={**event, "title": "Watched 2"}, headers=owner)
+        client.delete(f"/api/events/{event_id}", headers=owner)
+        assert received() == [("shared", event_id), ("updated", event_id), ("deleted", event_id)]
+    finally:
+        notifications.broker.unsubscribe(subscriber)
+        loop.close()
+
+def test_etags_and_conditional_requests(user_tokens):
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    event = {"title": "Tagged", "description": "ETag", "start_time": "2034-01-01T09:00:00",
+             "end_time": "2034-01-01T10:00:00"}
+    event_id = client.post("/api/events", json=event, headers=headers).json()["id"]
+
+    first = client.get(f"/api/events/{event_id}", headers=headers)
+    etag = first.headers["etag"]
+    assert first.json()["title"] == "Tagged"
+    cached = client.get(f"/api/events/{event_id}", headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    assert client.get(f"/api/events/{event_id}", headers=headers).content == first.content
+
+    updated = client.put(f"/api/events/{event_id}", json={**event, "title": "Tagged 2"},
+                         headers={**headers, "If-Match": etag})
+    assert updated.status_code == 200
+    new_etag = updated.headers["etag"]
+    assert new_etag != etag
+    stale = client.put(f"/api/events/{event_id}", json={**event, "title": "Lost update"},
+                       headers={**headers, "If-Match": etag})
+    assert stale.status_code == 412
+    assert client.get(f"/api/events/{event_id}", headers={**headers, "If-None-Match": etag}).json()["title"] == "Tagged 2"
+    assert client.get(f"/api/events/{event_id}", headers={**headers, "If-None-Match": new_etag}).status_code == 304
+
+    permissions_etag = client.get(f"/api/events/{event_id}/permissions", headers=headers).headers["etag"]
+    assert client.get(f"/api/events/{event_id}/permissions",
+                      headers={**headers, "If-None-Match": permissions_etag}).status_code == 304
+    version_id = client.get(f"/api/events/{event_id}/changelog", headers=headers).json()[0]["version_id"]
+    version = client.get(f"/api/events/{event_id}/history/{version_id}", headers=headers)
+    assert version.json()["version_id"] == version_id
+    assert client.get(f"/api/events/{event_id}/history/{version_id}",
+                      headers={**headers, "If-None-Match": f'W/{version.headers["etag"]}'}).status_code == 304
+
+def test_request_timing_metrics_and_slow_profiles(user_tokens, metrics_headers, monkeypatch, tmp_path):
+    headers = {"Authorization": f"Bearer {user_tokens['user1']['access']}"}
+    timing = client.get("/api/events?limit=5", headers=headers).headers["server-timing"]
+    db, serialize, handler = [part.strip() for part in timing.split(",")]
+    assert db.startswith("db;dur=") and int(db.split('desc="')[1].split()[0]) >= 1
+    assert serialize.startswith("serialize;dur=") and handler.startswith("handler;dur=")
+
+    rendered = client.get("/internal/metrics", headers=metrics_headers).text
+    assert 'http_request_queries_count{method="GET",route="/api/events"}' in rendered
+    assert 'http_request_serialization_seconds_sum{method="GET",route="/api/events"}' in rendered
+
+    monkeypatch.setattr(instrumentation, "PROFILE_SLOW_MS", 0.001)
+    monkeypatch.setattr(instrumentation, "PROFILE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(instrumentation, "PROFILE_INTERVAL_MS", 0.5)
+    monkeypatch.setattr(instrumentation, "PROFILE_DIR", str(tmp_path))
+    client.post("/api/auth/login", data={"username": "user1", "password": "password"})
+    profiles = list(tmp_path.glob("*-POST-api-auth-login-*.folded"))
+    assert profiles and profiles[0].read_text().strip()
+
+def _queries(response):
+    return int(response.headers["server-timing"].split('desc="')[1].split()[0])
+
+def test_mutation_round_trip_budgets(user2_headers):
+    # SQL statements per request, with the user and permission caches warm. Raise a
+    # budget only on purpose: each mutation is one transaction with no re-reads.
+    event = {"title": "Budget", "description": "Round trips", "start_time": "2035-01-01T09:00:00",
+             "end_time": "2035-01-01T10:00:00"}
+    client.get("/api/events?limit=1", headers=user2_headers)
+
+    created = client.post("/api/events", json=event, headers=user2_headers)
+    event_id = created.json()["id"]
+    assert _queries(created) <= 4  # event RETURNING id, permission, version, occurrence
+    assert _queries(client.get("/api/events?limit=10", headers=user2_headers)) <= 1
+
+    updated = client.put(f"/api/events/{event_id}", json={**event, "title": "Budget 2"}, headers=user2_headers)
+    assert updated.json()["title"] == "Budget 2" and updated.headers["etag"] == f'"{event_id}-2"'
+    assert _queries(updated) <= 6  # role + row, UPDATE RETURNING, occurrences x2, version number + row
+    fetched = client.get(f"/api/events/{event_id}", headers=user2_headers)
+    assert fetched.json()["title"] == "Budget 2" and _queries(fetched) <= 3
+
+    version_id = client.get(f"/api/events/{event_id}/changelog", headers=user2_headers).json()[-1]["version_id"]
+    rolled_back = client.post(f"/api/events/{event_id}/rollback/{version_id}", headers=user2_headers)
+    assert rolled_back.status_code == 200 and _queries(rolled_back) <= 8
+    assert client.get(f"/api/events/{event_id}", headers=user2_headers).json()["title"] == "Budget"
+
+    shared = client.post(f"/api/events/{event_id}/share", json={"users": [{"user_id": 1, "role": "Viewer"}]},
+                         headers=user2_headers)
+    assert shared.status_code == 200 and _queries(shared) <= 2
+    batch = client.post("/api/events/batch", json=[event, event], headers=user2_headers)
+    # SQLite inserts RETURNING rows one at a time, Postgres in a single statement
+    assert _queries(batch) <= 5
+    deleted = client.delete(f"/api/events/{event_id}", headers=user2_headers)
+    assert deleted.status_code == 200 and _queries(deleted) <= 6
+
+def test_health_probes_follow_startup_and_draining(user2_headers, metrics_headers):
+    assert client.get("/health/live").json() == {"status": "ok"}
+    try:
+        with TestClient(app) as running:
+            assert running.get("/health/ready").json() == {"status": "ready"}
+            lifecycle.begin_drain()
+            draining = running.get("/health/ready")
+            assert draining.status_code == 503 and draining.json() == {"status": "draining"}
+            assert running.get("/health/live").status_code == 200
+            assert running.get("/api/events/stream", headers=user2_headers).status_code == 503
+        assert 'app_startup_seconds{phase="lifespan"}' in client.get("/internal/metrics", headers=metrics_headers).text
+    finally:
+        lifecycle.reset()
+    assert client.get("/health/ready").json() == {"status": "starting"}
+
+async def test_queued_password_hashes_do_not_starve_sync_routes(user2_headers, monkeypatch):
+    # Four logins wait on a stalled hash pool while the threadpool has two threads:
+    # a sync route still answers, and a fifth login is refused with a 503
+    stalled = []
+
+    class StalledPool:
+        def submit(self, fn, *args):
+            stalled.append(Future())
+            return stalled[-1]
+
+    async def queued():
+        while len(stalled) < 4:
+            await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(hashing, "PASSWORD_HASH_WORKERS", 1)
+    monkeypatch.setattr(hashing, "_get_executor", StalledPool)
+    monkeypatch.setattr(hashing, "_slots", threading.BoundedSemaphore(4))
+    monkeypatch.setattr(hashing, "needs_rehash", lambda hashed: False)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 2
+    login = {"username": "user2", "password": "password"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+        pending = [asyncio.create_task(http.post("/api/auth/login", data=login)) for _ in range(4)]
+        await asyncio.wait_for(queued(), 5)
+        assert (await http.post("/api/auth/login", data=login)).status_code == 503
+        listed = await asyncio.wait_for(http.get("/api/events?limit=1", headers=user2_headers), 5)
+        assert listed.status_code == 200
+        for future in stalled:
+            future.set_result(True)
+        assert [response.status_code for response in await asyncio.gather(*pending)] == [200] * 4
+
 @pytest.fixture(scope="module", autouse=True)
 def cleanup():
     yield
@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from app import metrics, pool
+
+
+def test_instrumented_pool_counts_timeouts(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=pool.InstrumentedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.01)
+    pool.register(engine, "test")
+    timeouts = pool.POOL_TIMEOUTS.value(pool="sync")
+    waits = pool.POOL_CHECKOUT_WAIT.count(pool="sync")
+
+    conn = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    assert pool.POOL_TIMEOUTS.value(pool="sync") == timeouts + 1
+    assert pool.POOL_CHECKOUT_WAIT.count(pool="sync") == waits + 2
+    assert 'db_pool_connections_in_use{pool="test"} 1' in metrics.render()
+
+    conn.close()
+    engine.dispose()
+
+
+def test_render_histogram_and_labels():
+    histogram = metrics.Histogram("test_latency_seconds", "Test histogram", ["route"], buckets=(0.1, 1))
+    histogram.observe(0.5, route='/a"b')
+    rendered = metrics.render()
+    assert 'test_latency_seconds_bucket{route="/a\\"b",le="0.1"} 0' in rendered
+    assert 'test_latency_seconds_bucket{route="/a\\"b",le="1"} 1' in rendered
+    assert 'test_latency_seconds_count{route="/a\\"b"} 1' in rendered
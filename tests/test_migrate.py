@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, select, text
+
+from app import migrate, models, versions
+from app.database import Base
+
+# The schema as the first release created it
+BASELINE_SCHEMA = """
+CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR NOT NULL, hashed_password VARCHAR NOT NULL, PRIMARY KEY (id));
+CREATE INDEX ix_users_id ON users (id);
+CREATE UNIQUE INDEX ix_users_username ON users (username);
+CREATE TABLE events (id INTEGER NOT NULL, title VARCHAR, description VARCHAR, start_time DATETIME, end_time DATETIME,
+    location VARCHAR, is_recurring VARCHAR, recurrence_pattern VARCHAR, owner_id INTEGER, PRIMARY KEY (id),
+    FOREIGN KEY(owner_id) REFERENCES users (id));
+CREATE INDEX ix_events_id ON events (id);
+CREATE TABLE refresh_tokens (id INTEGER NOT NULL, token VARCHAR NOT NULL, user_id INTEGER, created_at DATETIME,
+    PRIMARY KEY (id), UNIQUE (token), FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE);
+CREATE INDEX ix_refresh_tokens_id ON refresh_tokens (id);
+CREATE TABLE event_permissions (id INTEGER NOT NULL, event_id INTEGER, user_id INTEGER, role VARCHAR, PRIMARY KEY (id),
+    FOREIGN KEY(event_id) REFERENCES events (id), FOREIGN KEY(user_id) REFERENCES users (id));
+CREATE INDEX ix_event_permissions_id ON event_permissions (id);
+CREATE TABLE event_versions (id INTEGER NOT NULL, event_id INTEGER, data JSON, timestamp DATETIME, PRIMARY KEY (id),
+    FOREIGN KEY(event_id) REFERENCES events (id));
+CREATE INDEX ix_event_versions_id ON event_versions (id);
+"""
+
+NOW = datetime.utcnow().replace(microsecond=0)
+START = NOW.replace(hour=9, minute=0, second=0)
+
+
+def snapshot(title):
+    return {"title": title, "description": "", "start_time": START.isoformat(),
+            "end_time": (START + timedelta(hours=1)).isoformat(), "location": "Room 1",
+            "is_recurring": False, "recurrence_pattern": None}
+
+
+def jwt_with_exp(exp: datetime):
+    claims = base64.urlsafe_b64encode(json.dumps({"sub": "alice", "exp": int(exp.timestamp())}).encode())
+    return f"header.{claims.decode().rstrip('=')}.signature"
+
+
+def run_script(engine, script: str):
+    with engine.begin() as conn:
+        for statement in script.split(";"):
+            if statement.strip():
+                conn.execute(text(statement))
+
+
+def schema_of(engine):
+    inspector = inspect(engine)
+    return {table: ({column["name"] for column in inspector.get_columns(table)},
+                    {index["name"]: (index["column_names"], bool(index["unique"]))
+                     for index in inspector.get_indexes(table)})
+            for table in inspector.get_table_names()}
+
+
+def test_migrate_upgrades_a_baseline_database(sqlite_engine, sqlite_session):
+    engine = sqlite_engine(create_all=False)
+    run_script(engine, BASELINE_SCHEMA)
+    token = jwt_with_exp(NOW + timedelta(days=1))
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users VALUES (1, 'alice', 'hash')"))
+        conn.execute(text("INSERT INTO events VALUES (1, 'Standup', '', :start, :end, 'Room 1', 'true', "
+                          "'FREQ=DAILY;COUNT=5', 1)"), {"start": START, "end": START + timedelta(minutes=15)})
+        conn.execute(text("INSERT INTO events VALUES (2, 'Review', '', :start, :end, 'Room 1', 'false', NULL, 1)"),
+                     {"start": START, "end": START + timedelta(hours=1)})
+        conn.execute(text("INSERT INTO event_permissions VALUES (1, 1, 1, 'Owner'), (2, 2, 1, 'Owner')"))
+        # Written out of id order, the numbering follows the timestamps
+        for version_id, title, written in ((1, "Review v2", NOW), (2, "Review", NOW - timedelta(hours=1)),
+                                           (3, "Standup", NOW)):
+            conn.execute(text("INSERT INTO event_versions VALUES (:id, :event_id, :data, :written)"),
+                         {"id": version_id, "event_id": 1 if title == "Standup" else 2,
+                          "data": json.dumps(snapshot(title)), "written": written})
+        conn.execute(text("INSERT INTO refresh_tokens VALUES (1, :token, 1, :created)"),
+                     {"token": token, "created": NOW})
+        conn.execute(text("INSERT INTO refresh_tokens VALUES (2, 'not-a-jwt', 1, :created)"), {"created": NOW})
+
+    migrate.migrate(engine)
+
+    expected = {table.name: ({column.name for column in table.columns},
+                             {index.name: ([column.name for column in index.columns], bool(index.unique))
+                              for index in table.indexes})
+                for table in Base.metadata.sorted_tables}
+    assert schema_of(engine) == expected
+
+    db = sqlite_session(engine)
+    assert [event.revision for event in db.query(models.Event).order_by(models.Event.id)] == [1, 1]
+    history = db.query(models.EventVersion).filter_by(event_id=2).order_by(models.EventVersion.version_number).all()
+    assert [(v.id, v.version_number, v.kind) for v in history] == [(2, 1, "snapshot"), (1, 2, "snapshot")]
+    assert history[0].changes["title"] == {"from": None, "to": "Review"}
+    assert history[1].changes == {"title": {"from": "Review", "to": "Review v2"}}
+    assert versions.add_version(db, 2, snapshot("Review v3"), snapshot("Review v2")).version_number == 3
+
+    tokens = db.query(models.RefreshToken).order_by(models.RefreshToken.id).all()
+    assert tokens[0].token_hash == hashlib.sha256(token.encode()).hexdigest()
+    assert tokens[0].expires_at == NOW + timedelta(days=1)
+    assert tokens[1].expires_at == NOW  # unreadable, swept as expired
+
+    occurrences = db.query(models.EventOccurrence.event_id).all()
+    assert sorted(event_id for event_id, in occurrences) == [1] * 5 + [2]
+    db.rollback()
+    db.close()
+
+    # A second run finds nothing to do
+    with engine.connect() as conn:
+        before = list(conn.connection.driver_connection.iterdump())
+    migrate.migrate(engine)
+    with engine.connect() as conn:
+        assert list(conn.connection.driver_connection.iterdump()) == before
+
+
+def test_migrate_rebuilds_changed_indexes(sqlite_engine):
+    # A database created midway: occurrences without long_end_time, the old
+    # index on event_id alone, and the archival index without id and number
+    engine = sqlite_engine()
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_event_occurrences_event_long_end"))
+        conn.execute(text("ALTER TABLE event_occurrences DROP COLUMN long_end_time"))
+        conn.execute(text("CREATE INDEX ix_event_occurrences_event_id ON event_occurrences (event_id)"))
+        conn.execute(text("DROP INDEX ix_event_versions_event_timestamp"))
+        conn.execute(text("CREATE INDEX ix_event_versions_event_timestamp ON event_versions (event_id, timestamp)"))
+        conn.execute(text("INSERT INTO users (id, username, hashed_password) VALUES (1, 'alice', 'hash')"))
+        conn.execute(text("INSERT INTO events (id, title, start_time, end_time, owner_id) "
+                          "VALUES (1, 'Offsite', :start, :end, 1)"),
+                     {"start": START, "end": START + timedelta(days=10)})
+
+    migrate.migrate(engine)
+
+    indexes = schema_of(engine)
+    assert "ix_event_occurrences_event_id" not in indexes["event_occurrences"][1]
+    assert indexes["event_occurrences"][1]["ix_event_occurrences_event_long_end"] == (
+        ["event_id", "long_end_time"], False)
+    assert indexes["event_versions"][1]["ix_event_versions_event_timestamp"] == (
+        ["event_id", "timestamp", "id", "version_number"], False)
+    with engine.connect() as conn:
+        assert conn.execute(select(models.EventOccurrence.long_end_time)).scalars().all() == [
+            START + timedelta(days=10)]
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import queue
+
+import pytest
+
+from app import notifications
+
+
+async def _connected():
+    return False
+
+
+def _frames(chunks):
+    return [dict(line.split(": ", 1) for line in chunk.strip().splitlines()) for chunk in chunks]
+
+
+async def test_notifications_reach_only_the_audience():
+    viewer = notifications.subscribe(1)
+    outsider = notifications.subscribe(2)
+    try:
+        notifications.publish("updated", 7, [1, 3], {"id": 7})
+        await asyncio.sleep(0)
+        message = viewer.queue.get_nowait()
+        assert (message["type"], message["event_id"], message["event"]) == ("updated", 7, {"id": 7})
+        assert outsider.queue.empty()
+    finally:
+        notifications.broker.unsubscribe(viewer)
+        notifications.broker.unsubscribe(outsider)
+    assert not notifications.has_listeners()
+
+
+async def test_slow_subscriber_drops_oldest():
+    subscriber = notifications.subscribe(1, maxsize=2, policy="drop_oldest")
+    for event_id in range(3):
+        notifications.publish("created", event_id, [1])
+    await asyncio.sleep(0)
+    assert subscriber.dropped == 1
+
+    chunks, stream = [], notifications.stream(subscriber, _connected, heartbeat=0.01)
+    async for chunk in stream:
+        chunks.append(chunk)
+        if len(chunks) == 4:
+            break
+    await stream.aclose()
+
+    frames = _frames(chunks)
+    assert frames[0]["event"] == "overflow" and json.loads(frames[0]["data"]) == {"dropped": 1}
+    assert [json.loads(f["data"])["event_id"] for f in frames[1:3]] == [1, 2]
+    assert chunks[3] == ": keepalive\n\n"
+    assert len(notifications.broker) == 0
+
+
+async def test_slow_subscriber_disconnect_policy():
+    subscriber = notifications.subscribe(1, maxsize=1, policy="disconnect")
+    notifications.publish("created", 1, [1])
+    notifications.publish("created", 2, [1])
+    await asyncio.sleep(0)
+
+    chunks = [chunk async for chunk in notifications.stream(subscriber, _connected)]
+    assert _frames(chunks) == [{"event": "overflow", "data": '{"disconnected": true}'}]
+    assert len(notifications.broker) == 0
+
+
+class FakePubSub:
+    def __init__(self, client):
+        self.client = client
+        self.messages = queue.Queue()
+
+    def subscribe(self, channel):
+        if self.client.down:
+            raise ConnectionError("redis is down")
+        self.client.subscriptions.append(self)
+
+    def listen(self):
+        while True:
+            item = self.messages.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        self.messages.put(None)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.published = []
+        self.subscriptions = []
+        self.down = False
+
+    def publish(self, channel, data):
+        if self.down:
+            raise ConnectionError("redis is down")
+        self.published.append((channel, data))
+        for subscription in self.subscriptions:
+            subscription.messages.put({"channel": channel, "data": data})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+    def drop_connections(self):
+        subscriptions, self.subscriptions = self.subscriptions, []
+        for subscription in subscriptions:
+            subscription.messages.put(ConnectionError("connection lost"))
+
+
+async def _received(subscriber, timeout=2.0):
+    return await asyncio.wait_for(subscriber.queue.get(), timeout)
+
+
+async def _until(condition, timeout=2.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+@pytest.fixture
+def redis_backend():
+    client = FakeRedis()
+    backend = notifications.RedisFanout(client, notifications.broker, reconnect_delay=0.01)
+    previous = notifications.get_backend()
+    notifications.set_backend(backend)
+    backend.start()
+    yield client, backend
+    backend.stop()
+    notifications.set_backend(previous)
+
+
+async def test_redis_fanout_delivers_through_the_channel(redis_backend):
+    client, backend = redis_backend
+    subscriber = notifications.subscribe(5)
+    try:
+        notifications.publish("deleted", 9, [5])
+        assert (await _received(subscriber))["type"] == "deleted"
+        assert any(json.loads(data).get("type") == "deleted" for channel, data in client.published)
+    finally:
+        notifications.unsubscribe(subscriber)
+
+
+async def test_redis_fanout_survives_publish_and_connection_failures(redis_backend):
+    client, backend = redis_backend
+    subscriber = notifications.subscribe(5)
+    try:
+        client.down = True
+        notifications.publish("updated", 1, [5])  # logged, the committed change still succeeds
+        client.drop_connections()
+        await asyncio.sleep(0.05)
+        client.down = False
+        await _until(lambda: client.subscriptions)
+        notifications.publish("updated", 2, [5])
+        assert (await _received(subscriber))["event_id"] == 2
+    finally:
+        notifications.unsubscribe(subscriber)
+
+
+async def test_redis_fanout_knows_whether_any_worker_listens(redis_backend):
+    client, backend = redis_backend
+    await _until(lambda: client.subscriptions)
+    assert not notifications.has_listeners()
+
+    # Another worker gains its first subscriber, then loses it
+    client.publish("event-notifications", json.dumps({"presence": "other", "listening": True}))
+    await _until(notifications.has_listeners)
+    client.publish("event-notifications", json.dumps({"presence": "other", "listening": False}))
+    await _until(lambda: not notifications.has_listeners())
+
+    # A local subscriber is announced, and answers the query of a worker that (re)connects
+    subscriber = notifications.subscribe(5)
+    notifications.unsubscribe(subscriber)
+    announcements = [json.loads(data) for _, data in client.published]
+    assert [a["listening"] for a in announcements if a.get("presence") == backend.worker_id] == [True, False]
+
+
+def test_message_ids_carry_a_per_process_prefix():
+    messages = []
+    backend = notifications.LocalFanout(notifications.broker)
+    backend.publish = messages.append
+    previous = notifications.get_backend()
+    notifications.set_backend(backend)
+    try:
+        notifications.publish("created", 1, [1])
+        notifications.publish("created", 2, [1])
+    finally:
+        notifications.set_backend(previous)
+    prefixes = {message["id"].rsplit("-", 1)[0] for message in messages}
+    assert prefixes == {notifications._id_prefix} and messages[0]["id"] != messages[1]["id"]
+
+
+async def test_close_streams_ends_open_streams():
+    subscriber = notifications.subscribe(1, maxsize=1)
+    notifications.publish("created", 1, [1])
+    await asyncio.sleep(0)
+    notifications.close_streams()
+    await asyncio.sleep(0)
+
+    chunks = [chunk async for chunk in notifications.stream(subscriber, _connected)]
+    assert _frames(chunks) == [{"event": "shutdown", "data": "{}"}]
+    assert len(notifications.broker) == 0
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from app import events, groups, models
+
+BASE = datetime(2020, 1, 1, 9)
+
+
+@pytest.fixture
+def make_session(sqlite_session):
+    return lambda grants: grant_events(sqlite_session(), grants)
+
+
+def grant_events(db, grants):
+    # User 1 holds `grants` events directly, alternating Owner and Viewer
+    db.add_all([models.User(id=1, username="member", hashed_password="unused"),
+                models.User(id=2, username="owner", hashed_password="unused")])
+    db.execute(insert(models.Event), [
+        {"id": n, "owner_id": 1, "title": f"Event {n}", "description": "", "start_time": BASE + timedelta(hours=n),
+         "end_time": BASE + timedelta(hours=n, minutes=30)} for n in range(1, grants + 1)])
+    db.execute(insert(models.EventPermission), [
+        {"event_id": n, "user_id": 1, "role": "Owner" if n % 2 else "Viewer"} for n in range(1, grants + 1)])
+    db.commit()
+    return db
+
+
+def list_page(db, **filters):
+    page, _ = events.list_events_logic(skip=0, limit=10, db=db, current_user=models.User(id=1),
+                                       columns=events.EVENT_OUT_COLUMNS, **filters)
+    return [row.id for row in page]
+
+
+def test_list_page_cost_does_not_grow_with_grants(make_session, vm_steps):
+    steps = {}
+    for grants in (200, 10000):
+        db = make_session(grants)
+        page, steps[grants] = vm_steps(db.get_bind(), lambda: list_page(db, role="Viewer"))
+        assert page == [2, 4, 6, 8, 10, 12, 14, 16, 18, 20]
+    assert steps[10000] <= 2 * steps[200]
+
+
+def test_role_filter_uses_the_strongest_grant(make_session):
+    db = make_session(4)
+    db.add_all([models.Group(id=1, name="editors", owner_id=2), models.GroupClosure(user_id=1, group_id=1),
+                models.EventGroupPermission(event_id=2, group_id=1, role="Editor"),
+                models.Event(id=5, owner_id=2, title="Group only", description="", start_time=BASE,
+                             end_time=BASE + timedelta(hours=1)),
+                models.EventGroupPermission(event_id=5, group_id=1, role="Viewer")])
+    db.commit()
+    assert list_page(db, role="Viewer") == [5, 4]
+    assert list_page(db, role="Editor") == [2]
+    assert list_page(db) == [5, 1, 2, 3, 4]
+
+
+def test_parents_walks_up_from_the_given_groups_only(make_session):
+    db = make_session(0)
+    db.add_all([models.Group(id=n, name=f"group {n}", owner_id=2) for n in range(1, 6)])
+    db.add_all([models.GroupNesting(parent_id=1, child_id=2), models.GroupNesting(parent_id=2, child_id=3),
+                models.GroupNesting(parent_id=4, child_id=5)])
+    db.commit()
+    assert groups._parents(db, [3]) == {3: [2], 2: [1]}
+    assert groups._ancestors([3], groups._parents(db, [3])) == {1, 2, 3}
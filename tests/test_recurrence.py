@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from app import recurrence
+
+
+def occurrences(pattern, start, window_start=None, window_end=None, hours=1):
+    rule = recurrence.parse_rule(pattern)
+    return [s for s, _ in recurrence.iter_occurrences(start, start + timedelta(hours=hours), rule,
+                                                      window_start, window_end)]
+
+
+def test_parse_rule():
+    rule = recurrence.parse_rule("RRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=WE,MO;COUNT=4")
+    assert rule == {"freq": "WEEKLY", "interval": 2, "count": 4, "until": None, "byday": [0, 2]}
+    assert recurrence.parse_rule("daily")["freq"] == "DAILY"
+    assert recurrence.parse_rule("string") is None
+    assert recurrence.parse_rule("FREQ=HOURLY") is None
+
+
+def test_weekly_byday_with_count():
+    start = datetime(2025, 1, 1, 9)  # a Wednesday
+    assert occurrences("FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE;COUNT=4", start) == [
+        datetime(2025, 1, 1, 9), datetime(2025, 1, 13, 9), datetime(2025, 1, 15, 9), datetime(2025, 1, 27, 9)]
+
+
+def test_monthly_skips_short_months_and_honours_until():
+    start = datetime(2025, 1, 31, 9)
+    assert occurrences("FREQ=MONTHLY;UNTIL=20250601", start) == [
+        datetime(2025, 1, 31, 9), datetime(2025, 3, 31, 9), datetime(2025, 5, 31, 9)]
+
+
+def test_window_is_applied_lazily():
+    start = datetime(2020, 1, 1, 9)
+    window = occurrences("FREQ=DAILY", start, datetime(2025, 1, 1), datetime(2025, 1, 4))
+    assert window == [datetime(2025, 1, 1, 9), datetime(2025, 1, 2, 9), datetime(2025, 1, 3, 9)]
+
+
+def test_plan_bounds_unending_rules_by_the_horizon():
+    now = datetime(2025, 1, 1)
+    start = datetime(2025, 1, 1, 9)
+    rows, covered_from, covered_until = recurrence.plan(
+        start, start + timedelta(hours=1), recurrence.parse_rule("FREQ=DAILY"), now)
+    assert len(rows) == recurrence.RECURRENCE_HORIZON_DAYS
+    assert (covered_from, covered_until) == (start, now + timedelta(days=recurrence.RECURRENCE_HORIZON_DAYS))
+
+    rows, covered_from, covered_until = recurrence.plan(
+        start, start + timedelta(hours=1), recurrence.parse_rule("FREQ=DAILY;COUNT=3"), now)
+    assert len(rows) == 3
+    assert covered_from is None and covered_until is None
+
+
+def test_out_of_range_rules_are_rejected():
+    assert recurrence.parse_rule("FREQ=YEARLY;INTERVAL=9000") is None
+    assert recurrence.parse_rule("FREQ=DAILY;INTERVAL=5000000") is None
+    assert recurrence.parse_rule("FREQ=DAILY;COUNT=0") is None
+    assert recurrence.parse_rule(f"FREQ=DAILY;COUNT={recurrence.RECURRENCE_MAX_COUNT + 1}") is None
+
+
+def test_iteration_ends_at_datetime_max():
+    start = datetime(2025, 1, 1, 9)
+    assert occurrences(f"FREQ=YEARLY;INTERVAL={recurrence.RECURRENCE_MAX_INTERVAL}", start)[-1] == \
+        datetime(9025, 1, 1, 9)
+    last = occurrences(f"FREQ=DAILY;INTERVAL={recurrence.RECURRENCE_MAX_INTERVAL}", start)[-1]
+    assert last > datetime.max - timedelta(days=recurrence.RECURRENCE_MAX_INTERVAL)
+    assert occurrences("FREQ=WEEKLY;BYDAY=MO,FR", datetime(9999, 12, 20, 9), hours=48) == [
+        datetime(9999, 12, 20, 9), datetime(9999, 12, 24, 9), datetime(9999, 12, 27, 9)]
+
+    # A rule far in the past still plans without raising
+    rows, _, _ = recurrence.plan(datetime(1, 1, 1, 9), datetime(1, 1, 1, 10), recurrence.parse_rule(
+        f"FREQ=MONTHLY;INTERVAL={recurrence.RECURRENCE_MAX_INTERVAL}"), datetime(2025, 1, 1))
+    assert rows == []
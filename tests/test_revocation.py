@@ -0,0 +1,45 @@
+from app import token_utils
+from app.revocation import BloomFilter, RevocationList
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(bits=4096, hashes=5)
+    keys = [f"session-{i}" for i in range(200)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other-{i}" in bloom for i in range(1000))
+    assert false_positives < 100
+
+
+def test_revocation_expires_and_filter_is_rebuilt():
+    clock = FakeClock()
+    revoked = RevocationList(bits=4096, hashes=5, prune_interval=10, clock=clock)
+    revoked.revoke("sid-1", expires_at=clock.now + 5)
+    assert revoked.is_revoked("sid-1")
+    assert not revoked.is_revoked("sid-2")
+    assert revoked.bloom_negatives == 1
+
+    clock.now += 20
+    assert not revoked.is_revoked("sid-1")
+    assert len(revoked) == 0
+    assert "sid-1" not in revoked._bloom
+
+
+def test_verify_access_token_memoizes_and_honours_revocation():
+    sid = token_utils.new_session_id()
+    token = token_utils.create_token({"sub": "someone", "sid": sid}, 5, token_utils.SECRET_KEY)
+    assert token_utils.verify_access_token(token)["sub"] == "someone"
+    assert token_utils.verify_access_token(token) is token_utils._verified_tokens.get(token)
+
+    token_utils.revoke_session(sid)
+    assert token_utils.verify_access_token(token) is None
+    assert token_utils.verify_access_token("not-a-token") is None
@@ -0,0 +1,82 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from app import models, recurrence, scheduling
+from app.scheduling import IntervalTree, merge_intervals
+
+BASE = datetime(2020, 1, 1, 9)
+
+
+@pytest.fixture
+def make_calendar(sqlite_session):
+    return lambda days: add_calendar(sqlite_session(), days)
+
+
+def add_calendar(db, days):
+    # A daily event with `days` materialized occurrences, a month-long event that
+    # overlaps the last day, and a long event that only starts after it
+    db.add(models.User(id=1, username="scheduler", hashed_password="unused"))
+    last_day = BASE + timedelta(days=days - 1)
+    spans = {1: [(BASE + timedelta(days=n), BASE + timedelta(days=n, hours=1)) for n in range(days)],
+             2: [(last_day - timedelta(days=20), last_day + timedelta(days=10))],
+             3: [(last_day + timedelta(days=5), last_day + timedelta(days=40))]}
+    for event_id, occurrences in spans.items():
+        db.add(models.Event(id=event_id, owner_id=1, title=f"Event {event_id}", description="",
+                            start_time=occurrences[0][0], end_time=occurrences[0][1]))
+        db.add(models.EventPermission(event_id=event_id, user_id=1, role="Owner"))
+        db.flush()
+        db.execute(insert(models.EventOccurrence), recurrence.occurrence_rows(event_id, occurrences))
+    db.commit()
+    return db
+
+
+def test_interval_tree_matches_brute_force():
+    rng = random.Random(7)
+    intervals = []
+    for i in range(500):
+        start = rng.randint(0, 10000)
+        intervals.append((start, start + rng.randint(1, 300), i))
+    tree = IntervalTree(intervals)
+
+    for _ in range(200):
+        start = rng.randint(0, 10000)
+        end = start + rng.randint(1, 500)
+        expected = {i for s, e, i in intervals if s < end and e > start}
+        assert {i for _, _, i in tree.overlapping(start, end)} == expected
+
+
+def test_interval_tree_treats_touching_intervals_as_free():
+    tree = IntervalTree([(0, 10, "a"), (10, 20, "b")])
+    assert [p for _, _, p in tree.overlapping(10, 15)] == ["b"]
+    assert list(IntervalTree([]).overlapping(0, 1)) == []
+
+
+def test_merge_intervals():
+    assert merge_intervals([(5, 7), (1, 3), (2, 4), (7, 8)]) == [
+        {"start_time": 1, "end_time": 4}, {"start_time": 5, "end_time": 8}]
+
+
+def test_window_scan_does_not_grow_with_calendar_history(make_calendar, vm_steps):
+    steps = {}
+    for days in (200, 10000):
+        db = make_calendar(days)
+        window_start = BASE + timedelta(days=days - 1, hours=-9)
+        rows, steps[days] = vm_steps(db.get_bind(), lambda: recurrence.query_window(
+            db, 1, window_start, window_start + timedelta(days=1)))
+        assert [row["event_id"] for row in rows] == [2, 1]
+        assert rows[1]["start_time"] == BASE + timedelta(days=days - 1)
+    assert steps[10000] <= 2 * steps[200]
+
+
+def test_free_busy_is_visible_within_shared_groups(make_calendar):
+    db = make_calendar(1)
+    db.add_all([models.User(id=2, username="teammate", hashed_password="unused"),
+                models.User(id=3, username="outsider", hashed_password="unused"),
+                models.Group(id=1, name="team", owner_id=1),
+                models.GroupClosure(user_id=1, group_id=1), models.GroupClosure(user_id=2, group_id=1)])
+    db.commit()
+    assert scheduling.visible_calendars(db, 1, [1, 2, 3]) == {1, 2}
+    assert scheduling.visible_calendars(db, 3, [1, 2, 3]) == {3}
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import schemas, serialization
+
+ROWS = [
+    {"id": 1, "owner_id": 2, "title": "Planning", "description": "Café ☕", "location": None,
+     "start_time": datetime(2025, 1, 1, 9), "end_time": datetime(2025, 1, 1, 10, 0, 0, 500),
+     "is_recurring": "1", "recurrence_pattern": "FREQ=WEEKLY"},
+    {"id": 2, "owner_id": 2, "title": "Review", "description": "", "location": "Room 1",
+     "start_time": datetime(2025, 1, 2, 9, tzinfo=timezone.utc),
+     "end_time": datetime(2025, 1, 2, 10, tzinfo=timezone(timedelta(hours=5, minutes=30))),
+     "is_recurring": "false", "recurrence_pattern": None},
+    {"id": 3, "owner_id": 1, "title": "Batch", "description": "d", "location": None,
+     "start_time": datetime(2025, 1, 3, 9), "end_time": datetime(2025, 1, 3, 10),
+     "is_recurring": False, "recurrence_pattern": None},
+]
+
+
+def _pydantic_bytes(rows):
+    return b"[" + b",".join(schemas.EventOut.model_validate(row).model_dump_json().encode() for row in rows) + b"]"
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_fast_path_matches_event_out_wire_format(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(serialization, "orjson", None)
+    elif serialization.orjson is None:
+        pytest.skip("orjson is not installed")
+    assert serialization.dump_events(ROWS) == _pydantic_bytes(ROWS)
+    assert serialization.dump_events([]) == b"[]"
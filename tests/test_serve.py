@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from app import hashing, invalidation, serve
+
+
+def test_several_workers_need_a_shared_invalidation_channel(monkeypatch):
+    monkeypatch.setattr(invalidation, "INVALIDATION_REDIS_URL", None)
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    monkeypatch.setattr(serve, "available_cpus", lambda: 8)
+    assert serve.default_workers() == 1
+    monkeypatch.setattr("sys.argv", ["app.serve", "--workers", "2"])
+    with pytest.raises(SystemExit):
+        serve.main()
+
+    monkeypatch.setattr(invalidation, "INVALIDATION_REDIS_URL", "redis://cache")
+    assert serve.default_workers() == 8
+
+
+def test_hash_pool_is_split_between_workers(monkeypatch):
+    monkeypatch.setattr(serve, "available_cpus", lambda: 8)
+    monkeypatch.setattr(hashing, "PASSWORD_HASH_WORKERS", hashing.PASSWORD_HASH_WORKERS)
+    environ = {key: value for key, value in os.environ.items() if key != "PASSWORD_HASH_WORKERS"}
+    monkeypatch.setattr(os, "environ", environ)
+    assert serve.configure_hash_workers(3) == 2
+    assert environ["PASSWORD_HASH_WORKERS"] == "2"
+    assert serve.configure_hash_workers(16) == 2  # already set, inherited by the workers as is
+
+    del environ["PASSWORD_HASH_WORKERS"]
+    assert serve.configure_hash_workers(16) == 1